@@ -3,47 +3,138 @@
 charts.py
 Generates charts from summary.py (aggregated stats)
 and from PostgreSQL (historical series).
+
+Runs as a pipeline:
+  1. load       one time-bounded query on the hourly rollup, downsampled in
+                the database to one close per coin and --step-hours bucket
+  2. transform  vectorized per-coin normalization; the plotted series is
+                thinned with LTTB to --points per coin. Sharpe ratios and the
+                correlation matrix are read from the metrics_* tables
+                (src/analytics.py), not recomputed
+  3. render     every chart drawn in parallel in a process pool
+Each stage prints its wall time. --backend local runs the load stage on the
+local Parquet store (src/localstore.py) instead of PostgreSQL, and computes
+the metrics from its daily closes with the same analytics functions.
+--currency quotes the price series in another currency (src/fx.py): the
+EUR series is converted with an as-of join on the stored FX rates.
+pandas, pyarrow and SQLAlchemy are imported once the arguments are parsed,
+matplotlib by the render stage only, and nothing connects to the database
+before the load stage.
 """
 
-import pandas as pd
-import matplotlib
-matplotlib.use("Agg")  # non-interactive backend
-import matplotlib.pyplot as plt
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import pathlib
 import sys
-from sqlalchemy import create_engine
 
 # Paths
 BASE_DIR = pathlib.Path(__file__).resolve().parents[1]
 STATS_FILE = BASE_DIR / "analysis" / "summary_stats.csv"
 PLOT_DIR = BASE_DIR / "analysis" / "plots"
-PLOT_DIR.mkdir(parents=True, exist_ok=True)
-
-# PostgreSQL connection config
-DB_USER = "ricardo"
-DB_PASS = "crypto"
-DB_HOST = "localhost"
-DB_PORT = "5432"
-DB_NAME = "crypto"
-
-engine = create_engine(f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
 
-# --- Time series chart ---
-def plot_price_evolution():
+sys.path.insert(0, str(BASE_DIR / "src"))
+import config  # noqa: E402
+
+def pyplot():
+    """matplotlib.pyplot on the non-interactive backend, imported on first use."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+@contextlib.contextmanager
+def timed(stage):
+    t0 = time.perf_counter()
+    yield
+    print(f"[{stage}] {time.perf_counter() - t0:.2f}s")
+
+# --- Load ---
+def load_prices(since=None, coins=None, step_hours=6):
+    """
+    Last close per coin and `step_hours` bucket from market_history_hourly,
+    optionally limited to ts >= since and to the given coins.
+    """
+    import pandas as pd
+    from sqlalchemy import text
+
+    import frames
+    from db import get_engine
+
+    where, params = [], {"step": step_hours}
+    if since is not None:
+        where.append("bucket >= :since")
+        params["since"] = pd.Timestamp(since).tz_localize(None).to_pydatetime()
+    if coins:
+        where.append("coin_id = ANY(:coins)")
+        params["coins"] = list(coins)
+    query = f"""
+        SELECT coin_id,
+               date_trunc('day', bucket)
+                 + floor(extract(hour FROM bucket) / :step) * :step * INTERVAL '1 hour' AS ts,
+               (array_agg(close ORDER BY bucket DESC))[1] AS price_eur
+        FROM market_history_hourly
+        {"WHERE " + " AND ".join(where) if where else ""}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """
+    with get_engine().connect() as conn:
+        return frames.read_sql(text(query), conn, params)
+
+def load_prices_local(since=None, coins=None, step_hours=6):
+    """load_prices() from the local store: last price per coin and `step_hours` bucket."""
+    import localstore
+
+    df = localstore.read_history(coins, since, None, columns=["price_eur"])
+    df = df.sort_values(["coin_id", "ts"], ignore_index=True)
+    df["ts"] = df["ts"].dt.floor(f"{step_hours}h")
+    return df.groupby(["coin_id", "ts"], as_index=False, observed=True)["price_eur"].last()
+
+def load_rates(currency, since=None, backend="postgres"):
+    """FX rates of `currency` from `since` on (empty for the base currency)."""
+    import pandas as pd
+
+    import fx
+    from db import get_engine
+
+    if currency == fx.BASE_CURRENCY:
+        return fx.empty_rates()
+    if backend == "local":
+        return fx.read_rates_local([currency])
+    with get_engine().connect() as conn:
+        return fx.read_rates(conn, [currency], pd.Timestamp(since).to_pydatetime() if since else None)
+
+# --- Transform ---
+def normalized_prices(df):
+    """Price relative to each coin's first point in the window (100 = start)."""
+    first = df.groupby("coin_id", observed=True)["price_eur"].transform("first")
+    return df.assign(norm_price=df["price_eur"] / first * 100)
+
+def load_metrics(coins=None):
+    """(Sharpe ratios, correlation matrix) materialized by analytics.py."""
+    import analytics
+    from db import get_engine
+
+    with get_engine().connect() as conn:
+        return analytics.read_sharpe(conn, coins), analytics.read_correlation(conn, coins)
+
+def local_metrics(df):
+    """load_metrics() computed from the daily closes of the loaded series."""
+    import analytics
+
+    daily = df.groupby(["coin_id", df["ts"].dt.floor("D")], observed=True)["price_eur"].last().reset_index()
+    return analytics.local_metrics(daily)
+
+# --- Render (each runs in a worker process) ---
+def plot_price_evolution(df, path):
     """Normalized price evolution (100 = initial value)"""
-    query = "SELECT coin_id, ts, price_eur FROM market_history"
-    df = pd.read_sql(query, engine)
-
-    # Convert to datetime
-    df["ts"] = pd.to_datetime(df["ts"], utc=True, errors="coerce")
-    df = df.dropna(subset=["ts"])
-
+    plt = pyplot()
     plt.figure(figsize=(10,6))
-    for coin_id, group in df.groupby("coin_id"):
-        group = group.sort_values("ts")
-        group = group.iloc[::6]  # sampling: 1 of every 6 points (~4 per day)
-        norm_price = group["price_eur"] / group["price_eur"].iloc[0] * 100
-        plt.plot(group["ts"], norm_price, label=coin_id)
+    for coin_id, group in df.groupby("coin_id", observed=True):
+        plt.plot(group["ts"], group["norm_price"], label=coin_id)
 
     plt.title("Normalized Price Evolution (100 = start)")
     plt.xlabel("Date")
@@ -51,60 +142,95 @@ def plot_price_evolution():
     plt.legend()
     plt.grid(True, alpha=0.3)
     plt.tight_layout()
-    plt.savefig(PLOT_DIR / "price_evolution.png")
+    plt.savefig(path)
     plt.close("all")
 
-# --- Sharpe Ratio chart ---
-def plot_sharpe_ratio():
+def plot_sharpe_ratio(sr_df, path):
     """Sharpe Ratio per coin (based on daily returns)"""
-    query = "SELECT coin_id, ts, price_eur FROM market_history"
-    df = pd.read_sql(query, engine)
-
-    df["ts"] = pd.to_datetime(df["ts"], utc=True, errors="coerce")
-    df = df.dropna(subset=["ts"])
-    df = df.sort_values(["coin_id", "ts"])
-
-    sharpes = {}
-    for coin_id, group in df.groupby("coin_id"):
-        group = group.sort_values("ts")
-        group["return"] = group["price_eur"].pct_change()
-        mean_ret = group["return"].mean()
-        std_ret = group["return"].std()
-        TRADING_DAYS = 365  # crypto trades every day
-
-        if std_ret and std_ret > 0:
-            daily_sharpe = mean_ret / std_ret
-            sharpes[coin_id] = daily_sharpe * (TRADING_DAYS ** 0.5)
-        else:
-            sharpes[coin_id] = 0.0
-
-    sr_df = pd.DataFrame.from_dict(sharpes, orient="index", columns=["sharpe"])
-
+    plt = pyplot()
     sr_df["sharpe"].plot(kind="bar", figsize=(8,6), rot=45)
     plt.title("Sharpe Ratio per coin (daily returns)")
     plt.ylabel("Sharpe Ratio")
     plt.tight_layout()
-    plt.savefig(PLOT_DIR / "sharpe_ratio.png")
+    plt.savefig(path)
     plt.close("all")
 
-# --- Volatility chart ---
-def plot_volatility(stats):
+def plot_correlation(corr, path):
+    """Correlation matrix of daily log returns"""
+    from analytics import CORR_WINDOW
+
+    plt = pyplot()
+    fig, ax = plt.subplots(figsize=(8,7))
+    im = ax.imshow(corr.to_numpy(), vmin=-1, vmax=1, cmap="RdBu_r")
+    ax.set_xticks(range(len(corr.columns)), corr.columns, rotation=90)
+    ax.set_yticks(range(len(corr.index)), corr.index)
+    fig.colorbar(im, ax=ax)
+    ax.set_title(f"Correlation of daily log returns (last {CORR_WINDOW} days)")
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close("all")
+
+def plot_volatility(stats, path):
     """Relative volatility (%) per coin"""
+    plt = pyplot()
     stats["rel_volatility_pct"].plot(kind="bar", figsize=(8,6), rot=45)
     plt.title("Relative Volatility (%)")
     plt.ylabel("% Volatility")
     plt.tight_layout()
-    plt.savefig(PLOT_DIR / "rel_volatility.png")
+    plt.savefig(path)
     plt.close("all")
 
-def main():
-    # Load summary stats
-    stats = pd.read_csv(STATS_FILE, index_col="coin_id")
-
-    # Generate charts
-    plot_price_evolution()   # PostgreSQL
-    plot_sharpe_ratio()      # PostgreSQL
-    plot_volatility(stats)   # CSV
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Render analysis charts")
+    ap.add_argument("--since", help="only history from this date on (YYYY-MM-DD)")
+    ap.add_argument("--coins", help="comma-separated coin_ids (default: all)")
+    ap.add_argument("--step-hours", type=int, default=6,
+                    help="downsampling step for the price series (default: 6, ~4 points per day)")
+    ap.add_argument("--points", type=int,
+                    help="points per coin in the price evolution chart (default: fits a 1000 px wide chart)")
+    ap.add_argument("--backend", choices=config.ANALYSIS_BACKENDS, default=config.ANALYSIS_BACKEND,
+                    help="postgres (default) or the local Parquet store")
+    ap.add_argument("--currency", default=config.BASE_CURRENCY,
+                    help="quote currency of the price series (default: eur; others need stored FX rates)")
+    ap.add_argument("--workers", type=int, default=min(3, os.cpu_count() or 1))
+    args = ap.parse_args(argv)
+
+    import pandas as pd
+
+    import fx
+    from downsample import lttb_frame, target_points
+
+    args.points = args.points or target_points(1000)
+    coins = [c.strip() for c in args.coins.split(",") if c.strip()] if args.coins else None
+
+    with timed("load"):
+        load = load_prices_local if args.backend == "local" else load_prices
+        df = load(args.since, coins, args.step_hours)
+        if args.currency != fx.BASE_CURRENCY:
+            df = fx.convert(df, load_rates(args.currency, args.since, args.backend), args.currency)
+        df["ts"] = pd.to_datetime(df["ts"], utc=True)
+        # Load summary stats
+        stats = pd.read_csv(STATS_FILE, index_col="coin_id")
+        if coins:
+            stats = stats.loc[stats.index.intersection(coins)]
+    print(f"Loaded {len(df)} points for {df['coin_id'].nunique()} coins")
+
+    with timed("transform"):
+        prices = lttb_frame(normalized_prices(df), args.points, y="norm_price")
+        sharpes, corr = local_metrics(df) if args.backend == "local" else load_metrics(coins)
+
+    with timed("render"):
+        pyplot()  # imported once here, inherited by forked workers
+        PLOT_DIR.mkdir(parents=True, exist_ok=True)
+        jobs = [
+            (plot_price_evolution, prices, PLOT_DIR / "price_evolution.png"),  # PostgreSQL
+            (plot_sharpe_ratio, sharpes, PLOT_DIR / "sharpe_ratio.png"),       # metrics_sharpe
+            (plot_correlation, corr, PLOT_DIR / "correlation.png"),            # metrics_correlation
+            (plot_volatility, stats, PLOT_DIR / "rel_volatility.png"),         # CSV
+        ]
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for fut in [pool.submit(fn, data, path) for fn, data, path in jobs]:
+                fut.result()
 
     print(f"Charts saved in: {PLOT_DIR}")
     return 0
@@ -3,50 +3,122 @@
 Exploratory analysis of the PostgreSQL crypto database.
 Computes descriptive statistics per coin (mean, variance, stddev, growth, time range).
 Includes relative volatility (coefficient of variation).
+
+Aggregation runs in the database. Per-coin running statistics are kept in the
+price_stats table (count, mean and M2 in Welford form); by default only the
+market_history rows newer than each coin's last_ts are folded in, through the
+(coin_id, ts) index, so a refresh costs the same however large the history is.
+Rows are folded only up to the coin's load watermark, and last_ts is that
+watermark: ticks written by src/stream.py ahead of it wait until the batch load
+has filled the hours before them. --full recomputes every coin with a single
+GROUP BY (e.g. after --fill-gaps backfilled older points).
+
+With --backend local the same statistics are computed from the local Parquet
+store (src/localstore.py) with a pyarrow hash aggregation, without PostgreSQL.
+pandas, pyarrow and SQLAlchemy are imported once the arguments are parsed.
 """
 
-import pandas as pd
+import argparse
 import pathlib
-from sqlalchemy import create_engine
+import sys
 
 # Paths
 BASE_DIR = pathlib.Path(__file__).resolve().parents[1]
 OUT_FILE = BASE_DIR / "analysis" / "summary_stats.csv"
 
-# PostgreSQL connection config
-DB_USER = "ricardo"
-DB_PASS = "crypto"
-DB_HOST = "localhost"
-DB_PORT = "5432"
-DB_NAME = "crypto"
+sys.path.insert(0, str(BASE_DIR / "src"))
+import config  # noqa: E402
+
+# Aggregate of one batch of rows per coin, in the same shape as price_stats.
+# VAR_POP * n is the batch's own M2.
+BATCH_AGG = """
+    COUNT(h.price_eur) AS n, AVG(h.price_eur) AS mean,
+    COALESCE(VAR_POP(h.price_eur) * COUNT(h.price_eur), 0) AS m2,
+    MIN(h.price_eur) AS min_price, MAX(h.price_eur) AS max_price,
+    MIN(h.ts) AS start_date, MAX(h.ts) AS end_date
+"""
 
-engine = create_engine(f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+FULL_REFRESH = f"""
+    INSERT INTO price_stats AS s
+        (coin_id, n, mean, m2, min_price, max_price, start_date, end_date, last_ts, updated_at)
+    SELECT h.coin_id, {BATCH_AGG}, w.max_ts, now()
+    FROM market_history h
+    JOIN load_watermarks w ON w.coin_id = h.coin_id AND h.ts <= w.max_ts
+    GROUP BY h.coin_id, w.max_ts
+    ON CONFLICT (coin_id) DO UPDATE SET
+        n = EXCLUDED.n, mean = EXCLUDED.mean, m2 = EXCLUDED.m2,
+        min_price = EXCLUDED.min_price, max_price = EXCLUDED.max_price,
+        start_date = EXCLUDED.start_date, end_date = EXCLUDED.end_date,
+        last_ts = EXCLUDED.last_ts, updated_at = EXCLUDED.updated_at
+"""
+
+# Only coins whose load watermark moved past last_ts are visited; for each,
+# the LATERAL subquery is a range scan of the (coin_id, ts) key over
+# (last_ts, watermark]. Streamed ticks past the watermark are left for later:
+# folding them would move last_ts past the hours the batch load has yet to fill.
+INCREMENTAL_REFRESH = f"""
+    INSERT INTO price_stats AS s
+        (coin_id, n, mean, m2, min_price, max_price, start_date, end_date, last_ts, updated_at)
+    SELECT w.coin_id, d.n, d.mean, d.m2, d.min_price, d.max_price,
+           d.start_date, d.end_date, w.max_ts, now()
+    FROM load_watermarks w
+    LEFT JOIN price_stats p ON p.coin_id = w.coin_id
+    CROSS JOIN LATERAL (
+        SELECT {BATCH_AGG}
+        FROM market_history h
+        WHERE h.coin_id = w.coin_id AND h.ts > COALESCE(p.last_ts, '-infinity') AND h.ts <= w.max_ts
+    ) d
+    WHERE (p.last_ts IS NULL OR w.max_ts > p.last_ts) AND d.end_date IS NOT NULL
+    ON CONFLICT (coin_id) DO UPDATE SET
+        n = s.n + EXCLUDED.n,
+        mean = CASE WHEN s.n + EXCLUDED.n = 0 THEN NULL
+                    ELSE COALESCE(s.mean, 0) + (COALESCE(EXCLUDED.mean, 0) - COALESCE(s.mean, 0))
+                         * EXCLUDED.n / (s.n + EXCLUDED.n) END,
+        m2 = CASE WHEN s.n + EXCLUDED.n = 0 THEN 0
+                  ELSE COALESCE(s.m2, 0) + EXCLUDED.m2
+                       + (COALESCE(EXCLUDED.mean, 0) - COALESCE(s.mean, 0)) ^ 2
+                         * s.n * EXCLUDED.n / (s.n + EXCLUDED.n) END,
+        min_price = LEAST(s.min_price, EXCLUDED.min_price),
+        max_price = GREATEST(s.max_price, EXCLUDED.max_price),
+        start_date = LEAST(s.start_date, EXCLUDED.start_date),
+        end_date = GREATEST(s.end_date, EXCLUDED.end_date),
+        last_ts = GREATEST(s.last_ts, EXCLUDED.last_ts),
+        updated_at = EXCLUDED.updated_at
+"""
 
-def main():
-    # Load historical data into pandas
-    query = "SELECT coin_id, ts, price_eur FROM market_history"
-    df = pd.read_sql(query, engine)
+def refresh_stats(conn, full=False):
+    """Bring price_stats up to date. Returns the number of coins touched."""
+    from sqlalchemy import text
 
-    # Calculate metrics per coin
-    stats = df.groupby("coin_id")["price_eur"].agg(
-        avg_price="mean",
-        variance="var",
-        stddev="std",
-        min_price="min",
-        max_price="max"
-    )
+    return conn.execute(text(FULL_REFRESH if full else INCREMENTAL_REFRESH)).rowcount
 
-    # Percentage growth
-    stats["pct_growth"] = (stats["max_price"] - stats["min_price"]) / stats["min_price"] * 100
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Per-coin price statistics")
+    ap.add_argument("--full", action="store_true",
+                    help="recompute every coin from market_history instead of folding in new rows")
+    ap.add_argument("--backend", choices=config.ANALYSIS_BACKENDS, default=config.ANALYSIS_BACKEND,
+                    help="postgres (default) or the local Parquet store")
+    args = ap.parse_args(argv)
 
-    # Relative volatility (coefficient of variation)
-    stats["rel_volatility_pct"] = (stats["stddev"] / stats["avg_price"]) * 100
+    import analytics
+    import localstore
 
-    # Time range
-    ranges = df.groupby("coin_id")["ts"].agg(start_date="min", end_date="max")
+    if args.backend == "local":
+        result = analytics.local_price_stats()
+        print(f"Computed statistics for {len(result)} coins from {localstore.LOCAL_DIR}")
+    else:
+        from db import get_engine
+        from load import bump_load_version
+        from migrate import upgrade
 
-    # Merge metrics and ranges
-    result = stats.join(ranges)
+        with get_engine().begin() as conn:
+            upgrade(conn)
+            touched = refresh_stats(conn, args.full)
+            if touched:
+                # price_stats is served through caches keyed on the load version (src/readapi.py)
+                bump_load_version(conn)
+            result = analytics.read_price_stats(conn)
+        print(f"Refreshed statistics for {touched} coins ({'full' if args.full else 'incremental'})")
 
     # Show in console
     print("\n=== Statistics per coin ===")
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+backup.py
+Incremental backups of data/ and of the PostgreSQL database, with restore
+verification.
+
+data/ → backup/data/
+    Content-addressed store: every file is split into CHUNK_SIZE chunks named
+    by their SHA-256 (chunks/ab/abcd..., zlib-compressed) and each backup is
+    a snapshot manifest (snapshots/<id>.json) listing the chunks of every
+    file. Only chunks not already stored are written, so unchanged files,
+    hard-linked copies (data/local/) and the untouched prefix of appended
+    files cost nothing. Files whose size and mtime match the previous
+    snapshot are not even read. data/ itself is never modified.
+
+PostgreSQL → backup/db/
+    full_<ts>/          pg_dump directory format, dumped in parallel (-j) and
+                        compressed with zstd (gzip before PostgreSQL 16). The
+                        rows of the market_history partitions are excluded.
+    partitions/<p>.dump one data-only dump per market_history partition,
+                        re-exported only when the partition changed since its
+                        last export (the per-partition change counter kept
+                        by load.py plus relfilenode, tracked in
+                        catalog.json). Past months are exported once, so
+                        nightly dumps only carry the current month.
+
+verify restores the latest data snapshot into a temporary directory and
+checks every file's hash, and reads every database archive end to end with
+pg_restore. --scratch-db NAME also restores the database into NAME and
+compares the row counts of unchanged partitions with the source.
+
+Usage:
+    python backup/backup.py data
+    python backup/backup.py db --jobs 4
+    python backup/backup.py verify [--scratch-db crypto_verify]
+    python backup/backup.py restore-data [SNAPSHOT] DEST
+    python backup/backup.py restore-db TARGET_DB
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+PROJECT_DIR = pathlib.Path(__file__).resolve().parents[1]
+DATA_DIR = PROJECT_DIR / "data"
+DATA_BACKUP_DIR = PROJECT_DIR / "backup" / "data"
+CHUNKS_DIR = DATA_BACKUP_DIR / "chunks"
+SNAPSHOTS_DIR = DATA_BACKUP_DIR / "snapshots"
+DB_BACKUP_DIR = PROJECT_DIR / "backup" / "db"
+PARTITIONS_DIR = DB_BACKUP_DIR / "partitions"
+CATALOG_FILE = DB_BACKUP_DIR / "catalog.json"
+
+sys.path.insert(0, str(PROJECT_DIR / "src"))
+import config  # noqa: E402
+
+DB_NAME = config.PGDATABASE
+
+CHUNK_SIZE = config.BACKUP_CHUNK_MB * 1024 * 1024
+WORKERS = config.BACKUP_WORKERS
+KEEP = config.BACKUP_KEEP  # snapshots / full dumps kept
+
+# Scratch files of running writers, never worth backing up
+SKIP = re.compile(r"(^|/)(\.staging|\.tmp-[^/]*|[^/]*\.rebuild)(/|$)")
+
+
+def now_id():
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def write_json(path, obj):
+    """Atomic JSON write (temp file + rename)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(".tmp-" + path.name)
+    tmp.write_text(json.dumps(obj, indent=1), encoding="utf-8")
+    tmp.replace(path)
+
+
+# --- data/: content-addressed chunk store ---
+def chunk_path(digest):
+    return CHUNKS_DIR / digest[:2] / digest
+
+
+def store_chunk(data, digest):
+    """Write one chunk unless the store already has it. Returns the bytes written."""
+    path = chunk_path(digest)
+    if path.exists():
+        return 0
+    body = zlib.compress(data, 1)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".tmp-{digest}-{os.getpid()}-{id(data)}")
+    tmp.write_bytes(body)
+    tmp.replace(path)
+    return len(body)
+
+
+def backup_file(path):
+    """Chunk, hash and store one file: (entry, bytes read, bytes stored)."""
+    st = path.stat()
+    whole = hashlib.sha256()
+    chunks, stored = [], 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            whole.update(data)
+            digest = hashlib.sha256(data).hexdigest()
+            stored += store_chunk(data, digest)
+            chunks.append(digest)
+    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": whole.hexdigest(), "chunks": chunks}
+    return entry, st.st_size, stored
+
+
+def list_snapshots():
+    return sorted(SNAPSHOTS_DIR.glob("*.json"))
+
+
+def read_snapshot(name=None):
+    snaps = list_snapshots()
+    if not snaps:
+        raise FileNotFoundError(f"No data snapshots in {SNAPSHOTS_DIR}")
+    path = snaps[-1] if name is None else SNAPSHOTS_DIR / f"{pathlib.Path(name).stem}.json"
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def backup_data(keep=KEEP, workers=WORKERS):
+    """Take an incremental snapshot of data/. Returns the snapshot manifest."""
+    t0 = time.perf_counter()
+    previous = read_snapshot()["files"] if list_snapshots() else {}
+    files, todo = {}, {}
+    for path in sorted(p for p in DATA_DIR.rglob("*") if p.is_file()) if DATA_DIR.exists() else []:
+        rel = path.relative_to(DATA_DIR).as_posix()
+        if SKIP.search(rel):
+            continue
+        st = path.stat()
+        old = previous.get(rel)
+        if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+            files[rel] = old
+        else:
+            # Hard links (the local store mirrors data/processed/) are read once
+            todo.setdefault((st.st_dev, st.st_ino), []).append(rel)
+
+    read = stored = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for rels, (entry, n_read, n_stored) in zip(
+                todo.values(), pool.map(lambda rels: backup_file(DATA_DIR / rels[0]), todo.values())):
+            files.update(dict.fromkeys(rels, entry))
+            read += n_read
+            stored += n_stored
+
+    snap_id = now_id()
+    while (SNAPSHOTS_DIR / f"{snap_id}.json").exists():
+        snap_id += "_"
+    snap = {
+        "snapshot": snap_id,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "files": dict(sorted(files.items())),
+        "stats": {"files": len(files), "files_read": sum(map(len, todo.values())), "bytes_total": sum(e["size"] for e in files.values()),
+                  "bytes_read": read, "bytes_stored": stored, "seconds": round(time.perf_counter() - t0, 2)},
+    }
+    write_json(SNAPSHOTS_DIR / f"{snap['snapshot']}.json", snap)
+    s = snap["stats"]
+    print(f"Data snapshot {snap['snapshot']}: {s['files']} files ({s['bytes_total']:,} bytes), "
+          f"{s['files_read']} read, {s['bytes_stored']:,} new bytes stored in {s['seconds']}s")
+    prune_data(keep)
+    return snap
+
+
+def prune_data(keep=KEEP):
+    """Drop snapshots beyond the newest `keep` and the chunks no remaining snapshot uses."""
+    snaps = list_snapshots()
+    if len(snaps) <= keep:
+        return 0
+    for path in snaps[:-keep]:
+        path.unlink()
+    live = set()
+    for path in list_snapshots():
+        for entry in json.loads(path.read_text(encoding="utf-8"))["files"].values():
+            live.update(entry["chunks"])
+    removed = 0
+    for path in CHUNKS_DIR.glob("*/*"):
+        if path.name not in live:
+            path.unlink()
+            removed += 1
+    print(f"Pruned {len(snaps) - keep} snapshots, {removed} unreferenced chunks")
+    return removed
+
+
+def restore_file(entry, dest):
+    """Reassemble one file from its chunks and check its hash. Returns an error or None."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    whole = hashlib.sha256()
+    try:
+        with open(dest, "wb") as f:
+            for digest in entry["chunks"]:
+                data = zlib.decompress(chunk_path(digest).read_bytes())
+                if hashlib.sha256(data).hexdigest() != digest:
+                    return f"chunk {digest} is corrupt"
+                whole.update(data)
+                f.write(data)
+    except (OSError, zlib.error) as e:
+        return str(e)
+    if whole.hexdigest() != entry["sha256"]:
+        return "file hash mismatch"
+    os.utime(dest, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+    return None
+
+
+def restore_data(dest, name=None, workers=WORKERS):
+    """Restore a snapshot (latest by default) into `dest`. Returns {path: error} for failures."""
+    snap = read_snapshot(name)
+    dest = pathlib.Path(dest)
+    items = list(snap["files"].items())
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        errors = pool.map(lambda kv: restore_file(kv[1], dest / kv[0]), items)
+        failed = {rel: err for (rel, _), err in zip(items, errors) if err}
+    print(f"Restored snapshot {snap['snapshot']} into {dest}: {len(items) - len(failed)} files ok, {len(failed)} failed")
+    return failed
+
+
+# --- PostgreSQL: parallel directory dumps + per-partition exports ---
+def pg_env():
+    return dict(os.environ, PGPASSWORD=config.PGPASSWORD)
+
+
+def server_args():
+    return ["-h", config.PGHOST, "-p", config.PGPORT, "-U", config.PGUSER]
+
+
+def pg_args(db=DB_NAME):
+    return [*server_args(), "-d", db]
+
+
+def run(cmd):
+    subprocess.run(cmd, env=pg_env(), check=True)
+
+
+def compression():
+    """zstd where pg_dump supports it (16+), gzip otherwise."""
+    out = subprocess.run(["pg_dump", "--version"], capture_output=True, text=True, check=True).stdout
+    major = int(re.search(r"(\d+)", out.split(")")[-1]).group(1))
+    return "zstd:3" if major >= 16 else "gzip:6"
+
+
+def psql(sql, db=DB_NAME):
+    """Rows of a query as lists of strings, through psql (no Python driver needed)."""
+    out = subprocess.run(["psql", *pg_args(db), "-At", "-F", "\t", "-c", sql],
+                         env=pg_env(), capture_output=True, text=True, check=True).stdout
+    return [line.split("\t") for line in out.splitlines() if line]
+
+
+# {partition: fingerprint}: the load's per-partition change counter plus the
+# relfilenode, which a TRUNCATE or table rewrite replaces. Catalog lookups
+# only, however much history there is.
+FINGERPRINTS_SQL = """
+    SELECT c.relname, concat_ws(':', c.relfilenode, COALESCE(m.changes, 0))
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    LEFT JOIN market_history_changes m ON m.partition = c.relname
+    WHERE i.inhparent = 'market_history'::regclass
+    ORDER BY c.relname
+"""
+
+
+def partition_fingerprints(db=DB_NAME):
+    """
+    {partition: fingerprint}; the fingerprint changes whenever load.py or
+    stream.py write rows to it (market_history_changes, migration 0009).
+    """
+    return dict(psql(FINGERPRINTS_SQL, db))
+
+
+def read_catalog():
+    if CATALOG_FILE.exists():
+        return json.loads(CATALOG_FILE.read_text(encoding="utf-8"))
+    return {"partitions": {}, "dumps": []}
+
+
+def export_partition(name, compress):
+    PARTITIONS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = PARTITIONS_DIR / f".tmp-{name}.dump"
+    run(["pg_dump", *pg_args(), "-Fc", "--data-only", f"--compress={compress}",
+         "-t", f"public.{name}", "-f", str(tmp)])
+    dest = PARTITIONS_DIR / f"{name}.dump"
+    tmp.replace(dest)
+    return dest
+
+
+def backup_db(jobs=4, keep=KEEP):
+    """Full dump without partition rows, then the partitions that changed."""
+    t0 = time.perf_counter()
+    compress = compression()
+    catalog = read_catalog()
+    # Fingerprints before dumping: a write during the export changes them
+    # again, so that partition is simply exported once more next time
+    fingerprints = partition_fingerprints()
+
+    dump_dir = DB_BACKUP_DIR / f"full_{now_id()}"
+    run(["pg_dump", *pg_args(), "-Fd", "-j", str(jobs), f"--compress={compress}",
+         "--exclude-table-data=public.market_history_y*", "-f", str(dump_dir)])
+    catalog["dumps"].append(dump_dir.name)
+    print(f"Full dump (partition rows excluded): {dump_dir} in {time.perf_counter() - t0:.1f}s")
+
+    changed = [p for p, fp in fingerprints.items() if catalog["partitions"].get(p, {}).get("fingerprint") != fp]
+    t1 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for name, dest in zip(changed, pool.map(lambda p: export_partition(p, compress), changed)):
+            catalog["partitions"][name] = {"fingerprint": fingerprints[name], "file": dest.name,
+                                           "exported_at": datetime.now(timezone.utc).isoformat()}
+    for name in set(catalog["partitions"]) - set(fingerprints):  # dropped partitions
+        (PARTITIONS_DIR / catalog["partitions"].pop(name)["file"]).unlink(missing_ok=True)
+    print(f"Exported {len(changed)} of {len(fingerprints)} market_history partitions "
+          f"in {time.perf_counter() - t1:.1f}s")
+
+    for old in catalog["dumps"][:-keep]:
+        shutil.rmtree(DB_BACKUP_DIR / old, ignore_errors=True)
+    catalog["dumps"] = catalog["dumps"][-keep:]
+    write_json(CATALOG_FILE, catalog)
+    return catalog
+
+
+def restore_db(target, jobs=4):
+    """Restore the latest full dump and every partition export into database `target`."""
+    catalog = read_catalog()
+    if not catalog["dumps"]:
+        raise FileNotFoundError(f"No database dumps in {DB_BACKUP_DIR}")
+    run(["pg_restore", *pg_args(target), "-j", str(jobs), "--no-owner", str(DB_BACKUP_DIR / catalog["dumps"][-1])])
+    parts = [PARTITIONS_DIR / p["file"] for p in catalog["partitions"].values()]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(lambda fp: run(["pg_restore", *pg_args(target), "--data-only", "--no-owner", str(fp)]), parts))
+    print(f"Restored {catalog['dumps'][-1]} and {len(parts)} partitions into {target}")
+
+
+# --- Verification ---
+def verify_data():
+    with tempfile.TemporaryDirectory(prefix="verify-data-") as tmp:
+        failed = restore_data(tmp)
+    for rel, err in failed.items():
+        print(f"  {rel}: {err}")
+    return not failed
+
+
+def verify_db(scratch_db=None, jobs=4):
+    """Read every archive end to end; with `scratch_db`, also restore it and compare row counts."""
+    catalog = read_catalog()
+    if not catalog["dumps"]:
+        print("No database dumps to verify")
+        return False
+    archives = [DB_BACKUP_DIR / catalog["dumps"][-1]] + [PARTITIONS_DIR / p["file"] for p in catalog["partitions"].values()]
+
+    def readable(path):
+        return subprocess.run(["pg_restore", "-f", os.devnull, str(path)], capture_output=True).returncode == 0
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        bad = [path.name for path, ok in zip(archives, pool.map(readable, archives)) if not ok]
+    print(f"Read {len(archives)} database archives: {len(archives) - len(bad)} ok" + (f", unreadable: {bad}" if bad else ""))
+    if bad or not scratch_db:
+        return not bad
+
+    run(["dropdb", *server_args(), "--if-exists", scratch_db])
+    run(["createdb", *server_args(), scratch_db])
+    try:
+        restore_db(scratch_db, jobs)
+        # Partitions untouched since their export must match the source exactly
+        current = partition_fingerprints()
+        same = [p for p, info in catalog["partitions"].items() if current.get(p) == info["fingerprint"]]
+        mismatched = []
+        for name in same:
+            sql = f"SELECT count(*) FROM {name}"
+            if psql(sql) != psql(sql, scratch_db):
+                mismatched.append(name)
+        print(f"Compared row counts of {len(same)} unchanged partitions: "
+              + (f"mismatch in {mismatched}" if mismatched else "all equal"))
+        return not mismatched
+    finally:
+        run(["dropdb", *server_args(), "--if-exists", scratch_db])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Incremental backups of data/ and PostgreSQL")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("data", help="incremental snapshot of data/")
+    p.add_argument("--keep", type=int, default=KEEP)
+    p = sub.add_parser("db", help="parallel full dump + changed market_history partitions")
+    p.add_argument("--jobs", type=int, default=4)
+    p.add_argument("--keep", type=int, default=KEEP)
+    p = sub.add_parser("verify", help="check that the latest backups restore")
+    p.add_argument("--skip-data", action="store_true")
+    p.add_argument("--skip-db", action="store_true")
+    p.add_argument("--scratch-db", help="also restore the database into this (re-created) database")
+    p.add_argument("--jobs", type=int, default=4)
+    p = sub.add_parser("restore-data", help="restore a data/ snapshot")
+    p.add_argument("snapshot", nargs="?", help="snapshot id (default: latest)")
+    p.add_argument("dest")
+    p = sub.add_parser("restore-db", help="restore the database into an existing, empty database")
+    p.add_argument("target")
+    p.add_argument("--jobs", type=int, default=4)
+    args = ap.parse_args(argv)
+
+    if args.command == "data":
+        backup_data(args.keep)
+    elif args.command == "db":
+        backup_db(args.jobs, args.keep)
+    elif args.command == "verify":
+        ok = True
+        if not args.skip_data:
+            ok &= verify_data()
+        if not args.skip_db:
+            ok &= verify_db(args.scratch_db, args.jobs)
+        return 0 if ok else 1
+    elif args.command == "restore-data":
+        return 1 if restore_data(args.dest, args.snapshot) else 0
+    elif args.command == "restore-db":
+        restore_db(args.target, args.jobs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
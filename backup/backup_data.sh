@@ -1,29 +1,19 @@
 #!/bin/bash
 
-# Backup script for the /data directory
-# Compresses the folder and deletes the original files afterward
-# Saves compressed .tar.gz files in backup/data/
+# Incremental backup of the /data directory
+# Stores only new or changed content (deduplicated chunks) in backup/data/
+# The original files are left in place
 # Usage: ./backup_data.sh
 
 PROJECT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
-DATA_DIR="$PROJECT_DIR/data"
-BACKUP_DIR="$PROJECT_DIR/backup/data"
+VENV_PYTHON="$PROJECT_DIR/venv/bin/python"
 
-mkdir -p "$BACKUP_DIR"
-TIMESTAMP=$(date +"%Y-%m-%d_%H-%M")
-
-echo "Creating backup of /data directory..."
-tar -czf "$BACKUP_DIR/data_${TIMESTAMP}.tar.gz" -C "$PROJECT_DIR" data
+echo "Creating incremental backup of /data directory..."
+$VENV_PYTHON "$PROJECT_DIR/backup/backup.py" data
 
 if [ $? -eq 0 ]; then
-    echo "Data backup completed: $BACKUP_DIR/data_${TIMESTAMP}.tar.gz"
-    echo "Deleting original files in /data..."
-    rm -rf "$DATA_DIR"/*
-    echo "Original data files deleted."
+    echo "Data backup completed in $PROJECT_DIR/backup/data/"
 else
-    echo "Data backup failed. Original files were NOT deleted."
+    echo "Data backup failed."
     exit 1
 fi
-
-# Optional: keep only last 10 backups
-ls -t "$BACKUP_DIR"/data_*.tar.gz | tail -n +11 | xargs -r rm --
@@ -1,26 +1,20 @@
 #!/bin/bash
 
 # Backup script for PostgreSQL database
-# Saves compressed .sql.gz files in backup/db/
-# Usage: ./backup_db.sh
+# Parallel directory-format dump (zstd) without the market_history rows, plus
+# one export per market_history partition changed since the last backup
+# Saves them in backup/db/
+# Usage: ./backup_db.sh [--jobs N]
 
 PROJECT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
-BACKUP_DIR="$PROJECT_DIR/backup/db"
-DB_NAME="crypto"
-DB_USER="ricardo"
+VENV_PYTHON="$PROJECT_DIR/venv/bin/python"
 
-mkdir -p "$BACKUP_DIR"
-TIMESTAMP=$(date +"%Y-%m-%d_%H-%M")
-
-echo "Creating database backup for '$DB_NAME'..."
-pg_dump -U "$DB_USER" "$DB_NAME" | gzip > "$BACKUP_DIR/${DB_NAME}_${TIMESTAMP}.sql.gz"
+echo "Creating database backup..."
+$VENV_PYTHON "$PROJECT_DIR/backup/backup.py" db "$@"
 
 if [ $? -eq 0 ]; then
-    echo "Database backup completed: $BACKUP_DIR/${DB_NAME}_${TIMESTAMP}.sql.gz"
+    echo "Database backup completed in $PROJECT_DIR/backup/db/"
 else
     echo "Database backup failed."
     exit 1
 fi
-
-# Optional: keep only last 10 backups
-ls -t "$BACKUP_DIR"/crypto_*.sql.gz | tail -n +11 | xargs -r rm --
@@ -1,16 +1,23 @@
 #!/bin/bash
 
-# Master script to run both database and data backups
+# Master script to run both database and data backups, then verify they restore
 # Usage: ./run_backup.sh
 
 PROJECT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+VENV_PYTHON="$PROJECT_DIR/../venv/bin/python"
 
-echo "=== [1/2] Backing up PostgreSQL database ==="
+set -e
+
+echo "=== [1/3] Backing up PostgreSQL database ==="
 "$PROJECT_DIR/backup_db.sh"
 
 echo ""
-echo "=== [2/2] Backing up data directory ==="
+echo "=== [2/3] Backing up data directory ==="
 "$PROJECT_DIR/backup_data.sh"
 
+echo ""
+echo "=== [3/3] Verifying backups ==="
+$VENV_PYTHON "$PROJECT_DIR/backup.py" verify
+
 echo ""
 echo "All backups completed successfully."
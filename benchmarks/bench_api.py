@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+bench_api.py
+Load test of the read API (src/readapi.py): many concurrent dashboard
+viewers, latency percentiles per endpoint, and the server's database
+connection count sampled throughout.
+
+Each viewer is a thread with its own keep-alive session that repeats one
+dashboard page view until --duration runs out:
+
+    /version, /coins, /history (every coin, LTTB), /metrics/sharpe, /stats,
+    /metrics/correlation, then /history of a random coin, range and mode
+
+With --cold every request carries a unique `points` value, so nothing is
+served from the response cache and every request reaches the database
+(the worst case after a load); by default the first viewers warm the cache
+and the rest measure cache hits.
+
+The target is a running API (--url) or one spawned for the test (--spawn,
+with --backend/--pool-size). /health is polled every 0.2 s; the run fails
+(exit status 1) when the connection count goes over the pool size or, with
+--max-p95-ms, when the overall p95 is slower.
+
+Usage:
+    python benchmarks/bench_api.py --spawn --backend local --viewers 50 --duration 20
+    python benchmarks/bench_api.py --url http://127.0.0.1:8800 --viewers 200 --cold --max-p95-ms 500
+"""
+
+import argparse
+import collections
+import http.client
+import pathlib
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+import requests
+
+BASE_DIR = pathlib.Path(__file__).resolve().parents[1]
+
+TIME_RANGES = (1, 7, 30, 90, 365, None)
+
+
+def page_view(rng, coins, cold):
+    """(label, path, params) requests of one dashboard page view."""
+    points = (lambda n: n + rng.randrange(1_000)) if cold else (lambda n: n)
+    coin = rng.choice(coins)
+    mode = rng.choice(("lttb", "ohlc"))
+    return [
+        ("version", "/version", {}),
+        ("coins", "/coins", {"format": "arrow"}),
+        ("history_all", "/history", {"format": "arrow", "points": points(500)}),
+        ("sharpe", "/metrics/sharpe", {"format": "arrow"}),
+        ("stats", "/stats", {"format": "arrow"}),
+        ("correlation", "/metrics/correlation", {"format": "arrow"}),
+        (f"history_{mode}", "/history", {"format": "arrow", "coins": coin, "days": rng.choice(TIME_RANGES),
+                                         "points": points(500), "mode": mode}),
+    ]
+
+
+def viewer(url, coins, cold, deadline, seed, latencies, errors):
+    # http.client rather than requests: ~5x less client CPU per request, which
+    # would otherwise be measured as server latency on a small machine
+    rng = random.Random(seed)
+    target = urlsplit(url)
+    conn = http.client.HTTPConnection(target.hostname, target.port, timeout=120)
+    while time.monotonic() < deadline:
+        for label, path, params in page_view(rng, coins, cold):
+            query = urlencode({k: v for k, v in params.items() if v is not None})
+            t0 = time.perf_counter()
+            try:
+                conn.request("GET", f"{path}?{query}", headers={"Accept-Encoding": "gzip"})
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status == 200
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                ok = False
+            ms = (time.perf_counter() - t0) * 1000
+            if ok:
+                latencies[label].append(ms)
+            else:
+                errors[label] += 1
+
+
+def monitor(url, stop, samples):
+    session = requests.Session()
+    while not stop.wait(0.2):
+        try:
+            samples.append(session.get(url + "/health", timeout=5).json())
+        except requests.RequestException:
+            pass
+
+
+def wait_ready(url, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"API exited with status {proc.returncode}")
+        try:
+            return requests.get(url + "/version", timeout=2).json()
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"API at {url} not ready after {timeout}s")
+
+
+def percentiles(values):
+    a = np.asarray(values)
+    return np.percentile(a, 50), np.percentile(a, 95), np.percentile(a, 99), a.max()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Read API load test")
+    ap.add_argument("--url", default="http://127.0.0.1:8800")
+    ap.add_argument("--spawn", action="store_true", help="start src/readapi.py for the test")
+    ap.add_argument("--backend", default="postgres", help="with --spawn")
+    ap.add_argument("--pool-size", type=int, default=4, help="with --spawn")
+    ap.add_argument("--port", type=int, default=8899, help="with --spawn")
+    ap.add_argument("--viewers", type=int, default=50, help="concurrent clients")
+    ap.add_argument("--duration", type=float, default=20, help="seconds")
+    ap.add_argument("--cold", action="store_true", help="unique parameters per request (no cache hits)")
+    ap.add_argument("--max-p95-ms", type=float, help="fail when the overall p95 is slower")
+    args = ap.parse_args()
+
+    proc = None
+    url = args.url.rstrip("/")
+    if args.spawn:
+        url = f"http://127.0.0.1:{args.port}"
+        proc = subprocess.Popen([sys.executable, str(BASE_DIR / "src" / "readapi.py"), "--port", str(args.port),
+                                 "--backend", args.backend, "--pool-size", str(args.pool_size)])
+    try:
+        info = wait_ready(url, proc)
+        coins = requests.get(url + "/coins", timeout=60).json()
+        coins = [c["coin_id"] for c in coins] or ["bitcoin"]
+        print(f"{url} ({info['backend']}, load version {info['version']}): {len(coins)} coins, "
+              f"{args.viewers} viewers, {args.duration:.0f}s, {'cold' if args.cold else 'warm'} cache")
+
+        latencies, errors = collections.defaultdict(list), collections.Counter()
+        samples, stop = [], threading.Event()
+        watcher = threading.Thread(target=monitor, args=(url, stop, samples), daemon=True)
+        watcher.start()
+        deadline = time.monotonic() + args.duration
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=viewer, args=(url, coins, args.cold, deadline, i, latencies, errors))
+                   for i in range(args.viewers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        watcher.join()
+        final = requests.get(url + "/health", timeout=5).json()
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    print(f"\n{'endpoint':<16}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label in sorted(latencies):
+        p50, p95, p99, worst = percentiles(latencies[label])
+        print(f"{label:<16}{len(latencies[label]):>10}{errors[label]:>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{worst:>10.1f}")
+    every = [ms for values in latencies.values() for ms in values]
+    if not every:
+        print("No successful requests")
+        return 1
+    p50, p95, p99, worst = percentiles(every)
+    print(f"{'all':<16}{len(every):>10}{sum(errors.values()):>8}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{worst:>10.1f}")
+    print(f"\n{len(every) / elapsed:.0f} requests/s; cache {final['cache_hits']} hits / {final['cache_misses']} misses")
+
+    connections = max([s["connections"] for s in samples] + [final["connections"]])
+    print(f"database connections: max {connections} (pool size {final['pool_size']})")
+    failed = connections > final["pool_size"]
+    if args.max_p95_ms is not None and p95 > args.max_p95_ms:
+        print(f"p95 {p95:.1f} ms over the {args.max_p95_ms:.0f} ms limit")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
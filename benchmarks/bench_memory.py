@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+bench_memory.py
+Per-row memory footprint of market_history frames: the legacy layout
+(object coin_id/snapshot_id, float64 everywhere) against the compact one of
+src/frames.py (categorical keys, optional float32 caps/volumes).
+
+Three ways a history frame gets built:
+    transform   transform.history_frame() per coin + concat (extract → transform)
+    parquet     a market_history part file read back with to_pandas() (load)
+    sql         a market_history query (analysis, dashboard); --sql-rows rows
+                through SQLite, since the DB-API row path is the same
+
+For each, "deep" is DataFrame.memory_usage(deep=True) (counts each string
+reference as a full string, even when rows share one object) and "retained"
+the bytes still allocated once it is built: tracemalloc for the Python/NumPy
+heap plus pyarrow's memory pool, which tracemalloc doesn't see.
+
+Usage:
+    python benchmarks/bench_memory.py --rows 10000000
+    python benchmarks/bench_memory.py --rows 10000000 --float32
+"""
+
+import argparse
+import gc
+import os
+import pathlib
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+SRC_DIR = pathlib.Path(__file__).resolve().parents[1] / "src"
+
+
+def synthetic_chart(n_points, seed):
+    """market_chart payload as (n, 2) arrays (chart_arrays() accepts them as is)."""
+    rng = np.random.default_rng(seed)
+    ts = 1_600_000_000_000 + np.arange(n_points, dtype=np.int64) * 60_000
+    prices = 100 * np.cumprod(1 + rng.normal(0, 0.001, n_points))
+    return {
+        key: np.column_stack([ts, prices * scale])
+        for key, scale in (("prices", 1.0), ("market_caps", 1.7e8), ("total_volumes", 3.1e6))
+    }
+
+
+def legacy(df):
+    """Compact frame → the layout history frames had before frames.py."""
+    import pandas as pd
+
+    return df.astype({"coin_id": object, "snapshot_id": object,
+                      **{c: "float64" for c in df.columns if pd.api.types.is_float_dtype(df[c])}})
+
+
+def measure(build):
+    """(frame, retained bytes, seconds) of build(); the frame stays alive."""
+    import pyarrow as pa
+
+    gc.collect()
+    arrow = pa.total_allocated_bytes()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    df = build()
+    seconds = time.perf_counter() - t0
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] + pa.total_allocated_bytes() - arrow
+    tracemalloc.stop()
+    return df, retained, seconds
+
+
+def report(path, layout, df, retained, seconds):
+    deep = int(df.memory_usage(deep=True, index=False).sum())
+    n = max(len(df), 1)
+    print(f"{path:<10}{layout:<9}{len(df):>12,}{deep / n:>12.1f}{retained / n:>16.1f}{seconds:>9.2f}s", flush=True)
+    return retained / n
+
+
+def main():
+    ap = argparse.ArgumentParser(description="market_history frame memory footprint")
+    ap.add_argument("--rows", type=int, default=10_000_000)
+    ap.add_argument("--coins", type=int, default=500)
+    ap.add_argument("--sql-rows", type=int, default=1_000_000,
+                    help="rows for the SQL path (SQLite inserts are the slow part)")
+    ap.add_argument("--float32", action="store_true", help="HISTORY_FLOAT32=1 for the compact layout")
+    args = ap.parse_args()
+
+    if args.float32:
+        os.environ["HISTORY_FLOAT32"] = "1"
+    sys.path.insert(0, str(SRC_DIR))
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from sqlalchemy import create_engine, text
+
+    import frames
+    from transform import history_frame
+
+    per_coin = max(1, args.rows // args.coins)
+    charts = {f"coin-{i:05d}": synthetic_chart(per_coin, i) for i in range(args.coins)}
+    sid = "20250101T000000Z"
+
+    print(f"{'path':<10}{'layout':<9}{'rows':>12}{'deep B/row':>12}{'retained B/row':>16}{'time':>10}")
+    results = {}
+
+    # --- transform: one frame per coin, concatenated ---
+    def build_compact():
+        return frames.concat_history([history_frame(c, chart, sid) for c, chart in charts.items()])
+
+    def build_legacy():
+        return pd.concat([legacy(history_frame(c, chart, sid)) for c, chart in charts.items()], ignore_index=True)
+
+    for layout, build in (("legacy", build_legacy), ("compact", build_compact)):
+        df, retained, seconds = measure(build)
+        results["transform", layout] = report("transform", layout, df, retained, seconds)
+        del df
+    source = build_compact()
+    del charts
+
+    with tempfile.TemporaryDirectory(prefix="bench-memory-") as tmp:
+        # --- parquet: the same rows written in each schema, read back ---
+        paths = {"legacy": pathlib.Path(tmp) / "legacy.parquet", "compact": pathlib.Path(tmp) / "compact.parquet"}
+        pq.write_table(pa.Table.from_pandas(legacy(source), preserve_index=False), paths["legacy"])
+        pq.write_table(pa.Table.from_pandas(source, preserve_index=False, schema=frames.HISTORY_SCHEMA),
+                       paths["compact"])
+        sample = source.iloc[:args.sql_rows]
+        del source
+
+        for layout, path in paths.items():
+            df, retained, seconds = measure(lambda: pq.read_table(path).to_pandas())
+            results["parquet", layout] = report("parquet", layout, df, retained, seconds)
+            del df
+
+        # --- sql: DB-API rows (one Python string per value) ---
+        engine = create_engine(f"sqlite:///{tmp}/history.db")
+        legacy(sample).assign(ts=sample["ts"].astype("int64")).to_sql("market_history", engine, index=False)
+        del sample
+        query = text("SELECT coin_id, ts, price_eur, market_cap, volume_24h, snapshot_id FROM market_history")
+        with engine.connect() as conn:
+            for layout, read in (("legacy", pd.read_sql), ("compact", frames.read_sql)):
+                df, retained, seconds = measure(lambda: read(query, conn))
+                results["sql", layout] = report("sql", layout, df, retained, seconds)
+                del df
+        engine.dispose()
+
+    print()
+    for path in ("transform", "parquet", "sql"):
+        ratio = results[path, "legacy"] / results[path, "compact"]
+        print(f"{path:<10}retained per row {results[path, 'legacy']:.1f} → {results[path, 'compact']:.1f} B "
+              f"({ratio:.1f}x smaller)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+bench_parse.py
+Micro-benchmark for market_chart parsing in transform.py.
+
+Compares the legacy per-point parser (one pd.to_datetime call per row) with
+transform.parse_market_chart on a synthetic chart and reports rows/sec.
+
+Usage:
+    python benchmarks/bench_parse.py --points 1000000
+"""
+
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / "src"))
+from transform import parse_market_chart  # noqa: E402
+
+
+def synthetic_chart(n_points, seed=0):
+    """Hourly market_chart payload with `n_points` points per series."""
+    rng = np.random.default_rng(seed)
+    ts = (1_600_000_000_000 + np.arange(n_points, dtype=np.int64) * 3_600_000).tolist()
+    prices = (100 * np.cumprod(1 + rng.normal(0, 0.01, n_points))).tolist()
+    return {
+        "prices": [[t, p] for t, p in zip(ts, prices)],
+        "market_caps": [[t, p * 1e6] for t, p in zip(ts, prices)],
+        "total_volumes": [[t, p * 1e4] for t, p in zip(ts, prices)],
+    }
+
+
+def legacy_parse(chart):
+    """Parser as it was in transform.transform (list comprehensions per point)."""
+    return pd.DataFrame({
+        "ts": [pd.to_datetime(x[0], unit="ms", utc=True).tz_convert(None) for x in chart["prices"]],
+        "price_eur": [x[1] for x in chart["prices"]],
+        "market_cap": [x[1] for x in chart["market_caps"]],
+        "volume_24h": [x[1] for x in chart["total_volumes"]],
+    })
+
+
+def bench(fn, chart, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        df = fn(chart)
+        best = min(best, time.perf_counter() - t0)
+    return best, df
+
+
+def main():
+    ap = argparse.ArgumentParser(description="market_chart parser micro-benchmark")
+    ap.add_argument("--points", type=int, default=1_000_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--legacy-points", type=int, default=None,
+                    help="points for the legacy parser (default: same as --points; it is slow)")
+    args = ap.parse_args()
+
+    chart = synthetic_chart(args.points)
+    t_new, df_new = bench(parse_market_chart, chart, args.repeat)
+
+    n_legacy = args.legacy_points or args.points
+    legacy_chart = chart if n_legacy == args.points else synthetic_chart(n_legacy)
+    t_old, df_old = bench(legacy_parse, legacy_chart, 1)
+
+    if n_legacy == args.points:
+        pd.testing.assert_frame_equal(df_old, df_new, check_dtype=False)
+
+    rps_old = n_legacy / t_old
+    rps_new = args.points / t_new
+    print(f"legacy     : {n_legacy:>10,} rows in {t_old:8.3f}s → {rps_old:>14,.0f} rows/s")
+    print(f"vectorized : {args.points:>10,} rows in {t_new:8.3f}s → {rps_new:>14,.0f} rows/s")
+    print(f"speed-up   : {rps_new / rps_old:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+bench_startup.py
+Startup time of the command-line scripts: wall time of `python <script>
+--help` (interpreter start plus every module-level import, nothing else),
+and where it goes according to `python -X importtime`.
+
+For each script the median of --runs fresh interpreters is reported, along
+with the import time of its top-level imports, the slowest of them and which
+heavy libraries (pandas, NumPy, pyarrow, SQLAlchemy, matplotlib, requests) it
+loads before doing anything. -X importtime adds its own overhead, so the
+import breakdown comes from a separate run and is not subtracted from the
+wall times.
+
+--max-seconds fails the run (exit status 1) when the --check scripts
+(default: extract, summary and charts, which import nothing heavy before
+parsing their arguments) start slower than that.
+
+Usage:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --max-seconds 1
+    python benchmarks/bench_startup.py --scripts extract load --top 10
+"""
+
+import argparse
+import collections
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+BASE_DIR = pathlib.Path(__file__).resolve().parents[1]
+
+SCRIPTS = {
+    "extract": "src/extract.py",
+    "transform": "src/transform.py",
+    "load": "src/load.py",
+    "pipeline": "src/pipeline.py",
+    "stream": "src/stream.py",
+    "readapi": "src/readapi.py",
+    "migrate": "src/migrate.py",
+    "summary": "analysis/summary.py",
+    "charts": "analysis/charts.py",
+}
+
+HEAVY = ("pandas", "numpy", "pyarrow", "sqlalchemy", "matplotlib", "requests")
+
+# "import time:       self [us] |  cumulative | imported package"
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def wall_time(*argv):
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, *argv], cwd=BASE_DIR, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - t0
+
+
+def import_times(script):
+    """{top-level module: cumulative µs} and the set of every module imported."""
+    out = subprocess.run([sys.executable, "-X", "importtime", script, "--help"], cwd=BASE_DIR,
+                         check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+    top, every = collections.OrderedDict(), set()
+    for line in out.splitlines():
+        m = IMPORT_LINE.match(line)
+        if not m:
+            continue
+        cumulative, indent, name = int(m.group(2)), len(m.group(3)), m.group(4)
+        every.add(name.split(".")[0])
+        if indent == 1:  # imported by the script itself (or by site at startup)
+            top[name] = top.get(name, 0) + cumulative
+    return top, every
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Startup time of the command-line scripts")
+    ap.add_argument("--scripts", nargs="+", choices=SCRIPTS, default=list(SCRIPTS))
+    ap.add_argument("--runs", type=int, default=5, help="fresh interpreters per script (median reported)")
+    ap.add_argument("--top", type=int, default=3, help="slowest top-level imports listed per script")
+    ap.add_argument("--check", nargs="+", choices=SCRIPTS, default=["extract", "summary", "charts"],
+                    help="scripts held to --max-seconds")
+    ap.add_argument("--max-seconds", type=float, help="fail when a --check script starts slower")
+    args = ap.parse_args()
+
+    baseline = statistics.median(wall_time("-c", "pass") for _ in range(args.runs))
+    print(f"python {sys.version.split()[0]}, bare interpreter start {baseline * 1000:.0f} ms, "
+          f"median of {args.runs} runs\n")
+    print(f"{'script':<11}{'startup ms':>11}{'imports ms':>12}  {'heavy libraries':<45}slowest imports (ms)")
+
+    failed = False
+    for name in args.scripts:
+        script = SCRIPTS[name]
+        try:
+            wall = statistics.median(wall_time(script, "--help") for _ in range(args.runs))
+            top, every = import_times(script)
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<11}failed with exit status {e.returncode} (missing dependency?)")
+            failed = failed or name in args.check
+            continue
+        slowest = sorted(top.items(), key=lambda kv: kv[1], reverse=True)[:args.top]
+        heavy = ", ".join(lib for lib in HEAVY if lib in every) or "-"
+        print(f"{name:<11}{wall * 1000:>11.0f}{sum(top.values()) / 1000:>12.0f}  {heavy:<45}"
+              + ", ".join(f"{mod} {us / 1000:.0f}" for mod, us in slowest))
+        if args.max_seconds is not None and name in args.check and wall > args.max_seconds:
+            print(f"  {name} starts in {wall:.2f}s, over the {args.max_seconds:.2f}s limit")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
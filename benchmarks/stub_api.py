@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+stub_api.py
+Minimal local stand-in for the CoinGecko endpoints used by src/extract.py.
+
+Serves synthetic /coins/markets and /coins/<id>/market_chart payloads and can
+answer a fraction of requests with 429 + Retry-After (or 503 with --p500) to
+exercise the extractor's rate limiting and retry logic. Tests can also script
+the first answers exactly (make_server(script=[429, 503, "drop"]): "drop"
+closes the connection without answering) and read the arrival time of every
+request from srv.times.
+
+Volume is set by --coins, the requested days and --resolution (minutes
+between chart points). With --freeze-time every chart ends at the server's
+start time, so its encoded body is generated once and then served from
+memory (benchmarks time the client, not the generator).
+
+Usage:
+    python benchmarks/stub_api.py --port 8000 --p429 0.2 --retry-after 1
+    python benchmarks/stub_api.py --coins 500 --resolution 5 --freeze-time
+    COINGECKO_BASE_URL=http://127.0.0.1:8000 COINGECKO_RATE_PER_MIN=600 python src/extract.py
+"""
+
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+MINUTE_MS = 60 * 1000
+
+# vs_currency → multiplier on the EUR-denominated synthetic prices
+CURRENCY_FACTORS = {"eur": 1.0, "usd": 1.08, "gbp": 0.85, "btc": 1 / 60000}
+
+
+def synthetic_markets(n_coins, page=1, per_page=100, currency="eur"):
+    """Top-N listing ordered by market cap (descending)."""
+    start = (page - 1) * per_page
+    stop = min(n_coins, start + per_page)
+    now = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+    rows = []
+    for i in range(start, stop):
+        price = 50000.0 / (i + 1) * CURRENCY_FACTORS.get(currency, 1.0)
+        rows.append({
+            "id": f"coin-{i:05d}",
+            "symbol": f"c{i}",
+            "name": f"Coin {i}",
+            "current_price": price,
+            "market_cap": price * 1e6,
+            "market_cap_rank": i + 1,
+            "total_volume": price * 1e4,
+            "price_change_percentage_24h": 0.0,
+            "last_updated": now,
+        })
+    return rows
+
+
+def synthetic_chart(coin_id, days, now_ms=None, resolution=60, currency="eur"):
+    """Random-walk series for `days` days ending now, one point every `resolution` minutes."""
+    now_ms = now_ms or int(time.time() * 1000)
+    n = max(1, int(float(days) * 24 * 60 / resolution))
+    rng = np.random.default_rng(zlib.crc32(coin_id.encode()))
+    ts = (now_ms - (n - 1 - np.arange(n)) * resolution * MINUTE_MS).tolist()
+    sigma = 0.01 * (resolution / 60) ** 0.5  # same volatility per hour at any resolution
+    price = (100.0 + rng.random() * 100) * np.cumprod(1 + rng.normal(0, sigma, n))
+    price *= CURRENCY_FACTORS.get(currency, 1.0)
+    return {
+        "prices": [list(p) for p in zip(ts, price.tolist())],
+        "market_caps": [list(p) for p in zip(ts, (price * 1e6).tolist())],
+        "total_volumes": [list(p) for p in zip(ts, (price * 1e4).tolist())],
+    }
+
+
+def chart_body(srv, coin_id, days, currency="eur"):
+    """Encoded market_chart response; cached when the server's clock is frozen."""
+    key = (coin_id, str(days), currency)
+    body = srv.cache.get(key) if srv.now_ms else None
+    if body is None:
+        chart = synthetic_chart(coin_id, days, srv.now_ms, srv.resolution, currency)
+        body = json.dumps(chart).encode("utf-8")
+        if srv.now_ms:
+            srv.cache[key] = body
+    return body
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "CoinGeckoStub/1.0"
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status, payload, headers=None):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.stats["requests"] += 1
+            srv.times.append(time.monotonic())
+            if srv.script:
+                forced = srv.script.pop(0)
+            elif srv.rng.random() < srv.p429:
+                forced = 429
+            elif srv.p500 and srv.rng.random() < srv.p500:
+                forced = 503
+            else:
+                forced = None
+            if forced is not None:
+                srv.stats[str(forced)] += 1
+
+        if forced == "drop":
+            self.close_connection = True
+            return
+        if forced == 429:
+            self._send(429, {"status": {"error_code": 429}},
+                       {"Retry-After": f"{srv.retry_after:g}"})
+            return
+        if forced is not None:
+            self._send(forced, {"error": "unavailable"})
+            return
+
+        url = urlparse(self.path)
+        qs = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split("/") if p]
+        # Accept both /coins/... and /api/v3/coins/...
+        if parts[:2] == ["api", "v3"]:
+            parts = parts[2:]
+
+        if parts == ["coins", "markets"]:
+            payload = synthetic_markets(srv.n_coins,
+                                        page=int(qs.get("page", 1)),
+                                        per_page=int(qs.get("per_page", 100)),
+                                        currency=qs.get("vs_currency", "eur"))
+        elif len(parts) == 3 and parts[0] == "coins" and parts[2] == "market_chart":
+            payload = chart_body(srv, parts[1], qs.get("days", 1), qs.get("vs_currency", "eur"))
+        else:
+            self._send(404, {"error": "not found"})
+            return
+
+        if srv.latency:
+            time.sleep(srv.latency)
+        self._send(200, payload)
+
+
+def make_server(host="127.0.0.1", port=0, n_coins=100, p429=0.0, retry_after=1,
+                latency=0.0, seed=0, verbose=False, resolution=60, freeze_time=False,
+                p500=0.0, script=()):
+    """
+    Build (but don't start) a stub server. Port 0 picks a free port.
+    `script` lists the answers to the first requests (a status code, or "drop").
+    """
+    srv = ThreadingHTTPServer((host, port), StubHandler)
+    srv.daemon_threads = True
+    srv.n_coins = n_coins
+    srv.p429 = p429
+    srv.p500 = p500
+    srv.script = list(script)
+    srv.retry_after = retry_after
+    srv.latency = latency
+    srv.verbose = verbose
+    srv.resolution = resolution
+    srv.now_ms = int(time.time() * 1000) if freeze_time else None
+    srv.cache = {}
+    srv.rng = random.Random(seed)
+    srv.lock = threading.Lock()
+    srv.stats = collections.Counter(requests=0)
+    srv.times = []
+    return srv
+
+
+def serve_in_thread(**kwargs):
+    """Start a stub server on a background thread; returns (server, base_url)."""
+    srv = make_server(**kwargs)
+    t = threading.Thread(target=srv.serve_forever, daemon=True)
+    t.start()
+    host, port = srv.server_address[:2]
+    return srv, f"http://{host}:{port}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--coins", type=int, default=100, help="size of the synthetic universe")
+    ap.add_argument("--p429", type=float, default=0.0, help="probability of answering 429")
+    ap.add_argument("--retry-after", type=float, default=1, help="Retry-After seconds sent with 429")
+    ap.add_argument("--p500", type=float, default=0.0, help="probability of answering 503")
+    ap.add_argument("--latency", type=float, default=0.0, help="artificial latency per request (s)")
+    ap.add_argument("--resolution", type=int, default=60, help="minutes between chart points")
+    ap.add_argument("--freeze-time", action="store_true",
+                    help="end every chart at the start time and cache the encoded responses")
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+
+    srv = make_server(args.host, args.port, args.coins, args.p429, args.retry_after,
+                      args.latency, verbose=args.verbose, resolution=args.resolution,
+                      freeze_time=args.freeze_time, p500=args.p500)
+    print(f"Stub CoinGecko API on http://{args.host}:{args.port} (p429={args.p429}, p500={args.p500})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served: {dict(srv.stats)}")
+        srv.server_close()
+
+
+if __name__ == "__main__":
+    main()
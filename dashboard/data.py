@@ -0,0 +1,110 @@
+"""
+data.py
+Shared data-access layer for the dashboard pages.
+
+- No database connection of its own: every table comes from the read API
+  (src/readapi.py, READ_API_URL) as an Arrow stream, so the number of
+  PostgreSQL connections doesn't grow with the number of viewers.
+- Every result is cached (st.cache_data) under the current load version,
+  which load.py bumps at the end of each load. Only /version is re-asked,
+  at most every VERSION_TTL seconds; as long as it is unchanged, page
+  interactions are served from the cache without any request.
+- Time series are downsampled by the API (src/downsample.py) to about as
+  many points as the chart is wide.
+"""
+
+import pathlib
+import sys
+
+import streamlit as st
+
+BASE_DIR = pathlib.Path(__file__).resolve().parents[1]
+
+sys.path.insert(0, str(BASE_DIR / "src"))
+import apiclient  # noqa: E402
+from downsample import MODES, target_points  # noqa: E402,F401
+
+# Seconds between load_version checks, and lifetime of cached results
+VERSION_TTL = 30
+RESULT_TTL = 24 * 3600
+
+# Time-range selector options → days back from the coin's last point (None = all)
+TIME_RANGES = {"24h": 1, "7d": 7, "30d": 30, "90d": 90, "1y": 365, "All": None}
+
+
+@st.cache_data(ttl=VERSION_TTL, show_spinner=False)
+def load_version():
+    """Current load version, as reported by the read API."""
+    return apiclient.version()
+
+
+# --- Cached queries: `version` is only part of the cache key ---
+@st.cache_data(ttl=RESULT_TTL, show_spinner=False)
+def _available_coins(version):
+    return apiclient.get("/coins")["coin_id"].tolist()
+
+
+@st.cache_data(ttl=RESULT_TTL, show_spinner=False)
+def _price_series(version, n_points):
+    return apiclient.get("/history", points=n_points, mode="lttb")
+
+
+@st.cache_data(ttl=RESULT_TTL, show_spinner=False)
+def _series(version, coin_id, days, n_points, mode):
+    df = apiclient.get("/history", coins=[coin_id], days=days, points=n_points, mode=mode)
+    return df.drop(columns="coin_id")
+
+
+@st.cache_data(ttl=RESULT_TTL, show_spinner=False)
+def _sharpe_ratios(version):
+    """Annualized Sharpe ratio per coin, as materialized by src/analytics.py."""
+    return apiclient.get("/metrics/sharpe").set_index("coin_id").rename(columns={"sharpe": "Sharpe"})
+
+
+@st.cache_data(ttl=RESULT_TTL, show_spinner=False)
+def _correlation(version):
+    return apiclient.get("/metrics/correlation").set_index("coin_id")
+
+
+@st.cache_data(ttl=RESULT_TTL, show_spinner=False)
+def _summary_stats(version):
+    return apiclient.get("/stats").set_index("coin_id")
+
+
+# --- Public API used by the pages ---
+def available_coins():
+    return _available_coins(load_version())
+
+
+def price_series(n_points=500):
+    """LTTB-thinned close series of every coin, about `n_points` per coin."""
+    return _price_series(load_version(), n_points)
+
+
+def normalized_prices(n_points=500):
+    """price_series() rebased to 100 at each coin's first point."""
+    df = price_series(n_points)
+    first = df.groupby("coin_id", observed=True)["price_eur"].transform("first")
+    return df.assign(norm_price=df["price_eur"] / first * 100)
+
+
+def sharpe_ratios():
+    return _sharpe_ratios(load_version())
+
+
+def series(coin_id, time_range="30d", n_points=500, mode="lttb"):
+    """
+    One coin over the last `time_range` (a TIME_RANGES key), downsampled to
+    about `n_points`: ts, price_eur for "lttb"; ts, open/high/low/close for "ohlc".
+    """
+    return _series(load_version(), coin_id, TIME_RANGES[time_range], n_points, mode)
+
+
+def correlation_matrix():
+    """Coin × coin correlation of daily log returns over analytics.CORR_WINDOW days."""
+    return _correlation(load_version())
+
+
+def summary_stats():
+    """Per-coin summary statistics (price_stats, refreshed by analysis/summary.py)."""
+    return _summary_stats(load_version())
@@ -1,49 +1,42 @@
 import streamlit as st
-import pandas as pd
 import matplotlib.pyplot as plt
-from sqlalchemy import create_engine
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+import data  # noqa: E402
 
 # --- Config ---
 st.set_page_config(page_title="Crypto Dashboard", layout="wide")
 st.title("Crypto-ETL Dashboard")
 
-# PostgreSQL connection
-DB_USER = "ricardo"
-DB_PASS = "crypto"
-DB_HOST = "localhost"
-DB_PORT = "5432"
-DB_NAME = "crypto"
-engine = create_engine(f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
-
 # --- Interactive filters ---
 st.sidebar.header("Query Controls")
 
-# Get available coins from DB
-coins_query = "SELECT DISTINCT coin_id FROM market_history ORDER BY coin_id"
-available_coins = pd.read_sql(coins_query, engine)["coin_id"].tolist()
+# Get available coins (cached until the next load)
+available_coins = data.available_coins()
 
 coin_selected = st.sidebar.selectbox("Select a coin:", available_coins, index=0)
-n_records = st.sidebar.slider("Number of records", min_value=50, max_value=1000, step=50, value=200)
-
-# --- Query with filters ---
-query = f"""
-    SELECT ts, price_eur
-    FROM market_history
-    WHERE coin_id = '{coin_selected}'
-    ORDER BY ts DESC
-    LIMIT {n_records}
-"""
-df = pd.read_sql(query, engine)
-df["ts"] = pd.to_datetime(df["ts"], utc=True, errors="coerce")
-df = df.sort_values("ts")  # ascending for chart
+time_range = st.sidebar.select_slider("Time range", options=list(data.TIME_RANGES), value="30d")
+mode = st.sidebar.radio("Downsampling", data.MODES, index=data.MODES.index("lttb"),
+                        help="lttb keeps the most representative points; ohlc shows per-bucket open/high/low/close")
+
+# --- Query with filters (bound parameters, downsampled to the chart width, cached per load version) ---
+fig, ax = plt.subplots(figsize=(8,4))
+n_points = data.target_points(fig.get_figwidth() * fig.dpi)
+df = data.series(coin_selected, time_range, n_points, mode)
 
 # --- Display data ---
-st.subheader(f"Last {n_records} records for {coin_selected}")
+st.subheader(f"{coin_selected} over {time_range} ({len(df)} points)")
 st.dataframe(df)
 
 # --- Plot ---
-fig, ax = plt.subplots(figsize=(8,4))
-ax.plot(df["ts"], df["price_eur"], marker="o", linestyle="-")
+if mode == "ohlc":
+    ax.fill_between(df["ts"], df["low"], df["high"], alpha=0.25, label="high/low")
+    ax.plot(df["ts"], df["close"], linestyle="-", label="close")
+    ax.legend()
+else:
+    ax.plot(df["ts"], df["price_eur"], marker="o", markersize=2, linestyle="-")
 ax.set_title(f"{coin_selected.capitalize()} price (EUR)")
 ax.set_xlabel("Timestamp")
 ax.set_ylabel("Price (EUR)")
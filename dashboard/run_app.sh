@@ -2,6 +2,7 @@
 
 # Script to launch the Streamlit app from the virtual environment
 # Usage: ./run_app.sh
+# The dashboard reads through the read API: start it first (src/run_api.sh)
 
 PROJECT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
 VENV_STREAMLIT="$PROJECT_DIR/venv/bin/streamlit"
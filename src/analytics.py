@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+analytics.py
+Derived metrics stage, run by load.py after every load (same transaction).
+
+Daily closes from market_history_daily are pivoted onto an aligned grid (one
+row per day, one column per coin, NaN where a coin has no close) and every
+metric is computed with NumPy over that wide array at once:
+
+- log returns, rolling mean of the close and annualized rolling volatility
+  of the log returns over ROLLING_WINDOWS days      → metrics_returns
+- annualized Sharpe ratio from daily simple returns  → metrics_sharpe
+- pairwise correlation of the log returns over the
+  last CORR_WINDOW days                              → metrics_correlation
+
+Incremental: only coins whose load watermark moved past the one recorded in
+metrics_sharpe are refreshed, and for those only the buckets from the last
+computed one onwards (plus the rolling look-back) are read and rewritten.
+The correlation matrix covers a trailing window, so it is recomputed
+whenever anything changed; on a daily grid that is a small matrix product.
+
+Usage:
+    python src/analytics.py           # incremental refresh
+    python src/analytics.py --full    # recompute every coin
+"""
+
+import argparse
+import datetime as dt
+import sys
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import frames
+
+TRADING_DAYS = 365  # crypto trades every day
+
+# Rolling windows in days (one ma_<w> / vol_<w> column pair each, see 0006_metrics.sql)
+ROLLING_WINDOWS = (7, 30)
+
+# Trailing window of the correlation matrix, and the least overlap a pair needs
+CORR_WINDOW = 90
+MIN_CORR_OBS = 10
+
+
+# --- Vectorized metrics over a (time × coin) array ---
+def daily_grid(df, ts="bucket", value="close"):
+    """Long (coin_id, ts, value) rows → wide frame on a complete daily index."""
+    wide = df.pivot(index=ts, columns="coin_id", values=value).sort_index()
+    if wide.empty:
+        return wide
+    return wide.reindex(pd.date_range(wide.index[0], wide.index[-1], freq="D"))
+
+
+def log_returns(closes):
+    out = np.full(closes.shape, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[1:] = np.diff(np.log(closes), axis=0)
+    return out
+
+
+def rolling_sums(a, w):
+    """Per-column (count, sum, sum of squares) of the non-NaN values in each trailing window of `w` rows."""
+    valid = ~np.isnan(a)
+    x = np.where(valid, a, 0.0)
+
+    def window(c):
+        c = np.cumsum(c, axis=0)
+        c[w:] -= c[:-w].copy()
+        return c
+
+    return window(valid.astype(float)), window(x), window(x * x)
+
+
+def rolling_mean(a, w):
+    """Mean over the trailing `w` rows; NaN unless all of them are present."""
+    n, s, _ = rolling_sums(a, w)
+    return np.where(n == w, s / w, np.nan)
+
+
+def rolling_std(a, w):
+    """Sample standard deviation over the trailing `w` rows; NaN unless all are present."""
+    n, s, ss = rolling_sums(a, w)
+    var = np.maximum((ss - s * s / w) / (w - 1), 0.0)
+    return np.where(n == w, np.sqrt(var), np.nan)
+
+
+def sharpe_ratios(log_ret, periods=TRADING_DAYS):
+    """Annualized Sharpe ratio per column from simple returns (NaN without variance)."""
+    simple = np.expm1(log_ret)
+    valid = ~np.isnan(simple)
+    n = valid.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(valid, simple, 0.0).sum(axis=0) / n
+        std = np.sqrt((np.where(valid, simple - mean, 0.0) ** 2).sum(axis=0) / (n - 1))
+        return np.where(std > 0, mean / std * np.sqrt(periods), np.nan)
+
+
+def correlation_matrix(returns, min_obs=MIN_CORR_OBS):
+    """
+    Pairwise-complete Pearson correlation between columns, from a handful of
+    matrix products over the NaN mask. Returns (corr, n_obs); corr is NaN for
+    pairs with fewer than `min_obs` common rows.
+    """
+    mask = (~np.isnan(returns)).astype(float)
+    x = np.where(mask > 0, returns, 0.0)
+    n = mask.T @ mask
+    sx = x.T @ mask          # sx[i, j]: sum of column i over the rows where j is present too
+    sxx = (x * x).T @ mask
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = x.T @ x - sx * sx.T / n
+        var = sxx - sx * sx / n
+        corr = cov / np.sqrt(var * var.T)
+    corr[n < min_obs] = np.nan
+    return np.clip(corr, -1.0, 1.0), n.astype(np.int64)
+
+
+def returns_frame(wide):
+    """Every metrics_returns column for the whole grid, as a dict of (time × coin) arrays."""
+    closes = wide.to_numpy(dtype=float)
+    log_ret = log_returns(closes)
+    arrays = {"close": closes, "log_return": log_ret}
+    for w in ROLLING_WINDOWS:
+        arrays[f"ma_{w}"] = rolling_mean(closes, w)
+        arrays[f"vol_{w}"] = rolling_std(log_ret, w) * np.sqrt(TRADING_DAYS)
+    return arrays
+
+
+# --- Refresh ---
+def stale_coins(conn, full=False):
+    """{coin_id: last computed bucket or None} of the coins with data newer than their metrics."""
+    rows = conn.execute(text("""
+        SELECT w.coin_id, s.last_bucket
+        FROM load_watermarks w
+        LEFT JOIN metrics_sharpe s ON s.coin_id = w.coin_id
+        WHERE :full OR s.last_ts IS NULL OR w.max_ts > s.last_ts
+    """), {"full": full}).fetchall()
+    return {coin_id: None if full else last for coin_id, last in rows}
+
+
+def read_closes(conn, start=None):
+    df = frames.read_sql(text(f"""
+        SELECT coin_id, bucket, close FROM market_history_daily
+        {"WHERE bucket >= :start" if start is not None else ""}
+    """), conn, params={"start": start})
+    df["bucket"] = pd.to_datetime(df["bucket"])
+    return df
+
+
+def write_returns(conn, wide, cutoffs):
+    """Upsert the metrics_returns rows of the stale coins from their cutoff bucket on."""
+    from load import bulk_load
+
+    coins = [c for c in wide.columns if c in cutoffs]
+    arrays = {k: v[:, wide.columns.get_indexer(coins)] for k, v in returns_frame(wide).items()}
+    floor = pd.DatetimeIndex([cutoffs[c] for c in coins]).to_numpy()  # NaT: every bucket
+    buckets = wide.index.to_numpy()
+    keep = ((buckets[:, None] >= floor[None, :]) | np.isnat(floor)[None, :]) & ~np.isnan(arrays["close"])
+    t, c = np.nonzero(keep)
+    df = pd.DataFrame({"coin_id": np.asarray(coins, dtype=object)[c], "bucket": buckets[t]})
+    for name, values in arrays.items():
+        df[name] = values[t, c]
+    _, written = bulk_load(conn, [df], "metrics_returns", upsert=True)
+    return written
+
+
+def write_sharpe(conn, coins):
+    """Recompute metrics_sharpe of `coins` from their daily rows in metrics_returns."""
+    conn.execute(text("""
+        INSERT INTO metrics_sharpe AS s
+            (coin_id, n_returns, mean_return, std_return, sharpe, last_bucket, last_ts, updated_at)
+        SELECT r.coin_id, COUNT(r.log_return), AVG(exp(r.log_return) - 1),
+               STDDEV_SAMP(exp(r.log_return) - 1),
+               AVG(exp(r.log_return) - 1) / NULLIF(STDDEV_SAMP(exp(r.log_return) - 1), 0) * sqrt(:periods),
+               MAX(r.bucket), w.max_ts, now()
+        FROM metrics_returns r
+        JOIN load_watermarks w ON w.coin_id = r.coin_id
+        WHERE r.coin_id = ANY(:coins)
+        GROUP BY r.coin_id, w.max_ts
+        ON CONFLICT (coin_id) DO UPDATE SET
+            n_returns = EXCLUDED.n_returns, mean_return = EXCLUDED.mean_return,
+            std_return = EXCLUDED.std_return, sharpe = EXCLUDED.sharpe,
+            last_bucket = EXCLUDED.last_bucket, last_ts = EXCLUDED.last_ts,
+            updated_at = EXCLUDED.updated_at
+    """), {"coins": list(coins), "periods": TRADING_DAYS})
+
+
+def write_correlation(conn, wide):
+    """Replace metrics_correlation with the matrix over the last CORR_WINDOW days of the grid."""
+    from load import bulk_load
+
+    window = wide.iloc[-CORR_WINDOW - 1:]
+    corr, n = correlation_matrix(log_returns(window.to_numpy(dtype=float))[1:])
+    a, b = np.triu_indices(len(wide.columns), k=1)
+    keep = n[a, b] >= MIN_CORR_OBS
+    a, b = a[keep], b[keep]
+    coins = np.asarray(wide.columns, dtype=object)
+    df = pd.DataFrame({
+        "coin_a": coins[a], "coin_b": coins[b], "n_obs": n[a, b], "corr": corr[a, b],
+        "window_start": window.index[1] if len(window) > 1 else window.index[0],
+        "window_end": window.index[-1],
+    })
+    conn.execute(text("DELETE FROM metrics_correlation"))
+    _, written = bulk_load(conn, [df], "metrics_correlation")
+    return written
+
+
+def refresh_metrics(conn, full=False):
+    """Bring the metrics_* tables up to date. Returns the number of coins refreshed."""
+    cutoffs = stale_coins(conn, full)
+    if not cutoffs:
+        return 0
+
+    # Read back far enough for the rolling windows of the earliest cutoff and
+    # for the trailing correlation window
+    latest = conn.execute(text("SELECT MAX(bucket) FROM market_history_daily")).scalar()
+    if latest is None:
+        return 0
+    lookback = dt.timedelta(days=max(ROLLING_WINDOWS) + 1)
+    starts = [c - lookback if c is not None else None for c in cutoffs.values()]
+    start = None if None in starts else min(min(starts), latest - dt.timedelta(days=CORR_WINDOW + 1))
+
+    wide = daily_grid(read_closes(conn, start))
+    cutoffs = {c: pd.Timestamp(t) if t is not None else None for c, t in cutoffs.items() if c in wide.columns}
+    if not cutoffs:
+        return 0
+    rows = write_returns(conn, wide, cutoffs)
+    write_sharpe(conn, cutoffs)
+    pairs = write_correlation(conn, wide)
+    print(f"Refreshed metrics for {len(cutoffs)} coins ({rows} daily rows, {pairs} correlation pairs)")
+    return len(cutoffs)
+
+
+# --- Readers ---
+def read_sharpe(conn, coins=None):
+    """metrics_sharpe as a frame indexed by coin_id (column "sharpe", 0 without variance)."""
+    df = pd.read_sql(text(f"""
+        SELECT coin_id, sharpe FROM metrics_sharpe
+        {"WHERE coin_id = ANY(:coins)" if coins else ""}
+        ORDER BY coin_id
+    """), conn, params={"coins": list(coins or [])}, index_col="coin_id")
+    return df.fillna(0.0)
+
+
+def read_correlation(conn, coins=None):
+    """metrics_correlation as a symmetric coin × coin frame (1 on the diagonal)."""
+    df = pd.read_sql(text(f"""
+        SELECT coin_a, coin_b, corr FROM metrics_correlation
+        {"WHERE coin_a = ANY(:coins) AND coin_b = ANY(:coins)" if coins else ""}
+    """), conn, params={"coins": list(coins or [])})
+    return square(df)
+
+
+def square(pairs):
+    """(coin_a, coin_b, corr) upper-triangle rows → symmetric matrix frame."""
+    both = pd.concat([pairs, pairs.rename(columns={"coin_a": "coin_b", "coin_b": "coin_a"})])
+    matrix = both.pivot(index="coin_a", columns="coin_b", values="corr")
+    coins = sorted(set(matrix.index) | set(matrix.columns))
+    matrix = matrix.reindex(index=coins, columns=coins)
+    np.fill_diagonal(matrix.values, 1.0)
+    matrix.index.name = matrix.columns.name = "coin_id"
+    return matrix
+
+
+def read_price_stats(conn):
+    """
+    price_stats (analysis/summary.py) as the summary table: avg_price, sample
+    variance/stddev (like pandas .var()), min/max price, growth, relative
+    volatility and the time range, indexed by coin_id.
+    """
+    df = pd.read_sql(text("""
+        SELECT coin_id, n, mean, m2, min_price, max_price, start_date, end_date
+        FROM price_stats ORDER BY coin_id
+    """), conn, index_col="coin_id")
+    return moments_table(df)
+
+
+def moments_table(df):
+    """price_stats rows (n, mean, m2, min/max price, date range) → the summary table."""
+    stats = pd.DataFrame(index=df.index)
+    stats["avg_price"] = df["mean"]
+    stats["variance"] = df["m2"] / (df["n"] - 1).where(df["n"] > 1)
+    stats["stddev"] = np.sqrt(stats["variance"])
+    stats["min_price"] = df["min_price"]
+    stats["max_price"] = df["max_price"]
+    return summary_table(stats, df[["start_date", "end_date"]])
+
+
+def local_price_stats():
+    """read_price_stats() computed from the local store, vectorized in pyarrow."""
+    import pyarrow.compute as pc
+
+    import localstore
+
+    sample = pc.VarianceOptions(ddof=1)
+    table = localstore.history_table(columns=["price_eur"])
+    df = table.group_by("coin_id").aggregate([
+        ("price_eur", "mean"), ("price_eur", "variance", sample), ("price_eur", "stddev", sample),
+        ("price_eur", "min"), ("price_eur", "max"), ("ts", "min"), ("ts", "max"),
+    ]).to_pandas().set_index("coin_id").sort_index()
+    df.columns = ["avg_price", "variance", "stddev", "min_price", "max_price", "start_date", "end_date"]
+    return summary_table(df.drop(columns=["start_date", "end_date"]), df[["start_date", "end_date"]])
+
+
+def summary_table(stats, ranges):
+    """Add percentage growth and relative volatility (coefficient of variation), then the ranges."""
+    stats["pct_growth"] = (stats["max_price"] - stats["min_price"]) / stats["min_price"] * 100
+    stats["rel_volatility_pct"] = (stats["stddev"] / stats["avg_price"]) * 100
+    return stats.join(ranges)
+
+
+def local_metrics(daily):
+    """
+    (sharpe frame, correlation matrix) from long daily closes (coin_id, ts,
+    price_eur), for analysis backends without the metrics tables.
+    """
+    wide = daily_grid(daily, ts="ts", value="price_eur")
+    log_ret = log_returns(wide.to_numpy(dtype=float))
+    sharpe = pd.DataFrame({"sharpe": sharpe_ratios(log_ret)}, index=wide.columns).fillna(0.0)
+    corr, _ = correlation_matrix(log_ret[-CORR_WINDOW:])
+    matrix = pd.DataFrame(corr, index=wide.columns, columns=wide.columns)
+    np.fill_diagonal(matrix.values, 1.0)
+    return sharpe, matrix
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Refresh the derived metrics_* tables")
+    ap.add_argument("--full", action="store_true", help="recompute every coin from the whole history")
+    args = ap.parse_args(argv)
+
+    from db import get_engine
+    from migrate import upgrade
+
+    with get_engine().begin() as conn:
+        upgrade(conn)
+        refresh_metrics(conn, args.full)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
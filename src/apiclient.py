@@ -0,0 +1,53 @@
+"""
+apiclient.py
+Python client of the read API (src/readapi.py), used by the dashboard and
+the notebook instead of opening their own database connections.
+
+Tables travel as Arrow IPC streams and come back as DataFrames with their
+dtypes intact (categoricals, UTC timestamps). One keep-alive session per
+process.
+
+    import apiclient
+    apiclient.get("/history", coins="bitcoin", days=30, points=500, mode="ohlc")
+"""
+
+import pyarrow as pa
+import requests
+
+import config
+
+API_URL = config.READ_API_URL
+API_TIMEOUT = config.READ_API_TIMEOUT
+
+_session = None
+
+
+def session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def request(path, **params):
+    """GET `path` with the non-None `params` (lists are sent comma-separated)."""
+    params = {k: ",".join(v) if isinstance(v, (list, tuple)) else v for k, v in params.items() if v is not None}
+    resp = session().get(API_URL.rstrip("/") + path, params=params, timeout=API_TIMEOUT)
+    if resp.status_code >= 400:
+        try:
+            message = resp.json()["error"]
+        except ValueError:
+            message = resp.text
+        raise RuntimeError(f"{path}: HTTP {resp.status_code}: {message}")
+    return resp
+
+
+def get(path, **params):
+    """A table endpoint as a DataFrame."""
+    resp = request(path, format="arrow", **params)
+    return pa.ipc.open_stream(resp.content).read_pandas()
+
+
+def version():
+    """Current load version: cache keys built on it stay valid until the next load."""
+    return request("/version").json()["version"]
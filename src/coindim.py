@@ -0,0 +1,153 @@
+"""
+coindim.py
+Coin dimension: one row per coin with a stable surrogate integer key.
+
+    coin_key (int32), coin_id, symbol, name, first_seen, last_seen
+
+Persisted as data/processed/coins.parquet (the file load.py and the local
+store already read). transform.py folds the coins of each run in with
+update(): new coins get the next free key, symbol/name changes are applied
+in place, and only the rows that changed are reported back so load.py can
+apply just those. Updates hold an exclusive lock (data/state/coins.lock) and
+replace the file atomically, so concurrent runs can't lose each other's
+coins. Reads are memoized on the file's mtime.
+
+Keys never change once assigned. encode() maps coin_ids to them, so frames
+and joins can carry a compact int32 instead of the text id.
+"""
+
+import contextlib
+import fcntl
+import os
+import pathlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from dataset import PROCESSED_DIR
+from state import STATE_DIR
+
+DIM_FILE = PROCESSED_DIR / "coins.parquet"
+LEGACY_CSV = PROCESSED_DIR / "coins.csv"
+LOCK_FILE = STATE_DIR / "coins.lock"
+
+COLUMNS = ["coin_key", "coin_id", "symbol", "name", "first_seen", "last_seen"]
+ATTRIBUTES = ["symbol", "name"]
+
+_cache = {"stamp": None, "dim": None, "keys": None}
+
+
+def snapshot_time(snapshot_id):
+    """'20250101T120000Z[-sIofK]' → naive UTC Timestamp."""
+    return pd.to_datetime(snapshot_id[:16], format="%Y%m%dT%H%M%SZ")
+
+
+@contextlib.contextmanager
+def locked():
+    """Exclusive inter-process lock around a read-modify-write of the dimension."""
+    LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_FILE, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def empty():
+    return pd.DataFrame({
+        "coin_key": pd.Series(dtype="int32"), "coin_id": pd.Series(dtype=object),
+        "symbol": pd.Series(dtype=object), "name": pd.Series(dtype=object),
+        "first_seen": pd.Series(dtype="datetime64[ns]"), "last_seen": pd.Series(dtype="datetime64[ns]"),
+    })
+
+
+def _load():
+    """Read the dimension from disk, upgrading pre-dimension coins files (no keys yet)."""
+    if DIM_FILE.exists():
+        dim = pd.read_parquet(DIM_FILE)
+    elif LEGACY_CSV.exists():
+        dim = pd.read_csv(LEGACY_CSV)
+    else:
+        return empty()
+    if "coin_key" not in dim.columns:
+        dim = dim.drop_duplicates("coin_id", keep="last").reset_index(drop=True)
+        dim.insert(0, "coin_key", np.arange(1, len(dim) + 1, dtype="int32"))
+        dim["first_seen"] = dim["last_seen"] = pd.NaT
+    return dim[COLUMNS].astype({"coin_key": "int32", "first_seen": "datetime64[ns]", "last_seen": "datetime64[ns]"})
+
+
+def read():
+    """The whole dimension (memoized until the file changes). Don't modify the result."""
+    stamp = DIM_FILE.stat().st_mtime_ns if DIM_FILE.exists() else None
+    if _cache["dim"] is None or stamp != _cache["stamp"]:
+        dim = _load()
+        _cache.update(stamp=stamp, dim=dim, keys=pd.Series(dim["coin_key"].to_numpy(), index=dim["coin_id"]))
+    return _cache["dim"]
+
+
+def lookup():
+    """coin_id → coin_key as a Series (memoized with read())."""
+    read()
+    return _cache["keys"]
+
+
+def encode(coin_ids):
+    """int32 coin_key for each coin_id (-1 for coins not in the dimension)."""
+    return lookup().reindex(pd.Index(coin_ids)).fillna(-1).to_numpy(dtype="int32")
+
+
+def write(dim):
+    """Atomically replace the dimension file (temp file + rename)."""
+    DIM_FILE.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=DIM_FILE.parent, prefix=".coins.", suffix=".tmp")
+    os.close(fd)
+    try:
+        dim.to_parquet(tmp, index=False)
+        os.replace(tmp, DIM_FILE)
+    except BaseException:
+        pathlib.Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def update(coins, seen_at):
+    """
+    Fold `coins` (coin_id, symbol, name; later rows win) seen at `seen_at`
+    (Timestamp, or a Series aligned with `coins`) into the dimension. Returns
+    the dimension rows that are new or whose attributes changed.
+    """
+    seen = pd.Series(seen_at, index=coins.index) if not isinstance(seen_at, pd.Series) else seen_at
+    incoming = coins[["coin_id", *ATTRIBUTES]].assign(seen=pd.to_datetime(seen))
+    span = incoming.groupby("coin_id")["seen"].agg(["min", "max"])
+    incoming = incoming.drop_duplicates("coin_id", keep="last").set_index("coin_id")
+
+    with locked():
+        dim = _load().set_index("coin_id")
+        known = incoming.index.isin(dim.index)
+
+        # Coins already in the dimension: apply attribute changes only
+        old = dim.loc[incoming.index[known], ATTRIBUTES]
+        new_vals = incoming.loc[known, ATTRIBUTES]
+        differs = ~((old == new_vals) | (old.isna() & new_vals.isna())).all(axis=1)
+        changed = list(differs.index[differs])
+        dim.loc[changed, ATTRIBUTES] = new_vals.loc[changed]
+
+        # New coins: next free keys, in arrival order
+        added = incoming.index[~known]
+        start = int(dim["coin_key"].max()) + 1 if len(dim) else 1
+        new_rows = incoming.loc[added, ATTRIBUTES].assign(
+            coin_key=np.arange(start, start + len(added), dtype="int32"), first_seen=pd.NaT, last_seen=pd.NaT)
+        dim = pd.concat([dim, new_rows]) if len(dim) else new_rows
+
+        ids = span.index
+        dim.loc[ids, "first_seen"] = dim.loc[ids, "first_seen"].where(
+            dim.loc[ids, "first_seen"] <= span["min"], span["min"])
+        dim.loc[ids, "last_seen"] = dim.loc[ids, "last_seen"].where(
+            dim.loc[ids, "last_seen"] >= span["max"], span["max"])
+
+        dim = dim.reset_index()[COLUMNS].astype({"coin_key": "int32"})
+        write(dim)
+
+    touched = set(changed) | set(added)
+    return dim[dim["coin_id"].isin(touched)].reset_index(drop=True)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+compact.py
+Compacts the partitioned Parquet datasets in data/processed/.
+
+Each transform run appends one small part file per month partition. This
+merges the parts of every month into a single file, deduplicated on
+(coin_id, ts) for market_history, (snapshot_id, coin_id) for
+market_snapshots and (currency, ts) for fx_rates, sorted and written with large row groups.
+
+Parts of runs that are still waiting to be loaded are left untouched.
+
+Usage:
+    python src/compact.py
+"""
+
+import argparse
+import sys
+
+from dataset import FX_DIR, HISTORY_DIR, SNAPSHOTS_DIR, compact_partition
+from frames import HISTORY_SCHEMA, RATES_SCHEMA
+from state import read_manifest
+
+DATASETS = {
+    "market_history": (HISTORY_DIR, ("coin_id", "ts"), HISTORY_SCHEMA),
+    "market_snapshots": (SNAPSHOTS_DIR, ("snapshot_id", "coin_id"), None),
+    "fx_rates": (FX_DIR, ("currency", "ts"), RATES_SCHEMA),
+}
+
+
+def run_id_of(part):
+    """part-<run_id>[-c...].parquet → run_id"""
+    stem = part.stem[len("part-"):]
+    while stem.endswith("-c"):
+        stem = stem[:-2]
+    return stem
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Merge small Parquet parts per month partition")
+    ap.add_argument("--dataset", choices=sorted(DATASETS), action="append",
+                    help="dataset to compact (default: all)")
+    args = ap.parse_args(argv)
+
+    runs = read_manifest()["runs"]
+
+    def loaded(part):
+        info = runs.get(run_id_of(part))
+        return info is None or info["loaded"]
+
+    for name in args.dataset or sorted(DATASETS):
+        root, key, schema = DATASETS[name]
+        if not root.exists():
+            continue
+        for part_dir in sorted(root.glob("month=*")):
+            merged, before, after = compact_partition(part_dir, keep=loaded, key=key, schema=schema)
+            if merged:
+                print(f"{name}/{part_dir.name}: {merged} parts, {before} → {after} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
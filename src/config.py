@@ -0,0 +1,87 @@
+"""
+config.py
+Every setting read from the environment, in one place. Modules take their
+values from here instead of calling os.getenv themselves or hard-coding
+them (database credentials used to be copied into five files).
+
+Standard library only, and nothing is created at import: importing it costs
+nothing, so any script can do it before it knows what it will need. The
+database engine itself is created on first use by db.get_engine().
+
+PostgreSQL uses the libpq variable names (PGHOST, PGPORT, PGUSER,
+PGPASSWORD, PGDATABASE), so psql/pg_dump read the same ones. DATABASE_URL,
+when set, overrides them for SQLAlchemy.
+"""
+
+import os
+from urllib.parse import quote_plus
+
+
+def env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def env_float(name, default):
+    return float(os.getenv(name, str(default)))
+
+
+def env_flag(name, default=False):
+    return os.getenv(name, "1" if default else "0") == "1"
+
+
+def env_list(name, default):
+    """Comma-separated, lower-cased list."""
+    return [v.strip().lower() for v in os.getenv(name, default).split(",") if v.strip()]
+
+
+# --- PostgreSQL ---
+PGHOST = os.getenv("PGHOST", "localhost")
+PGPORT = os.getenv("PGPORT", "5432")
+PGUSER = os.getenv("PGUSER", "ricardo")
+PGPASSWORD = os.getenv("PGPASSWORD", "crypto")
+PGDATABASE = os.getenv("PGDATABASE", "crypto")
+DATABASE_URL = os.getenv("DATABASE_URL") or (
+    f"postgresql+psycopg2://{quote_plus(PGUSER)}:{quote_plus(PGPASSWORD)}@{PGHOST}:{PGPORT}/{PGDATABASE}"
+)
+
+# --- Extraction (extract.py) ---
+# A local server (e.g. benchmarks/stub_api.py) can stand in for the API
+COINGECKO_BASE_URL = os.getenv("COINGECKO_BASE_URL", "https://api.coingecko.com/api/v3")
+COINGECKO_RATE_PER_MIN = env_float("COINGECKO_RATE_PER_MIN", 10)
+COINGECKO_RATE_BURST = env_int("COINGECKO_RATE_BURST", 2)
+EXTRACT_WORKERS = env_int("EXTRACT_WORKERS", 4)
+UNIVERSE_SIZE = env_int("UNIVERSE_SIZE", 5)
+RAW_FORMAT = os.getenv("RAW_FORMAT", "json")
+
+# --- Multi-currency quotes (fx.py) ---
+BASE_CURRENCY = "eur"
+QUOTE_CURRENCIES = env_list("QUOTE_CURRENCIES", BASE_CURRENCY)
+FX_REFERENCE_COIN = os.getenv("FX_REFERENCE_COIN", "bitcoin")
+FX_REFERENCE_SYMBOL = os.getenv("FX_REFERENCE_SYMBOL", "btc")
+
+# --- Transform / storage ---
+WRITE_CSV = env_flag("WRITE_CSV")
+HISTORY_FLOAT32 = env_flag("HISTORY_FLOAT32")
+LOCAL_STORE = env_flag("LOCAL_STORE", True)
+ANALYSIS_BACKENDS = ("postgres", "local")
+ANALYSIS_BACKEND = os.getenv("ANALYSIS_BACKEND", "postgres")
+
+# --- Streaming ingestion (stream.py) ---
+STREAM_INTERVAL = env_float("STREAM_INTERVAL", 30)
+STREAM_BATCH_ROWS = env_int("STREAM_BATCH_ROWS", 5000)
+STREAM_FLUSH_SECONDS = env_float("STREAM_FLUSH_SECONDS", 5)
+STREAM_QUEUE_SIZE = env_int("STREAM_QUEUE_SIZE", 8)
+
+# --- Read API (readapi.py, apiclient.py) ---
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = env_int("API_PORT", 8800)
+API_POOL_SIZE = env_int("API_POOL_SIZE", 4)
+API_VERSION_TTL = env_float("API_VERSION_TTL", 5)
+API_CACHE_ENTRIES = env_int("API_CACHE_ENTRIES", 512)
+READ_API_URL = os.getenv("READ_API_URL", f"http://{API_HOST}:{API_PORT}")
+READ_API_TIMEOUT = env_float("READ_API_TIMEOUT", 60)
+
+# --- Backups (backup/backup.py) ---
+BACKUP_CHUNK_MB = env_int("BACKUP_CHUNK_MB", 4)
+BACKUP_WORKERS = env_int("BACKUP_WORKERS", min(8, os.cpu_count() or 1))
+BACKUP_KEEP = env_int("BACKUP_KEEP", 10)  # snapshots / full dumps kept
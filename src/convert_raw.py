@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+convert_raw.py
+Converts the backlog of pretty-printed .json raw files in data/raw/ to the
+compact .ndjson.gz format and rewrites the snapshot metadata to point at the
+new files. Snapshot metadata (snapshot_*.json) itself stays as plain JSON.
+
+Usage:
+    python src/convert_raw.py            # convert, keep the original .json files
+    python src/convert_raw.py --delete   # convert and remove the originals
+"""
+
+import argparse
+import json
+import pathlib
+
+from rawio import iter_records, read_chart, write_ndjson
+from state import write_json
+
+RAW_DIR = pathlib.Path(__file__).resolve().parents[1] / "data" / "raw"
+
+
+def convert_file(src):
+    """Convert one raw .json file; returns the new file path."""
+    dst = src.with_name(src.name[:-len(".json")] + ".ndjson.gz")
+    write_ndjson(dst, iter_records(read_chart(src)))
+    return dst
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Convert raw .json files to .ndjson.gz")
+    ap.add_argument("--delete", action="store_true", help="remove the original .json files")
+    args = ap.parse_args(argv)
+
+    bytes_before = bytes_after = converted = 0
+    for meta_file in sorted(RAW_DIR.glob("snapshot_*.json")):
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        files, originals = [], []
+        for fname in meta["files"]:
+            src = RAW_DIR / fname
+            if not fname.endswith(".json") or not src.exists():
+                files.append(fname)
+                continue
+            dst = convert_file(src)
+            bytes_before += src.stat().st_size
+            bytes_after += dst.stat().st_size
+            converted += 1
+            files.append(dst.name)
+            originals.append(src)
+
+        if originals:
+            # Point the metadata at the new files before touching the originals
+            meta["files"] = files
+            write_json(meta_file, meta)
+            if args.delete:
+                for src in originals:
+                    src.unlink()
+            print(f"Converted {len(originals)} files of {meta_file.name}")
+
+    ratio = bytes_after / bytes_before if bytes_before else 0
+    print(f"Converted {converted} files: {bytes_before:,} → {bytes_after:,} bytes ({ratio:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+dataset.py
+Hive-partitioned Parquet datasets under data/processed/.
+
+Layout:
+    data/processed/market_history/month=YYYY-MM/part-<run_id>.parquet
+    data/processed/market_snapshots/month=YYYY-MM/part-<run_id>.parquet
+    data/processed/fx_rates/month=YYYY-MM/part-<run_id>.parquet (fx.py)
+
+Every transform run appends one part file per month it touches. Rows are
+sorted by (coin_id, ts) inside each row group, coin_id/snapshot_id are
+dictionary-encoded (market_history is written with frames.HISTORY_SCHEMA, so
+they read back as categoricals) and column statistics are written, so readers can prune
+whole partitions by month and row groups by coin_id/ts (predicate pushdown).
+compact_partition() merges the parts of a month into a single file, deduped on
+(coin_id, ts).
+"""
+
+import pathlib
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from frames import HISTORY_SCHEMA
+
+PROCESSED_DIR = pathlib.Path(__file__).resolve().parents[1] / "data" / "processed"
+HISTORY_DIR = PROCESSED_DIR / "market_history"
+SNAPSHOTS_DIR = PROCESSED_DIR / "market_snapshots"
+FX_DIR = PROCESSED_DIR / "fx_rates"
+
+PARTITIONING = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+# Parts written before HISTORY_SCHEMA (plain strings, float64) are cast to it on read
+HISTORY_DATASET_SCHEMA = HISTORY_SCHEMA.append(pa.field("month", pa.string()))
+ROW_GROUP_ROWS = 128 * 1024
+WRITE_OPTIONS = {
+    "compression": "zstd",
+    "use_dictionary": ["coin_id", "snapshot_id"],
+    "write_statistics": True,
+}
+
+
+def month_key(ts):
+    """datetime64 Series → 'YYYY-MM' partition values."""
+    return ts.dt.strftime("%Y-%m")
+
+
+def part_name(run_id):
+    return f"part-{run_id}.parquet"
+
+
+class PartitionedWriter:
+    """
+    Streams DataFrames into month=YYYY-MM/part-<run_id>.parquet files,
+    keeping one open ParquetWriter per month touched by the run. The schema
+    is `schema` when given, else that of the first table written.
+    """
+
+    def __init__(self, root, run_id, ts_column="ts", sort_by=("coin_id", "ts"), schema=None):
+        self.root = pathlib.Path(root)
+        self.run_id = run_id
+        self.ts_column = ts_column
+        self.sort_by = list(sort_by)
+        self.writers = {}
+        self.schema = schema
+        self.rows = 0
+
+    def write(self, df, month=None):
+        """Append `df`; rows are routed by the month of `ts_column` unless `month` is given."""
+        if df.empty:
+            return
+        df = df.sort_values(self.sort_by, ignore_index=True)
+        months = pd.Series(month, index=df.index) if month else month_key(df[self.ts_column])
+        for key, part in df.groupby(months, sort=True):
+            table = pa.Table.from_pandas(part, preserve_index=False, schema=self.schema)
+            if self.schema is None:
+                self.schema = table.schema
+            writer = self.writers.get(key)
+            if writer is None:
+                path = self.root / f"month={key}" / part_name(self.run_id)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                writer = self.writers[key] = pq.ParquetWriter(path, self.schema, **WRITE_OPTIONS)
+            writer.write_table(table, row_group_size=ROW_GROUP_ROWS)
+        self.rows += len(df)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def files(self):
+        """Written part files, relative to PROCESSED_DIR."""
+        return [
+            str((self.root / f"month={key}" / part_name(self.run_id)).relative_to(PROCESSED_DIR))
+            for key in sorted(self.writers)
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- Readers ---
+def history_filter(coins=None, start=None, end=None):
+    """pyarrow filter expression on coin_id / ts, plus the month partitions it implies."""
+    expr = None
+
+    def _and(e):
+        nonlocal expr
+        expr = e if expr is None else expr & e
+
+    if coins is not None:
+        _and(pc.field("coin_id").isin(list(coins)))
+    if start is not None:
+        start = pd.Timestamp(start)
+        _and(pc.field("month") >= start.strftime("%Y-%m"))
+        _and(pc.field("ts") >= pa.scalar(start.tz_localize(None).value, pa.timestamp("ns")))
+    if end is not None:
+        end = pd.Timestamp(end)
+        _and(pc.field("month") <= end.strftime("%Y-%m"))
+        _and(pc.field("ts") <= pa.scalar(end.tz_localize(None).value, pa.timestamp("ns")))
+    return expr
+
+
+def open_dataset(root=HISTORY_DIR, files=None, schema=None):
+    """Open a partitioned dataset (or an explicit list of its part files)."""
+    root = pathlib.Path(root)
+    if files is not None:
+        return ds.dataset([str(PROCESSED_DIR / f) for f in files], format="parquet", schema=schema,
+                          partitioning=PARTITIONING, partition_base_dir=str(root))
+    return ds.dataset(str(root), format="parquet", schema=schema, partitioning=PARTITIONING)
+
+
+def read_history(coins=None, start=None, end=None, columns=None, root=HISTORY_DIR):
+    """
+    Read market_history from the local dataset, pushing the coin and time
+    filters down to partition and row-group level.
+    """
+    if not pathlib.Path(root).exists():
+        return pd.DataFrame(columns=columns)
+    dataset = open_dataset(root, schema=HISTORY_DATASET_SCHEMA)
+    table = dataset.to_table(columns=columns, filter=history_filter(coins, start, end))
+    return table.to_pandas()
+
+
+# --- Compaction ---
+def compact_partition(part_dir, keep=lambda path: True, key=("coin_id", "ts"), schema=None):
+    """
+    Merge the part files of one partition directory into a single file,
+    deduplicated on `key` (later parts win) and sorted for pruning.
+    Only parts for which keep(path) is true are compacted; the merged file
+    is written with `schema` when given.
+    Returns (n_parts_merged, rows_before, rows_after).
+    """
+    part_dir = pathlib.Path(part_dir)
+    parts = sorted(p for p in part_dir.glob("part-*.parquet") if keep(p))
+    if len(parts) < 2:
+        return 0, 0, 0
+
+    df = pd.concat(
+        # ParquetFile.read() so the hive "month" key isn't materialized as a column
+        [pq.ParquetFile(p).read().to_pandas().assign(_order=i) for i, p in enumerate(parts)],
+        ignore_index=True,
+    )
+    rows_before = len(df)
+    df = (
+        df.sort_values(list(key) + ["_order"])
+        .drop_duplicates(list(key), keep="last")
+        .drop(columns="_order")
+        .reset_index(drop=True)
+    )
+
+    # Name after the newest merged part so later runs still sort after it
+    target = part_dir / (parts[-1].stem + "-c.parquet")
+    tmp = part_dir / (".tmp-" + target.name)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False, schema=schema), tmp,
+                   row_group_size=ROW_GROUP_ROWS, **WRITE_OPTIONS)
+    tmp.replace(target)
+    for p in parts:
+        if p != target:
+            p.unlink()
+    return len(parts), rows_before, len(df)
@@ -0,0 +1,31 @@
+"""
+db.py
+The process-wide SQLAlchemy engine, created on first use.
+
+Importing this module imports neither SQLAlchemy nor the driver, and
+nothing connects until a script actually runs a query: --help, --backend
+local and the extractor never pay for them.
+
+    from db import get_engine
+    with get_engine().begin() as conn:
+        ...
+"""
+
+import config
+
+_engine = None
+
+
+def new_engine(**kwargs):
+    """A separate engine on config.DATABASE_URL (e.g. with its own pool settings)."""
+    from sqlalchemy import create_engine
+
+    return create_engine(config.DATABASE_URL, **kwargs)
+
+
+def get_engine():
+    """The shared engine (default pool), created on the first call."""
+    global _engine
+    if _engine is None:
+        _engine = new_engine()
+    return _engine
@@ -0,0 +1,195 @@
+"""
+downsample.py
+Server-side downsampling of market_history for charts.
+
+Given coins, a time range and a target point count (sized to the chart
+width, see target_points), returns about that many points per coin, however
+long the range:
+
+- "ohlc": date_bin() buckets computed in PostgreSQL (14+), one open/high/
+  low/close row per bucket, so spikes survive as high/low.
+- "lttb": Largest-Triangle-Three-Buckets on the close series; keeps the
+  actual points that best preserve the visual shape.
+
+Both read from the coarsest table that is still finer than the bucket width
+(market_history_daily, market_history_hourly or the raw market_history), so
+long ranges transfer rollup rows instead of every point. A range starting
+mid-hour/day is widened to the start of that rollup bucket (floor_to), so
+its first partial bucket is kept.
+"""
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import frames
+
+MODES = ("ohlc", "lttb")
+
+# (granularity, table, ts column, open, high, low, close, point count), coarsest first
+SOURCES = [
+    (dt.timedelta(days=1), "market_history_daily", "bucket", "open", "high", "low", "close", "n_points"),
+    (dt.timedelta(hours=1), "market_history_hourly", "bucket", "open", "high", "low", "close", "n_points"),
+    (dt.timedelta(0), "market_history", "ts", "price_eur", "price_eur", "price_eur", "price_eur", "1"),
+]
+
+# LTTB picks among the input points, so read a few per output bucket
+LTTB_OVERSAMPLE = 4
+
+
+def target_points(width_px, px_per_point=2):
+    """Points worth drawing on a chart `width_px` pixels wide."""
+    return max(int(width_px // px_per_point), 3)
+
+
+def pick_source(step):
+    for source in SOURCES:
+        if step >= source[0]:
+            return source
+    return SOURCES[-1]
+
+
+def floor_to(ts, granularity):
+    """
+    Start of the rollup bucket holding `ts`: rollup rows are keyed by the
+    start of their hour/day, so a range starting mid-bucket must read from
+    the bucket start or it drops the partial first bucket.
+    """
+    if not granularity:
+        return ts
+    return ts - (ts - dt.datetime(1970, 1, 1)) % granularity
+
+
+def naive_utc(ts):
+    ts = pd.Timestamp(ts)
+    return (ts.tz_convert(None) if ts.tzinfo is not None else ts).to_pydatetime()
+
+
+def time_bounds(conn, coins):
+    """(first ts, last ts) of the given coins, two index probes per coin."""
+    return conn.execute(text("""
+        SELECT MIN(first_ts), MAX(last_ts)
+        FROM unnest(CAST(:coins AS text[])) AS c(coin_id)
+        CROSS JOIN LATERAL (
+            SELECT (SELECT ts FROM market_history h WHERE h.coin_id = c.coin_id ORDER BY ts LIMIT 1) AS first_ts,
+                   (SELECT ts FROM market_history h WHERE h.coin_id = c.coin_id ORDER BY ts DESC LIMIT 1) AS last_ts
+        ) b
+    """), {"coins": list(coins)}).one()
+
+
+def resolve_range(conn, coins, start, end):
+    if start is None or end is None:
+        first, last = time_bounds(conn, coins)
+        start = first if start is None else start
+        end = last if end is None else end
+    if start is None or end is None:
+        return None, None
+    return naive_utc(start), naive_utc(end)
+
+
+def ohlc(conn, coins, start=None, end=None, n_points=500):
+    """OHLC buckets of width (end - start) / n_points: coin_id, ts, open, high, low, close, n_points."""
+    start, end = resolve_range(conn, coins, start, end)
+    if start is None:
+        return pd.DataFrame(columns=["coin_id", "ts", "open", "high", "low", "close", "n_points"])
+    step = max((end - start) / max(n_points, 1), dt.timedelta(seconds=1))
+    granularity, table, ts, o, h, lo, c, n = pick_source(step)
+    start = floor_to(start, granularity)
+    df = frames.read_sql(text(f"""
+        SELECT coin_id, date_bin(:step, {ts}, :origin) AS ts,
+               (array_agg({o} ORDER BY {ts}))[1] AS open,
+               MAX({h}) AS high, MIN({lo}) AS low,
+               (array_agg({c} ORDER BY {ts} DESC))[1] AS close,
+               SUM({n}) AS n_points
+        FROM {table}
+        WHERE coin_id = ANY(:coins) AND {ts} >= :start AND {ts} <= :end
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """), conn, params={"step": step, "origin": start, "start": start, "end": end, "coins": list(coins)})
+    df["ts"] = pd.to_datetime(df["ts"], utc=True)
+    return df
+
+
+def lttb(x, y, n_out):
+    """
+    Indices of the `n_out` points of (x, y) chosen by Largest-Triangle-Three-
+    Buckets. Bucket edges and the next-bucket averages are computed for all
+    buckets at once; the remaining loop does one vectorized argmax per bucket.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # First and last points are kept; the n - 2 between go into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+
+def lttb_frame(df, n_points, x="ts", y="price_eur", by="coin_id"):
+    """Apply lttb() to every `by` group of a frame sorted by (by, x)."""
+    keep = []
+    for _, group in df.groupby(by, sort=False, observed=True):
+        group = group.dropna(subset=[y])
+        xs = group[x].astype("int64") if pd.api.types.is_datetime64_any_dtype(group[x]) else group[x]
+        keep.append(group.index.to_numpy()[lttb(xs.to_numpy(), group[y].to_numpy(), n_points)])
+    if not keep:
+        return df.iloc[0:0]
+    return df.loc[np.concatenate(keep)].reset_index(drop=True)
+
+
+def ohlc_frame(df, start, end, n_points=500, x="ts", y="price_eur", by="coin_id"):
+    """ohlc() over an in-memory frame sorted by (by, x), e.g. from the local store."""
+    columns = [by, x, "open", "high", "low", "close", "n_points"]
+    df = df.dropna(subset=[y])
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    step = max((end - start) / max(n_points, 1), pd.Timedelta(seconds=1))
+    bucket = start + (df[x] - start) // step * step
+    out = df.groupby([df[by], bucket.rename(x)], observed=True)[y].agg(
+        open="first", high="max", low="min", close="last", n_points="count").reset_index()
+    return out[columns]
+
+
+def lttb_series(conn, coins, start=None, end=None, n_points=500):
+    """LTTB-thinned close series: coin_id, ts, price_eur."""
+    start, end = resolve_range(conn, coins, start, end)
+    if start is None:
+        return pd.DataFrame(columns=["coin_id", "ts", "price_eur"])
+    step = (end - start) / max(n_points, 1) / LTTB_OVERSAMPLE
+    granularity, table, ts, _, _, _, c, _ = pick_source(step)
+    start = floor_to(start, granularity)
+    df = frames.read_sql(text(f"""
+        SELECT coin_id, {ts} AS ts, {c} AS price_eur
+        FROM {table}
+        WHERE coin_id = ANY(:coins) AND {ts} >= :start AND {ts} <= :end
+        ORDER BY coin_id, {ts}
+    """), conn, params={"start": start, "end": end, "coins": list(coins)})
+    df["ts"] = pd.to_datetime(df["ts"], utc=True)
+    return lttb_frame(df, n_points)
+
+
+def downsample(conn, coins, start=None, end=None, n_points=500, mode="ohlc"):
+    """Dispatch to ohlc() or lttb_series()."""
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+    fn = ohlc if mode == "ohlc" else lttb_series
+    return fn(conn, coins, start, end, n_points)
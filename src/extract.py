@@ -2,30 +2,170 @@
 """
 Script de extracción de datos desde CoinGecko API.
 Guarda los resultados en data/raw/ con un timestamp.
+
+Las descargas de histórico se hacen en paralelo (pool de hilos) compartiendo
+un limitador token-bucket, de modo que el tiempo total depende del límite de
+peticiones de la API y no del número de monedas.
+
+Todo se descarga una sola vez en la divisa base (EUR). Con varias divisas de
+cotización (--currencies / QUOTE_CURRENCIES) se añade solo la serie de
+referencia para el tipo de cambio: el histórico de la moneda de referencia en
+cada divisa extra, una petición por divisa (ver fx.py).
 """
 
+import argparse
+import math
 import requests
 import json
+import random
+import threading
 import time
 import pathlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+import config
+import metrics
+from rawio import FORMATS, iter_records, raw_suffix, write_ndjson
+from state import read_watermarks
 
 # Carpeta donde se guardarán los JSON crudos
 RAW_DIR = pathlib.Path(__file__).resolve().parents[1] / "data" / "raw"
 RAW_DIR.mkdir(parents=True, exist_ok=True)
 
-BASE_URL = "https://api.coingecko.com/api/v3"
+# Se puede apuntar a un servidor local (p.ej. benchmarks/stub_api.py) para pruebas
+BASE_URL = config.COINGECKO_BASE_URL
+
+# Presupuesto de la API: peticiones por minuto y ráfaga máxima permitida
+RATE_PER_MIN = config.COINGECKO_RATE_PER_MIN
+RATE_BURST = config.COINGECKO_RATE_BURST
+MAX_WORKERS = config.EXTRACT_WORKERS
+MAX_BACKOFF = 300  # segundos
+
+# Tamaño del universo (top-N por capitalización) y página máxima de coins/markets
+UNIVERSE_SIZE = config.UNIVERSE_SIZE
+MARKETS_PAGE_SIZE = 250
+
+# Formato de los ficheros crudos: "json" (legible) o "ndjson.gz" (compacto, en streaming)
+RAW_FORMAT = config.RAW_FORMAT
+
+# Ventana de histórico: backfill completo y mínimo que mantiene granularidad horaria
+# (CoinGecko devuelve puntos cada 5 minutos con days=1 y horarios entre 2 y 90 días)
+BACKFILL_DAYS = 60
+MIN_DAYS = 2
+DAY_MS = 24 * 3600 * 1000
+
+
+class TokenBucket:
+    """Limitador token-bucket compartido por todos los hilos de extracción."""
+
+    def __init__(self, rate_per_sec, capacity=1):
+        self.rate = rate_per_sec
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Bloquea hasta obtener un token (o hasta que termine una pausa por 429)."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Detiene a todos los consumidores durante `seconds` y vacía el bucket."""
+        with self.lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0.0
+            self.updated = now
+
+
+LIMITER = TokenBucket(RATE_PER_MIN / 60.0, capacity=RATE_BURST)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Sesión HTTP compartida con pool de conexiones keep-alive."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        return _session
+
 
-def robust_get(url, params=None, max_attempts=10, base_wait=30):
-    """Hace una petición GET con reintentos en caso de 429 (rate limit)."""
+def retry_after_seconds(resp):
+    """Interpreta la cabecera Retry-After (segundos o fecha HTTP). None si no existe."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_seconds(attempt, base_wait):
+    """Backoff exponencial con jitter completo, acotado a MAX_BACKOFF."""
+    return random.uniform(0, min(MAX_BACKOFF, base_wait * (2 ** attempt)))
+
+
+def robust_get(url, params=None, max_attempts=10, base_wait=30, limiter=LIMITER):
+    """Hace una petición GET con reintentos en caso de 429 (rate limit) o errores 5xx."""
+    session = get_session()
     for attempt in range(max_attempts):
-        resp = requests.get(url, params=params, timeout=30)
-        if resp.status_code == 429:
-            wait = (attempt + 1) * base_wait
-            print(f"Rate limit hit. Retrying in {wait}s...")
+        limiter.acquire()
+        metrics.incr("http_requests")
+        if attempt:
+            metrics.incr("http_retries")
+        try:
+            resp = session.get(url, params=params, timeout=30)
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            wait = backoff_seconds(attempt, base_wait)
+            print(f"Request error ({exc.__class__.__name__}). Retrying in {wait:.1f}s...")
             time.sleep(wait)
             continue
+        if resp.status_code == 429 or resp.status_code >= 500:
+            wait = retry_after_seconds(resp)
+            if wait is None:
+                wait = backoff_seconds(attempt, base_wait)
+            if resp.status_code == 429:
+                # Pausa global: el resto de hilos también respeta el límite
+                limiter.pause(wait)
+                print(f"Rate limit hit. Retrying in {wait:.1f}s...")
+            else:
+                print(f"Server error {resp.status_code}. Retrying in {wait:.1f}s...")
+                time.sleep(wait)
+            continue
         resp.raise_for_status()
+        metrics.incr("http_bytes", len(resp.content))
         return resp.json()
     raise Exception(f"Failed to fetch {url} after {max_attempts} attempts")
 
@@ -41,12 +181,91 @@ def fetch_markets(vs_currency="eur", per_page=10, page=1):
     }
     return robust_get(url, params=params)
 
+def fetch_top_markets(n, vs_currency="eur", page_size=MARKETS_PAGE_SIZE, max_workers=MAX_WORKERS):
+    """
+    Barrido paginado de coins/markets hasta reunir las `n` primeras monedas.
+    Las páginas se piden en paralelo (respetando LIMITER) y se deduplican por id,
+    ya que el ranking puede moverse entre páginas durante el barrido.
+    """
+    per_page = min(page_size, n)
+    pages = range(1, math.ceil(n / per_page) + 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda p: fetch_markets(vs_currency, per_page, p), pages))
+    markets, seen = [], set()
+    for page in results:
+        for coin in page:
+            if coin["id"] not in seen:
+                seen.add(coin["id"])
+                markets.append(coin)
+    return markets[:n]
+
+def shard_coins(coin_ids, shard, n_shards):
+    """Subconjunto de monedas que corresponde al shard `shard` de `n_shards` (reparto round-robin)."""
+    return coin_ids[shard::n_shards]
+
 def fetch_market_chart(coin_id, days=30, vs_currency="eur"):
     """Descarga histórico de precios, volumen y market cap de una moneda."""
     url = f"{BASE_URL}/coins/{coin_id}/market_chart"
     params = {"vs_currency": vs_currency, "days": days}
     return robust_get(url, params=params)
 
+def fetch_market_charts(coin_ids, days=30, vs_currency="eur", max_workers=MAX_WORKERS):
+    """
+    Descarga el histórico de varias monedas en paralelo.
+    Genera tuplas (coin_id, chart) a medida que terminan las descargas.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(fetch_market_chart, coin_id, days, vs_currency): coin_id
+            for coin_id in coin_ids
+        }
+        for fut in as_completed(futures):
+            yield futures[fut], fut.result()
+
+def days_to_fetch(watermark_ms, now_ms, backfill_days=BACKFILL_DAYS):
+    """
+    Menor valor de `days` que cubre el hueco desde el último timestamp cargado.
+    Sin watermark (moneda nueva) se hace el backfill completo.
+    """
+    if watermark_ms is None:
+        return backfill_days
+    gap_days = max(0, now_ms - watermark_ms) / DAY_MS
+    return int(min(backfill_days, max(MIN_DAYS, math.ceil(gap_days))))
+
+def plan_history(coin_ids, mode="incremental", backfill_days=BACKFILL_DAYS):
+    """
+    Devuelve {coin_id: (days, since_ms)} según el modo:
+    - incremental: solo la ventana posterior al watermark de cada moneda.
+    - full: backfill completo de `backfill_days` ignorando watermarks.
+    """
+    watermarks = read_watermarks() if mode == "incremental" else {}
+    now_ms = int(time.time() * 1000)
+    plan = {}
+    for coin_id in coin_ids:
+        wm = watermarks.get(coin_id)
+        plan[coin_id] = (days_to_fetch(wm, now_ms, backfill_days), wm)
+    return plan
+
+def fetch_reference_charts(plan, charts, currencies, keep=False, max_workers=MAX_WORKERS):
+    """
+    Series de referencia FX: histórico de FX_REFERENCE_COIN en cada divisa que
+    lo necesita, sobre la ventana más larga del plan. El gráfico en la divisa
+    base se reutiliza si la moneda de referencia ya se descargó con esa ventana.
+    Devuelve (días, {divisa: chart}, reutilizado).
+    """
+    # fx (pandas) solo se importa cuando hay divisas extra
+    from fx import fetched_currencies
+
+    fx_days = max(n_days for n_days, _ in plan.values())
+    reused = plan.get(config.FX_REFERENCE_COIN, (None,))[0] == fx_days
+    wanted = ([] if reused else [config.BASE_CURRENCY]) + fetched_currencies(currencies)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        fetched = dict(zip(wanted, pool.map(
+            lambda c: fetch_market_chart(config.FX_REFERENCE_COIN, fx_days, c), wanted)))
+    if reused and keep:
+        fetched[config.BASE_CURRENCY] = charts[config.FX_REFERENCE_COIN]
+    return fx_days, fetched, reused
+
 def save_json(obj, name, snapshot_id):
     """Guarda un objeto JSON en disco con snapshot_id + timestamp."""
     ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
@@ -57,42 +276,129 @@ def save_json(obj, name, snapshot_id):
     print(f"Guardado: {fp}")
     return str(fp.name)
 
-def main():
-    wait_time = 15  # segundos entre peticiones para respetar rate limit
+def save_raw(obj, name, snapshot_id, fmt=RAW_FORMAT):
+    """Guarda una respuesta de la API en el formato crudo elegido."""
+    if fmt == "json":
+        return save_json(obj, name, snapshot_id)
+    ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    fp = RAW_DIR / f"{snapshot_id}_{ts}_{name}{raw_suffix(fmt)}"
+    n = write_ndjson(fp, iter_records(obj))
+    print(f"Guardado: {fp} ({n} registros)")
+    return str(fp.name)
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Extract CoinGecko market data into data/raw/")
+    ap.add_argument("--mode", choices=["incremental", "full"], default="incremental",
+                    help="incremental: fetch only the window after the last loaded ts; "
+                         "full: explicit backfill of --days days")
+    ap.add_argument("--days", type=int, default=BACKFILL_DAYS,
+                    help=f"backfill window in days (default {BACKFILL_DAYS})")
+    ap.add_argument("--raw-format", choices=FORMATS, default=RAW_FORMAT,
+                    help=f"raw file format (default {RAW_FORMAT}, env RAW_FORMAT)")
+    ap.add_argument("--top-n", type=int, default=UNIVERSE_SIZE,
+                    help=f"universe size: top-N coins by market cap (default {UNIVERSE_SIZE}, env UNIVERSE_SIZE)")
+    ap.add_argument("--shard", default="0/1", metavar="I/K",
+                    help="fetch history only for shard I of K (round-robin over the ranking), "
+                         "so K workers can split the universe")
+    ap.add_argument("--snapshot-id", default=None,
+                    help="shared snapshot id for all shards of one run (default: current UTC time)")
+    ap.add_argument("--currencies", default=",".join(config.QUOTE_CURRENCIES),
+                    help="comma-separated quote currencies, e.g. eur,usd,btc (env QUOTE_CURRENCIES); "
+                         "only the FX reference series is fetched for the non-base ones")
+    args = ap.parse_args(argv)
+    try:
+        args.shard_index, args.n_shards = (int(x) for x in args.shard.split("/"))
+    except ValueError:
+        ap.error("--shard must look like I/K, e.g. 0/4")
+    if not 0 <= args.shard_index < args.n_shards:
+        ap.error("--shard index must satisfy 0 <= I < K")
+    args.currencies = [c.strip().lower() for c in args.currencies.split(",") if c.strip()]
+    return args
 
-    # Crear snapshot_id único al inicio
-    snapshot_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-    print(f"=== SNAPSHOT ID: {snapshot_id} ===")
+def extract_snapshot(top_n=UNIVERSE_SIZE, mode="incremental", days=BACKFILL_DAYS,
+                     shard_index=0, n_shards=1, snapshot_id=None, raw_format=RAW_FORMAT,
+                     save=True, keep=False, currencies=None):
+    """
+    Descarga un snapshot completo (markets + histórico de las monedas del shard).
+
+    save: escribe los ficheros crudos y los metadatos en data/raw/ (flujo por lotes).
+    keep: además devuelve los datos en memoria (orquestador en un solo proceso).
+    currencies: divisas de cotización (por defecto QUOTE_CURRENCIES); las
+    series FX de referencia las descarga solo el shard 0.
+    Devuelve {"metadata": ..., "markets": [...], "charts": {coin_id: chart},
+    "fx": {divisa: chart de referencia}}.
+    """
+    currencies = currencies or config.QUOTE_CURRENCIES
+    # Crear snapshot_id único al inicio (los shards de una misma ejecución comparten base)
+    snapshot_id = snapshot_id or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    if n_shards > 1:
+        snapshot_id = f"{snapshot_id}-s{shard_index}of{n_shards}"
+    print(f"=== SNAPSHOT ID: {snapshot_id} ({mode}) ===")
 
     metadata = {
         "snapshot_id": snapshot_id,
         "ts_start": datetime.now(timezone.utc).isoformat(),
+        "mode": mode,
         "coins": [],
+        "since": {},
         "files": []
     }
 
-    # Descargar snapshot de markets en EUR
-    markets = fetch_markets(vs_currency="eur", per_page=10, page=1)
-    fname = save_json(markets, "coins_markets", snapshot_id)
-    metadata["files"].append(fname)
+    # Barrido paginado de markets en EUR (top-N por capitalización)
+    markets = fetch_top_markets(top_n, vs_currency="eur")
+    coins = shard_coins([coin["id"] for coin in markets], shard_index, n_shards)
+    if n_shards > 1:
+        keep_ids = set(coins)
+        markets = [coin for coin in markets if coin["id"] in keep_ids]
+    if save:
+        metadata["files"].append(save_raw(markets, "coins_markets", snapshot_id, raw_format))
+    metadata["coins"] = coins
+    print(f"Top {top_n} monedas (shard {shard_index}/{n_shards}): {len(coins)}")
+
+    # Ventana a descargar por moneda (watermark → days mínimo que la cubre)
+    plan = plan_history(coins, mode=mode, backfill_days=days)
+    metadata["since"] = {c: since for c, (_, since) in plan.items() if since is not None}
+    by_days = {}
+    for coin_id, (n_days, _) in plan.items():
+        by_days.setdefault(n_days, []).append(coin_id)
 
-    # Seleccionar top 5 por capitalización
-    top5 = [coin["id"] for coin in markets[:5]]
-    metadata["coins"] = top5
-    print("Top 5 monedas:", top5)
+    # Descargar histórico de esas monedas (en paralelo, limitado por LIMITER)
+    chart_files, charts = {}, {}
+    for n_days, coin_ids in sorted(by_days.items()):
+        print(f"Histórico de {len(coin_ids)} monedas con days={n_days}")
+        for coin_id, chart in fetch_market_charts(coin_ids, days=n_days, vs_currency="eur"):
+            if save:
+                chart_files[coin_id] = save_raw(chart, f"{coin_id}_market_chart", snapshot_id, raw_format)
+            if keep:
+                charts[coin_id] = chart
+    metadata["files"].extend(chart_files[c] for c in coins if c in chart_files)
 
-    # Descargar histórico de esas monedas
-    for coin_id in top5:
-        chart = fetch_market_chart(coin_id, days=60, vs_currency="eur")
-        fname = save_json(chart, f"{coin_id}_market_chart", snapshot_id)
-        metadata["files"].append(fname)
-        time.sleep(wait_time)  # Respetar rate limit
+    # Serie de referencia FX (solo con divisas distintas de la base)
+    fx_charts = {}
+    if shard_index == 0 and plan and any(c != config.BASE_CURRENCY for c in currencies):
+        fx_days, fx_charts, reused = fetch_reference_charts(plan, charts, currencies, keep)
+        print(f"Serie FX de {config.FX_REFERENCE_COIN} (days={fx_days}) para {', '.join(currencies)}")
+        if save:
+            metadata["files"].extend(
+                save_raw(chart, f"fx_{currency}_reference_chart", snapshot_id, raw_format)
+                for currency, chart in fx_charts.items() if not (reused and currency == config.BASE_CURRENCY))
+        metadata["fx"] = {"base": config.BASE_CURRENCY, "reference": config.FX_REFERENCE_COIN,
+                          "currencies": currencies, "days": fx_days}
 
     # Guardar metadatos del snapshot
-    meta_file = RAW_DIR / f"snapshot_{snapshot_id}.json"
-    with open(meta_file, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
-    print(f"Metadatos guardados en: {meta_file}")
+    if save:
+        meta_file = RAW_DIR / f"snapshot_{snapshot_id}.json"
+        with open(meta_file, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+        print(f"Metadatos guardados en: {meta_file}")
+
+    return {"metadata": metadata, "markets": markets if keep else None, "charts": charts,
+            "fx": fx_charts if keep else None}
+
+def main(argv=None):
+    args = parse_args(argv)
+    extract_snapshot(args.top_n, args.mode, args.days, args.shard_index, args.n_shards,
+                     args.snapshot_id, args.raw_format, currencies=args.currencies)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,138 @@
+"""
+frames.py
+Compact in-memory representation of market_history frames.
+
+A history frame repeats its coin_id and snapshot_id on every row. As object
+columns that is one pointer plus one Python string per row; here both are
+categoricals (int codes + one copy of each distinct string), which Arrow and
+Parquet carry as dictionary<int32, string>. ts stays datetime64[ns], an int64
+epoch in memory and in Parquet. With HISTORY_FLOAT32=1 market_cap and
+volume_24h are float32 (~7 significant digits, plenty for caps and volumes;
+price_eur stays float64).
+
+    column       object layout         compact layout
+    coin_id      8 B + str per row     1-2 B code per row
+    snapshot_id  8 B + str per row     1-2 B code per row
+    ts           8 B                   8 B
+    price_eur    8 B                   8 B
+    market_cap   8 B                   8 B (4 B with HISTORY_FLOAT32)
+    volume_24h   8 B                   8 B (4 B with HISTORY_FLOAT32)
+
+benchmarks/bench_memory.py measures both layouts.
+
+read_sql() is pd.read_sql with dtype_backend="pyarrow", converted back to
+the same compact NumPy/categorical dtypes the rest of the code expects.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import config
+
+HISTORY_COLUMNS = ["coin_id", "ts", "price_eur", "market_cap", "volume_24h", "snapshot_id"]
+KEY_COLUMNS = ["coin_id", "snapshot_id"]
+
+# float32 market_cap/volume_24h are opt-in (HISTORY_FLOAT32=1)
+FLOAT32 = config.HISTORY_FLOAT32
+FLOAT_DTYPES = {
+    "price_eur": "float64",
+    "market_cap": "float32" if FLOAT32 else "float64",
+    "volume_24h": "float32" if FLOAT32 else "float64",
+}
+
+KEY_TYPE = pa.dictionary(pa.int32(), pa.string())
+HISTORY_SCHEMA = pa.schema(
+    [("coin_id", KEY_TYPE), ("ts", pa.timestamp("ns"))]
+    + [(col, pa.from_numpy_dtype(np.dtype(dtype))) for col, dtype in FLOAT_DTYPES.items()]
+    + [("snapshot_id", KEY_TYPE)]
+)
+# FX reference rates (fx.py): units of `currency` per 1 unit of the base currency
+RATES_SCHEMA = pa.schema([("currency", KEY_TYPE), ("ts", pa.timestamp("ns")), ("rate", pa.float64())])
+
+
+def constant_key(value, n):
+    """Categorical column of `n` rows all equal to `value` (one category, int8 codes)."""
+    return pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[value])
+
+
+def empty_history():
+    return pd.DataFrame({
+        "coin_id": pd.Categorical([]),
+        "ts": pd.Series(dtype="datetime64[ns]"),
+        **{col: pd.Series(dtype=dtype) for col, dtype in FLOAT_DTYPES.items()},
+        "snapshot_id": pd.Categorical([]),
+    })
+
+
+def compact_history(df):
+    """market_history frame → categorical keys and FLOAT_DTYPES floats (no-op when already compact)."""
+    dtypes = {col: "category" for col in KEY_COLUMNS if col in df and df[col].dtype != "category"}
+    dtypes.update({col: dtype for col, dtype in FLOAT_DTYPES.items() if col in df and df[col].dtype != dtype})
+    return df.astype(dtypes) if dtypes else df
+
+
+def concat_history(frames):
+    """
+    pd.concat for compact frames. Categoricals with different categories would
+    concatenate to object, so the key columns are recoded onto the sorted
+    union of their categories (sorting by the codes then matches sorting by
+    the strings, which keeps Parquet row-group stats tight).
+    """
+    frames = [compact_history(df) for df in frames]
+    if len(frames) < 2:
+        return pd.concat(frames, ignore_index=True)
+    keys = [col for col in KEY_COLUMNS if all(col in df for df in frames)]
+    out = pd.concat([df.drop(columns=keys) for df in frames], ignore_index=True)
+    for col in keys:
+        cats = [df[col].cat for df in frames]
+        union = pd.Index(np.unique(np.concatenate([c.categories.to_numpy(dtype=object) for c in cats])))
+        # old code → new code per frame; the appended -1 keeps NaN (code -1) as NaN
+        codes = np.concatenate([np.append(union.get_indexer(c.categories), -1)[c.codes] for c in cats])
+        out[col] = pd.Categorical.from_codes(codes, categories=union)
+    return out[list(frames[0].columns)]
+
+
+def from_arrow_dtypes(df, float_dtypes=None):
+    """
+    pyarrow-backed frame → NumPy/categorical columns: strings become
+    categoricals (sorted categories), timestamps datetime64[ns], decimals and floats NumPy floats
+    (float_dtypes overrides per column), integers int64 (nullable Int64 when
+    there are NULLs).
+    """
+    float_dtypes = float_dtypes or {}
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        if not isinstance(s.dtype, pd.ArrowDtype):
+            out[col] = s
+            continue
+        t = s.dtype.pyarrow_dtype
+        # float_dtypes columns first: pandas types an all-NULL chunk as string
+        if col in float_dtypes or pa.types.is_floating(t) or pa.types.is_decimal(t):
+            values = pc.cast(s.array.__arrow_array__(), pa.float64()).to_numpy()
+            out[col] = pd.Series(values.astype(float_dtypes.get(col, "float64"), copy=False), index=s.index)
+        elif pa.types.is_string(t) or pa.types.is_large_string(t) or pa.types.is_dictionary(t):
+            codes = pc.dictionary_encode(s.array.__arrow_array__()).to_pandas()
+            codes = codes.cat.set_categories(codes.cat.categories.sort_values())
+            out[col] = pd.Series(codes.to_numpy(), index=s.index, dtype=codes.dtype)
+        elif pa.types.is_timestamp(t):
+            out[col] = s.astype(f"datetime64[ns, {t.tz}]" if t.tz else "datetime64[ns]")
+        elif pa.types.is_integer(t):
+            out[col] = s.astype("Int64") if s.hasnans else s.astype("int64")
+        else:
+            out[col] = s
+    return pd.DataFrame(out, index=df.index)
+
+
+def read_sql(sql, conn, params=None, **kwargs):
+    """
+    pd.read_sql(..., dtype_backend="pyarrow") with the result converted by
+    from_arrow_dtypes(): no per-row Python strings in the returned frame.
+    With chunksize=N an iterator of converted frames is returned.
+    """
+    result = pd.read_sql(sql, conn, params=params or {}, dtype_backend="pyarrow", **kwargs)
+    if kwargs.get("chunksize"):
+        return (from_arrow_dtypes(df, FLOAT_DTYPES) for df in result)
+    return from_arrow_dtypes(result, FLOAT_DTYPES)
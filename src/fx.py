@@ -0,0 +1,184 @@
+"""
+fx.py
+Multi-currency quotes from one base currency plus a reference-rate series.
+
+Everything is extracted and stored once, in the base currency (EUR: the
+price_eur columns). For every other quote currency the extractor fetches a
+single extra series, the reference coin's market_chart in that currency
+(one request per currency per snapshot, however many coins are tracked):
+
+    rate(currency, ts) = reference price in currency / reference price in EUR
+
+= units of `currency` per 1 EUR. Quoting in the reference coin itself (BTC
+for bitcoin) needs no request at all: rate = 1 / reference price in EUR.
+
+Rates are stored as (currency, ts, rate) rows: data/processed/fx_rates/ and
+the fx_rates table (migrations/0008_fx_rates.sql). Prices in other
+currencies are never stored; they are derived with an as-of join (the last
+rate at or before each ts): convert()/quotes() here with pd.merge_asof, or
+the *_quotes views in SQL.
+
+Quote currencies: QUOTE_CURRENCIES (comma-separated, default "eur" = single
+currency, no extra requests), e.g. QUOTE_CURRENCIES=eur,usd,btc.
+"""
+
+import numpy as np
+import pandas as pd
+
+import config
+from rawio import coin_from_filename, currency_from_filename, read_chart
+
+BASE_CURRENCY = config.BASE_CURRENCY
+REFERENCE_COIN = config.FX_REFERENCE_COIN
+REFERENCE_SYMBOL = config.FX_REFERENCE_SYMBOL
+QUOTE_CURRENCIES = config.QUOTE_CURRENCIES
+
+# market_history value columns that scale with the currency
+VALUE_COLUMNS = ("price_eur", "market_cap", "volume_24h")
+
+
+def fetched_currencies(currencies=None):
+    """Quote currencies that need a reference chart (not the base, not the reference coin itself)."""
+    return [c for c in (currencies or QUOTE_CURRENCIES) if c not in (BASE_CURRENCY, REFERENCE_SYMBOL)]
+
+
+def price_series(chart):
+    """market_chart payload → (ts, price) frame of its "prices" series, sorted by ts."""
+    arr = np.asarray(chart.get("prices", []), dtype=np.float64).reshape(-1, 2)
+    df = pd.DataFrame({"ts": pd.to_datetime(arr[:, 0].astype(np.int64), unit="ms"), "price": arr[:, 1]})
+    return df.dropna().drop_duplicates("ts", keep="last").sort_values("ts", ignore_index=True)
+
+
+def empty_rates():
+    return pd.DataFrame({
+        "currency": pd.Categorical([]),
+        "ts": pd.Series(dtype="datetime64[ns]"),
+        "rate": pd.Series(dtype="float64"),
+    })
+
+
+def rates_frame(base_chart, quote_charts, currencies=None):
+    """
+    Reference coin charts → (currency, ts, rate) rows, on the timestamps of
+    the base-currency chart. quote_charts: {currency: market_chart}; a quote
+    point is matched to the nearest base point within the chart resolution.
+    """
+    base = price_series(base_chart)
+    base = base[base["price"] > 0]
+    if base.empty:
+        return empty_rates()
+    step = base["ts"].diff().median() if len(base) > 1 else pd.Timedelta(hours=1)
+
+    parts = []
+    for currency in currencies or QUOTE_CURRENCIES:
+        if currency == BASE_CURRENCY:
+            continue
+        if currency == REFERENCE_SYMBOL:
+            rate = 1.0 / base["price"].to_numpy()
+        elif currency in quote_charts:
+            quote = price_series(quote_charts[currency]).rename(columns={"price": "quote"})
+            matched = pd.merge_asof(base, quote, on="ts", direction="nearest", tolerance=step)
+            rate = (matched["quote"] / matched["price"]).to_numpy()
+        else:
+            continue
+        parts.append(pd.DataFrame({"currency": currency, "ts": base["ts"].to_numpy(), "rate": rate}))
+
+    if not parts:
+        return empty_rates()
+    df = pd.concat(parts, ignore_index=True)
+    df = df[np.isfinite(df["rate"])].reset_index(drop=True)
+    return df.astype({"currency": "category"})
+
+
+def snapshot_rates(meta, raw_dir):
+    """
+    FX rates of one extracted snapshot (empty unless it was extracted with
+    several quote currencies). The base-currency reference chart is either
+    its own fx file or, when the reference coin's history was fetched over
+    the same window, that market_chart file.
+    """
+    info = meta.get("fx")
+    if not info:
+        return empty_rates()
+    charts = {currency_from_filename(f): read_chart(raw_dir / f) for f in meta["files"] if "_reference_chart" in f}
+    base = charts.pop(info["base"], None)
+    if base is None:
+        fname = next((f for f in meta["files"]
+                      if "market_chart" in f and coin_from_filename(f) == info["reference"]), None)
+        if fname is None:
+            return empty_rates()
+        base = read_chart(raw_dir / fname)
+    return rates_frame(base, charts, info["currencies"])
+
+
+def convert(df, rates, currency, ts="ts", columns=VALUE_COLUMNS):
+    """
+    `df` (base currency) with `columns` converted to `currency` by an as-of
+    join on `ts`: each row takes the last rate at or before its ts (NaN
+    before the first rate). Row order is preserved.
+    """
+    if currency == BASE_CURRENCY:
+        return df
+    rate = rates.loc[rates["currency"] == currency, ["ts", "rate"]].rename(columns={"ts": "_fx_ts"})
+    rate = rate.sort_values("_fx_ts")
+    keys = pd.DataFrame({"_fx_ts": pd.to_datetime(df[ts]).to_numpy(), "_row": np.arange(len(df))})
+    matched = pd.merge_asof(keys.sort_values("_fx_ts", kind="stable"), rate, on="_fx_ts", direction="backward")
+    factor = np.empty(len(df))
+    factor[matched["_row"].to_numpy()] = matched["rate"].to_numpy()
+    out = df.copy()
+    for col in columns:
+        if col in out:
+            out[col] = out[col].to_numpy() * factor
+    return out
+
+
+def quotes(df, rates, currencies=None, ts="ts", columns=VALUE_COLUMNS):
+    """
+    Long (…, currency, price…) frame: `df` once per quote currency, as in
+    the market_history_quotes view (price_eur becomes price).
+    """
+    parts = [convert(df, rates, c, ts, columns).assign(currency=c) for c in currencies or QUOTE_CURRENCIES]
+    out = pd.concat(parts, ignore_index=True).rename(columns={"price_eur": "price"})
+    return out.astype({"currency": "category"})
+
+
+# --- Storage ---
+def read_rates(conn, currencies=None, start=None):
+    """fx_rates rows of `currencies` (default: every stored one), optionally from `start` on."""
+    from sqlalchemy import text
+
+    import frames
+
+    where, params = [], {}
+    if currencies is not None:
+        where.append("currency = ANY(:currencies)")
+        params["currencies"] = list(currencies)
+    if start is not None:
+        # Keep the last rate before `start` so the first rows still get one
+        where.append("""ts >= COALESCE((SELECT MAX(p.ts) FROM fx_rates p
+                                        WHERE p.currency = fx_rates.currency AND p.ts <= :start), :start)""")
+        params["start"] = start
+    return frames.read_sql(text(f"""
+        SELECT currency, ts, rate FROM fx_rates
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY currency, ts
+    """), conn, params)
+
+
+def read_rates_local(currencies=None):
+    """fx_rates from the local store (empty when nothing was mirrored yet)."""
+    import pyarrow as pa
+
+    import localstore
+    from dataset import open_dataset
+    from frames import RATES_SCHEMA
+
+    root = localstore.LOCAL_DIR / "fx_rates"
+    if not root.exists():
+        return empty_rates()
+    schema = RATES_SCHEMA.append(pa.field("month", pa.string()))
+    table = open_dataset(root, schema=schema).to_table(columns=["currency", "ts", "rate"])
+    df = localstore.dedup(table, key=("currency", "ts")).to_pandas()
+    if currencies is not None:
+        df = df[df["currency"].isin(list(currencies))]
+    return df.sort_values(["currency", "ts"], ignore_index=True).astype({"currency": "category"})
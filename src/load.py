@@ -1,110 +1,412 @@
 #!/usr/bin/env python3
 """
 load.py
-Loads processed datasets (Parquet preferred, CSV fallback) into PostgreSQL.
+Loads processed datasets (partitioned Parquet parts listed in the processed
+manifest; legacy flat Parquet/CSV files as fallback) into PostgreSQL.
+
+The schema is managed by the versioned migrations in src/migrations/ (applied
+by migrate.upgrade at the start of each load). Each table is bulk-loaded with
+COPY FROM STDIN into a temporary staging table followed by one set-based
+INSERT ... ON CONFLICT, and the whole load runs in a single transaction.
+market_history is range-partitioned by month; the hourly/daily OHLC rollups
+are refreshed for the buckets each load touches, then the derived metrics_*
+tables (analytics.py) for the coins that moved. After the commit, loaded
+Parquet parts are mirrored into the local analysis store (localstore.py).
 Assumes data is already clean (timestamps normalized, types correct).
 """
 
+import argparse
+import io
 import pandas as pd
+import pyarrow.parquet as pq
 import pathlib
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 
-PROC_DIR = pathlib.Path(__file__).resolve().parents[1] / "data" / "processed"
+import analytics
+import coindim
+import localstore
+import metrics
+from db import get_engine
+from migrate import upgrade
+from state import STREAM_SUFFIX, mark_loaded, pending_runs, read_manifest, write_watermarks
 
-# PostgreSQL connection config
-DB_USER = "ricardo"
-DB_PASS = "crypto"
-DB_HOST = "localhost"
-DB_PORT = "5432"
-DB_NAME = "crypto"
+PROC_DIR = pathlib.Path(__file__).resolve().parents[1] / "data" / "processed"
 
-engine = create_engine(f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+# Rows handled per batch when streaming processed files into the database
+LOAD_BATCH_ROWS = 200_000
 
 # --- Helpers ---
-def read_processed(prefix: str):
-    """Read latest dataset: prefer Parquet, fallback to CSV."""
-    pq_files = sorted(PROC_DIR.glob(f"{prefix}_*.parquet"))
-    csv_files = sorted(PROC_DIR.glob(f"{prefix}_*.csv"))
-
-    if pq_files:
-        return pd.read_parquet(pq_files[-1]), pq_files[-1].name
-    elif csv_files:
-        return pd.read_csv(csv_files[-1]), csv_files[-1].name
-    else:
-        return None, None
+def latest_processed(prefix: str):
+    """
+    Files of the most recent run for `prefix` (every shard of it when the
+    extraction was sharded). Parquet preferred, CSV fallback.
+    """
+    for ext in ("parquet", "csv"):
+        files = sorted(PROC_DIR.glob(f"{prefix}_*.{ext}"))
+        if files:
+            run_id = files[-1].stem[len(prefix) + 1:].split("-s")[0]
+            return [f for f in files if f.stem[len(prefix) + 1:].startswith(run_id)]
+    return []
 
-# --- Load functions ---
-def load_coins(engine):
-    coins_file_pq = PROC_DIR / "coins.parquet"
-    coins_file_csv = PROC_DIR / "coins.csv"
-
-    if coins_file_pq.exists():
-        df = pd.read_parquet(coins_file_pq)
-        src = coins_file_pq.name
-    elif coins_file_csv.exists():
-        df = pd.read_csv(coins_file_csv)
-        src = coins_file_csv.name
+def pending_processed(prefix: str):
+    """
+    Processed files awaiting load: every unloaded run of the processed manifest
+    (oldest first), or the latest run for outputs written before the manifest.
+    """
+    runs = pending_runs()
+    if runs:
+        files = []
+        for _, info in runs:
+            entry = info["files"].get(prefix, [])
+            files.extend(PROC_DIR / f for f in ([entry] if isinstance(entry, str) else entry))
+        return files
+    if read_manifest()["runs"]:
+        return []
+    return latest_processed(prefix)
+
+def iter_processed(files, batch_rows=LOAD_BATCH_ROWS):
+    """Stream DataFrames of at most `batch_rows` rows from processed files."""
+    for fp in files:
+        if fp.suffix == ".parquet":
+            for batch in pq.ParquetFile(fp).iter_batches(batch_size=batch_rows):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(fp, chunksize=batch_rows, parse_dates=["ts"])
+
+def to_naive_utc(ts):
+    """Normalize a DB timestamp to naive UTC, the convention used by transform.py."""
+    ts = pd.Timestamp(ts)
+    return ts.tz_convert(None) if ts.tzinfo is not None else ts
+
+# --- Watermarks ---
+def read_watermark_table(conn):
+    """All per-coin watermarks kept in load_watermarks, in one query: {coin_id: ts}."""
+    rows = conn.execute(text("SELECT coin_id, max_ts FROM load_watermarks")).fetchall()
+    return {coin_id: to_naive_utc(max_ts) for coin_id, max_ts in rows if max_ts is not None}
+
+def bootstrap_watermarks(conn, coin_ids):
+    """
+    Watermarks for coins missing from load_watermarks, in a single round trip.
+    The LATERAL ... ORDER BY ts DESC LIMIT 1 is one backward probe of the
+    (coin_id, ts) index per coin rather than a scan. Rows written by stream.py
+    are skipped: they must not hide the batch history before them. Coins
+    without history map to None.
+    """
+    rows = conn.execute(
+        text("""
+            SELECT c.coin_id, h.ts
+            FROM unnest(CAST(:cids AS text[])) AS c(coin_id)
+            LEFT JOIN LATERAL (
+                SELECT ts FROM market_history
+                WHERE market_history.coin_id = c.coin_id
+                  AND market_history.snapshot_id NOT LIKE :stream
+                ORDER BY ts DESC
+                LIMIT 1
+            ) h ON TRUE
+        """),
+        {"cids": list(coin_ids), "stream": "%" + STREAM_SUFFIX}
+    ).fetchall()
+    return {coin_id: to_naive_utc(ts) if ts is not None else None for coin_id, ts in rows}
+
+def update_watermark_table(conn, stage):
+    """Advance load_watermarks with the max ts per coin of the staged rows."""
+    conn.execute(text(f"""
+        INSERT INTO load_watermarks (coin_id, max_ts, updated_at)
+        SELECT coin_id, MAX(ts), now() FROM {stage} GROUP BY coin_id
+        ON CONFLICT (coin_id) DO UPDATE
+        SET max_ts = GREATEST(load_watermarks.max_ts, EXCLUDED.max_ts),
+            updated_at = EXCLUDED.updated_at
+    """))
+
+# --- Bulk COPY + staging upsert ---
+TABLE_KEYS = {
+    "coins": ("coin_id",),
+    "market_snapshots": ("snapshot_id", "coin_id"),
+    "market_history": ("coin_id", "ts"),
+    "metrics_returns": ("coin_id", "bucket"),
+    "metrics_correlation": ("coin_a", "coin_b"),
+    "fx_rates": ("currency", "ts"),
+}
+
+def create_stage(conn, table):
+    """
+    Temporary (hence unlogged) staging copy of `table`, dropped at commit.
+    stage_seq numbers the rows in the order they were copied in.
+    """
+    stage = f"stage_{table}"
+    conn.execute(text(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {stage}
+            (LIKE {table} INCLUDING DEFAULTS, stage_seq BIGSERIAL)
+        ON COMMIT DROP
+    """))
+    conn.execute(text(f"TRUNCATE {stage}"))
+    return stage
+
+def copy_frame(conn, df, table, columns):
+    """Stream a DataFrame into `table` with COPY FROM STDIN (CSV, empty = NULL)."""
+    buf = io.StringIO()
+    df.to_csv(buf, columns=columns, index=False, header=False, date_format="%Y-%m-%d %H:%M:%S.%f")
+    buf.seek(0)
+    with conn.connection.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+    metrics.incr("db_copies")
+    metrics.incr("db_copy_bytes", buf.tell())
+
+def merge_stage(conn, stage, table, columns, upsert=False):
+    """
+    Single set-based INSERT ... ON CONFLICT from the staging table. Returns rows written.
+    A key staged more than once keeps its last copy (frames are staged oldest first),
+    so --upsert never writes an older value over a newer one.
+    """
+    key = ", ".join(TABLE_KEYS[table])
+    cols = ", ".join(columns)
+    if upsert:
+        updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in TABLE_KEYS[table])
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
     else:
-        return
+        action = "DO NOTHING"
+    result = conn.execute(text(f"""
+        INSERT INTO {table} ({cols})
+        SELECT DISTINCT ON ({key}) {cols} FROM {stage}
+        ORDER BY {key}, stage_seq DESC
+        ON CONFLICT ({key}) {action}
+    """))
+    return result.rowcount
+
+def bulk_load(conn, frames, table, upsert=False, before_merge=None):
+    """
+    COPY every frame into a staging table, then merge it into `table` at once.
+    before_merge(conn, stage) runs between the two (e.g. to create partitions).
+    """
+    stage = create_stage(conn, table)
+    columns, staged = None, 0
+    for df in frames:
+        if df.empty:
+            continue
+        columns = columns or list(df.columns)
+        copy_frame(conn, df, stage, columns)
+        staged += len(df)
+    if not staged:
+        return 0, 0
+    if before_merge is not None:
+        before_merge(conn, stage)
+    return staged, merge_stage(conn, stage, table, columns, upsert)
+
+# --- Partitions and rollups ---
+# Rollup table → date_trunc() unit of its buckets (see migrations/0003_rollups.sql)
+ROLLUPS = {
+    "market_history_hourly": "hour",
+    "market_history_daily": "day",
+}
 
-    with engine.begin() as conn:
-        for _, row in df.iterrows():
-            conn.execute(
-                text("""
-                    INSERT INTO coins (coin_id, symbol, name)
-                    VALUES (:coin_id, :symbol, :name)
-                    ON CONFLICT (coin_id) DO NOTHING
-                """),
-                {"coin_id": row["coin_id"], "symbol": row["symbol"], "name": row["name"]}
+def ensure_partitions(conn, stage):
+    """
+    Create the monthly market_history partitions covering the staged rows,
+    and count a change for each partition they go to (market_history_changes,
+    what backup/backup.py compares to find the partitions to export again).
+    """
+    created = conn.execute(text(
+        f"SELECT ensure_market_history_partitions(MIN(ts), MAX(ts)) FROM {stage}"
+    )).scalar()
+    if created:
+        print(f"Created {created} market_history partitions")
+    conn.execute(text(f"""
+        INSERT INTO market_history_changes (partition, changes, changed_at)
+        SELECT DISTINCT 'market_history_y' || to_char(ts, 'YYYY') || 'm' || to_char(ts, 'MM'), 1, now()
+        FROM {stage}
+        ON CONFLICT (partition) DO UPDATE
+        SET changes = market_history_changes.changes + 1, changed_at = EXCLUDED.changed_at
+    """))
+
+def refresh_rollups(conn, stage):
+    """
+    Recompute the rollup buckets touched by the staged rows: per coin, every
+    bucket from the one holding its earliest staged ts onwards. Reads only that
+    slice of market_history through the (coin_id, ts) primary key.
+    """
+    for table, unit in ROLLUPS.items():
+        conn.execute(text(f"""
+            WITH touched AS (
+                SELECT coin_id, date_trunc('{unit}', MIN(ts)) AS since
+                FROM {stage} GROUP BY coin_id
             )
-    print(f"Inserted/updated {len(df)} coins from {src}")
+            INSERT INTO {table}
+                (coin_id, bucket, open, high, low, close, avg_price, market_cap, volume_24h, n_points)
+            SELECT h.coin_id, date_trunc('{unit}', h.ts),
+                   (array_agg(h.price_eur ORDER BY h.ts))[1], MAX(h.price_eur), MIN(h.price_eur),
+                   (array_agg(h.price_eur ORDER BY h.ts DESC))[1], AVG(h.price_eur),
+                   (array_agg(h.market_cap ORDER BY h.ts DESC))[1],
+                   (array_agg(h.volume_24h ORDER BY h.ts DESC))[1],
+                   COUNT(*)
+            FROM market_history h
+            JOIN touched t ON h.coin_id = t.coin_id AND h.ts >= t.since
+            GROUP BY h.coin_id, date_trunc('{unit}', h.ts)
+            ON CONFLICT (coin_id, bucket) DO UPDATE SET
+                open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+                close = EXCLUDED.close, avg_price = EXCLUDED.avg_price,
+                market_cap = EXCLUDED.market_cap, volume_24h = EXCLUDED.volume_24h,
+                n_points = EXCLUDED.n_points
+        """))
+
+def bump_load_version(conn):
+    """Advance the load_version counter that readers key their caches on."""
+    return conn.execute(text(
+        "UPDATE load_version SET version = version + 1, loaded_at = now() RETURNING version"
+    )).scalar()
 
-def load_snapshots(engine):
-    df, fname = read_processed("market_snapshots")
-    if df is None:
+# --- Load functions ---
+def release_keys(conn, stage):
+    """Free coin_keys held by other coins (e.g. after the dimension file was rebuilt)."""
+    conn.execute(text(f"""
+        UPDATE coins c SET coin_key = NULL
+        FROM {stage} s
+        WHERE c.coin_key = s.coin_key AND c.coin_id <> s.coin_id
+    """))
+
+def load_coins(conn, df=None):
+    """
+    Apply the coin dimension (coindim.py) to the coins table, restricted to
+    the coins of `df` when given. Only rows whose key or attributes differ
+    from the database are staged, and those are always updated in place.
+    """
+    dim = coindim.read()
+    if df is not None:
+        dim = dim[dim["coin_id"].isin(df["coin_id"])]
+    if dim.empty:
         return
 
-    snapshot_id = df["snapshot_id"].iloc[0]
-    with engine.begin() as conn:
-        exists = conn.execute(
-            text("SELECT 1 FROM market_snapshots WHERE snapshot_id = :sid LIMIT 1"),
-            {"sid": snapshot_id}
-        ).fetchone()
+    columns = ["coin_id", "coin_key", "symbol", "name", "first_seen"]
+    current = pd.read_sql(
+        text(f"SELECT {', '.join(columns)} FROM coins WHERE coin_id = ANY(:ids)"),
+        conn, params={"ids": dim["coin_id"].tolist()},
+    )
+    merged = dim[columns].merge(current, on="coin_id", how="left", suffixes=("", "_db"))
+    same = pd.Series(True, index=merged.index)
+    for c in columns[1:]:
+        a, b = merged[c], merged[f"{c}_db"]
+        if c == "first_seen":
+            a, b = pd.to_datetime(a), pd.to_datetime(b)
+        same &= (a == b) | (a.isna() & b.isna())
+    changed = dim[columns][~same.to_numpy()]
 
-        if exists:
-            print(f"Snapshot {snapshot_id} already loaded, skipped.")
-        else:
-            df.to_sql("market_snapshots", engine, if_exists="append", index=False)
-            print(f"Inserted {len(df)} rows into market_snapshots ({fname})")
+    _, written = bulk_load(conn, [changed], "coins", upsert=True, before_merge=release_keys)
+    if written:
+        print(f"Inserted/updated {written} of {len(dim)} coins from the coin dimension")
 
-def load_history(engine):
-    df, fname = read_processed("market_history")
-    if df is None:
-        return
+def load_snapshots(conn, upsert=False, frames=None):
+    """Load pending market_snapshots files, or the given DataFrames."""
+    if frames is None:
+        files = pending_processed("market_snapshots")
+        frames = (
+            pq.ParquetFile(fp).read().to_pandas() if fp.suffix == ".parquet" else pd.read_csv(fp)
+            for fp in files
+        )
+        src = f"{len(files)} files"
+    else:
+        src = "memory"
+    staged, written = bulk_load(conn, frames, "market_snapshots", upsert)
+    if staged:
+        skipped = f", {staged - written} already loaded" if staged > written else ""
+        print(f"Inserted {written} rows into market_snapshots ({src}{skipped})")
 
-    inserted_total = 0
-    with engine.begin() as conn:
-        for coin_id, group in df.groupby("coin_id"):
-            result = conn.execute(
-                text("SELECT MAX(ts) FROM market_history WHERE coin_id = :cid"),
-                {"cid": coin_id}
-            ).fetchone()
-            max_ts = result[0]
+def load_fx(conn, frames=None):
+    """Upsert pending FX reference rates (or the given DataFrames) into fx_rates."""
+    if frames is None:
+        files = pending_processed("fx_rates")
+        frames = (pq.ParquetFile(fp).read().to_pandas() for fp in files if fp.suffix == ".parquet")
+    staged, written = bulk_load(conn, frames, "fx_rates", upsert=True)
+    if staged:
+        print(f"Upserted {written} rows into fx_rates")
 
-            if max_ts:
-                group = group[group["ts"] > max_ts]
+def load_history(conn, upsert=False, fill_gaps=False, frames=None):
+    """
+    Bulk-load pending market_history rows (or the given DataFrames) and
+    return {coin_id: max_ts}.
+
+    By default rows at or before each coin's watermark are dropped before the
+    COPY. With fill_gaps every row is staged and ON CONFLICT (an index probe
+    on the (coin_id, ts) key per row) inserts any (coin_id, ts) not present yet,
+    so late-arriving points and holes in the series are backfilled.
+    """
+    if frames is None:
+        files = pending_processed("market_history")
+        if not files:
+            return {}
+        frames = iter_processed(files)
+        src = f"{len(files)} files"
+    else:
+        src = "memory"
 
-            if not group.empty:
-                group.to_sql("market_history", engine, if_exists="append", index=False)
-                inserted_total += len(group)
+    watermarks = read_watermark_table(conn)
 
-    print(f"Inserted {inserted_total} new rows into market_history ({fname})")
+    def new_rows():
+        for df in frames:
+            if fill_gaps:
+                yield df
+                continue
+
+            missing = set(df["coin_id"].unique()) - watermarks.keys()
+            if missing:
+                watermarks.update(bootstrap_watermarks(conn, missing))
+
+            max_ts = pd.to_datetime(df["coin_id"].map(watermarks))
+            df = df[max_ts.isna() | (df["ts"] > max_ts)]
+            if not df.empty:
+                yield df
+
+    staged, written = bulk_load(conn, new_rows(), "market_history", upsert,
+                                before_merge=ensure_partitions)
+    if staged:
+        update_watermark_table(conn, "stage_market_history")
+        refresh_rollups(conn, "stage_market_history")
+    mode = "gap-aware" if fill_gaps else "after watermark"
+    print(f"Inserted {written} new rows into market_history ({staged} staged {mode} from {src})")
+    return read_watermark_table(conn)
 
 # --- Main ---
-def main():
-    load_coins(engine)
-    load_snapshots(engine)
-    load_history(engine)
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load processed datasets into PostgreSQL")
+    ap.add_argument("--upsert", action="store_true",
+                    help="update existing rows on key conflict instead of skipping them")
+    ap.add_argument("--fill-gaps", action="store_true",
+                    help="insert every (coin_id, ts) not yet present, not only rows after the watermark")
+    args = ap.parse_args(argv)
+
+    pending = pending_runs()
+
+    # Single transaction: either every table is loaded or nothing is
+    with get_engine().begin() as conn:
+        upgrade(conn)
+        load_coins(conn)
+        load_snapshots(conn, args.upsert)
+        load_fx(conn)
+        watermarks = load_history(conn, args.upsert, args.fill_gaps)
+        analytics.refresh_metrics(conn, full=args.fill_gaps)
+        version = bump_load_version(conn)
+
+    finish_load(watermarks, pending, version)
+
+def finish_load(watermarks, runs, version, memory_run=None):
+    """
+    Post-commit bookkeeping: state watermarks, manifest, local store mirror.
+    memory_run: (run_id, {dataset: [DataFrame]}) of a run loaded from memory
+    without processed files (pipeline.py), written into the mirror directly.
+    """
+    # Persist the last loaded ts per coin so extract.py only asks for the delta
+    write_watermarks({
+        coin_id: int(ts.value // 10**6) for coin_id, ts in watermarks.items() if ts is not None
+    })
+    print(f"Updated watermarks for {len(watermarks)} coins (load version {version})")
+    if runs:
+        mark_loaded([run_id for run_id, _ in runs])
+        print(f"Marked {len(runs)} processed runs as loaded")
+
+    # Mirror what was just committed into the local analysis store
+    if localstore.ENABLED:
+        n = localstore.sync(runs)
+        if memory_run is not None:
+            n += localstore.write_frames(*memory_run)
+        print(f"Mirrored {n} files into {localstore.LOCAL_DIR}")
 
 if __name__ == "__main__":
     main()
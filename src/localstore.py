@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+localstore.py
+Embedded read-only mirror of the loaded data for analysis, under data/local/.
+
+Same layout as the processed datasets (see dataset.py):
+    data/local/market_history/month=YYYY-MM/part-<run_id>.parquet
+    data/local/market_snapshots/month=YYYY-MM/part-<run_id>.parquet
+    data/local/fx_rates/month=YYYY-MM/part-<run_id>.parquet
+    data/local/coins.parquet
+
+load.py calls sync() after each committed load: the part files of the runs it
+just loaded are hard-linked (copied across filesystems) into the mirror, so
+keeping it in sync costs no extra I/O. Runs loaded straight from memory
+(pipeline.py without --checkpoint) have no part files; write_frames() writes
+their frames into the mirror instead. Analysis code selects it with
+--backend local (or ANALYSIS_BACKEND=local) and scans it with pyarrow —
+columnar, multi-threaded, memory-mapped, with partition and row-group
+pruning — without touching PostgreSQL, and keeps working while it is down.
+
+Usage:
+    python src/localstore.py --rebuild     # re-export everything from PostgreSQL
+    python src/localstore.py --compact     # merge parts per month
+"""
+
+import argparse
+import os
+import pathlib
+import shutil
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import config
+from dataset import (HISTORY_DATASET_SCHEMA, PROCESSED_DIR, PartitionedWriter, compact_partition,
+                     history_filter, open_dataset)
+from frames import HISTORY_COLUMNS, HISTORY_SCHEMA, RATES_SCHEMA, concat_history
+from state import MANIFEST_FILE
+
+LOCAL_DIR = pathlib.Path(__file__).resolve().parents[1] / "data" / "local"
+LOCAL_HISTORY_DIR = LOCAL_DIR / "market_history"
+LOCAL_SNAPSHOTS_DIR = LOCAL_DIR / "market_snapshots"
+LOCAL_COINS_FILE = LOCAL_DIR / "coins.parquet"
+
+# load.py mirrors every load here unless LOCAL_STORE=0
+ENABLED = config.LOCAL_STORE
+
+BACKENDS = config.ANALYSIS_BACKENDS
+DEFAULT_BACKEND = config.ANALYSIS_BACKEND
+
+KEYS = {
+    "market_history": ("coin_id", "ts"),
+    "market_snapshots": ("snapshot_id", "coin_id"),
+    "fx_rates": ("currency", "ts"),
+}
+SCHEMAS = {"market_history": HISTORY_SCHEMA, "fx_rates": RATES_SCHEMA}
+
+
+def available():
+    return LOCAL_HISTORY_DIR.exists()
+
+
+# --- Sync ---
+def mirror_file(src, dest):
+    """Hard-link `src` to `dest` (copy when linking isn't possible)."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(".tmp-" + dest.name)
+    if tmp.exists():
+        tmp.unlink()
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    tmp.replace(dest)
+
+
+def sync(runs):
+    """
+    Mirror the outputs of loaded runs ([(run_id, info), ...] from the
+    manifest) plus coins.parquet. Returns the number of files mirrored.
+    """
+    n = 0
+    for _, info in runs:
+        for prefix in KEYS:
+            entry = info["files"].get(prefix, [])
+            for rel in [entry] if isinstance(entry, str) else entry:
+                src = PROCESSED_DIR / rel
+                # Flat legacy outputs (pre-partitioning, CSV) aren't mirrored
+                if src.suffix != ".parquet" or not rel.startswith(prefix + "/") or not src.exists():
+                    continue
+                mirror_file(src, LOCAL_DIR / rel)
+                n += 1
+    coins = PROCESSED_DIR / "coins.parquet"
+    if coins.exists():
+        mirror_file(coins, LOCAL_COINS_FILE)
+        n += 1
+    return n
+
+
+def write_frames(run_id, frames):
+    """
+    Write the frames of a run loaded from memory ({"market_history": [...],
+    "market_snapshots": [...], "fx_rates": [...]}) as part-<run_id> files,
+    the layout sync() mirrors, plus coins.parquet. Returns the files written.
+    """
+    n = 0
+    history = [df for df in frames.get("market_history", []) if len(df)]
+    if history:
+        with PartitionedWriter(LOCAL_HISTORY_DIR, run_id, schema=HISTORY_SCHEMA) as writer:
+            writer.write(concat_history(history)[HISTORY_COLUMNS])
+        n += len(writer.writers)
+    with PartitionedWriter(LOCAL_SNAPSHOTS_DIR, run_id, sort_by=KEYS["market_snapshots"]) as writer:
+        for df in frames.get("market_snapshots", []):
+            for sid, part in df.groupby("snapshot_id", sort=True, observed=True):
+                writer.write(part, month=f"{sid[:4]}-{sid[4:6]}")
+    n += len(writer.writers)
+    with PartitionedWriter(LOCAL_DIR / "fx_rates", run_id, sort_by=KEYS["fx_rates"], schema=RATES_SCHEMA) as writer:
+        for df in frames.get("fx_rates", []):
+            writer.write(df)
+    n += len(writer.writers)
+    coins = PROCESSED_DIR / "coins.parquet"
+    if coins.exists():
+        mirror_file(coins, LOCAL_COINS_FILE)
+        n += 1
+    return n
+
+
+def rebuild(engine, batch_rows=200_000):
+    """Replace the mirror with a full export of PostgreSQL (bootstrap / repair)."""
+    import pandas as pd
+    from sqlalchemy import text
+
+    import frames
+
+    tmp_dir = LOCAL_DIR.with_name(LOCAL_DIR.name + ".rebuild")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    run_id = "rebuild-" + time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    queries = {
+        "market_history": "SELECT coin_id, ts, price_eur, market_cap, volume_24h, snapshot_id "
+                          "FROM market_history ORDER BY ts",
+        "market_snapshots": "SELECT * FROM market_snapshots ORDER BY snapshot_id",
+        "fx_rates": "SELECT currency, ts, rate FROM fx_rates ORDER BY ts",
+    }
+    rows = {}
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        for name, sql in queries.items():
+            read = pd.read_sql if name == "market_snapshots" else frames.read_sql
+            with PartitionedWriter(tmp_dir / name, run_id, sort_by=KEYS[name], schema=SCHEMAS.get(name)) as writer:
+                for df in read(text(sql), conn, chunksize=batch_rows):
+                    if name != "market_snapshots":
+                        writer.write(df)
+                        continue
+                    # Snapshots are partitioned by the month of their snapshot_id
+                    sid = df["snapshot_id"].astype(str)
+                    for month, part in df.groupby(sid.str[:4] + "-" + sid.str[4:6]):
+                        writer.write(part, month=month)
+            rows[name] = writer.rows
+        coins = pd.read_sql(text("SELECT * FROM coins"), conn)
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(coins, preserve_index=False), tmp_dir / LOCAL_COINS_FILE.name)
+
+    shutil.rmtree(LOCAL_DIR, ignore_errors=True)
+    tmp_dir.rename(LOCAL_DIR)
+    return rows
+
+
+def compact():
+    """Merge the parts of every month of the mirror (all of it is loaded data)."""
+    for name, key in KEYS.items():
+        root = LOCAL_DIR / name
+        for part_dir in sorted(root.glob("month=*")) if root.exists() else []:
+            merged, before, after = compact_partition(part_dir, key=key, schema=SCHEMAS.get(name))
+            if merged:
+                print(f"local {name}/{part_dir.name}: {merged} parts, {before} → {after} rows")
+
+
+# --- Readers ---
+def dedup(table, key=("coin_id", "ts")):
+    """
+    Keep the last row per key (parts are scanned oldest run first), vectorized:
+    the highest row number per key is picked and taken, so value columns of
+    any type (dictionary-encoded ones included) pass through untouched.
+    """
+    rows = table.select(list(key)).append_column("_row", pa.array(np.arange(len(table), dtype=np.int64)))
+    last = rows.group_by(list(key), use_threads=False).aggregate([("_row", "max")])["_row_max"]
+    return table.take(last)
+
+
+def history_table(coins=None, start=None, end=None, columns=None):
+    """market_history as a pyarrow Table, with pruning pushed down to the Parquet scan."""
+    if not available():
+        raise FileNotFoundError(f"No local store at {LOCAL_DIR} (run a load or localstore.py --rebuild)")
+    if columns is not None:
+        columns = list(dict.fromkeys(["coin_id", "ts", *columns]))
+    table = open_dataset(LOCAL_HISTORY_DIR, schema=HISTORY_DATASET_SCHEMA).to_table(columns=columns, filter=history_filter(coins, start, end))
+    return dedup(table)
+
+
+def read_history(coins=None, start=None, end=None, columns=None):
+    return history_table(coins, start, end, columns).to_pandas()
+
+
+def read_coins():
+    return pq.read_table(LOCAL_COINS_FILE).to_pandas()
+
+
+def read_latest_snapshot():
+    """Rows of the newest snapshot in the mirror, by rank."""
+    import pyarrow.compute as pc
+
+    snapshots = open_dataset(LOCAL_SNAPSHOTS_DIR)
+    latest = pc.max(snapshots.to_table(columns=["snapshot_id"])["snapshot_id"]).as_py()
+    table = snapshots.to_table(filter=pc.field("snapshot_id") == latest)
+    table = dedup(table.drop_columns(["month"]), key=KEYS["market_snapshots"])
+    return table.sort_by([("rank", "ascending"), ("coin_id", "ascending")]).to_pandas()
+
+
+def version():
+    """
+    Change stamp of the mirror, for caches keyed on the load version: the
+    manifest is rewritten after every load (which syncs first) and a rebuild
+    replaces the directory.
+    """
+    stamps = [p.stat().st_mtime_ns for p in (LOCAL_DIR, MANIFEST_FILE) if p.exists()]
+    return max(stamps, default=0)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Manage the local analysis store (data/local/)")
+    ap.add_argument("--rebuild", action="store_true", help="re-export everything from PostgreSQL")
+    ap.add_argument("--compact", action="store_true", help="merge the parts of every month")
+    args = ap.parse_args(argv)
+
+    if args.rebuild:
+        from db import get_engine
+        rows = rebuild(get_engine())
+        print("Rebuilt local store: " + ", ".join(f"{n} {name} rows" for name, n in rows.items()))
+    if args.compact:
+        compact()
+    if not (args.rebuild or args.compact):
+        ap.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
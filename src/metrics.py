@@ -0,0 +1,36 @@
+"""
+metrics.py
+Process-wide counters for pipeline observability: HTTP requests, retries and
+bytes (extract.py), COPY calls/bytes (load.py), SQL statements (any engine
+passed to count_statements). pipeline.py snapshots them around each stage.
+"""
+
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def incr(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters)
+
+
+def delta(before, after):
+    """Counters that changed between two snapshots."""
+    return {k: v - before.get(k, 0) for k, v in after.items() if v != before.get(k, 0)}
+
+
+def count_statements(engine):
+    """Count every statement `engine` sends to the database as db_statements."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(*_):
+        incr("db_statements")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+migrate.py
+Versioned schema migrations for the PostgreSQL database.
+
+Migrations are the numbered SQL files in src/migrations/ (NNNN_name.sql),
+applied in order and recorded in schema_migrations. load.py runs upgrade()
+at the start of every load, so the schema is always current; this script
+can also be run on its own to inspect or apply pending migrations.
+"""
+
+import argparse
+import pathlib
+
+from sqlalchemy import text
+
+MIGRATIONS_DIR = pathlib.Path(__file__).resolve().parent / "migrations"
+
+# Arbitrary key for pg_advisory_xact_lock: serializes concurrent upgrades
+LOCK_KEY = 0x63727970746f
+
+
+def available():
+    """[(version, name, path), ...] for every migration file, in order."""
+    out = []
+    for path in sorted(MIGRATIONS_DIR.glob("[0-9][0-9][0-9][0-9]_*.sql")):
+        version, _, name = path.stem.partition("_")
+        out.append((int(version), name, path))
+    return out
+
+
+def applied(conn):
+    """Versions already recorded in schema_migrations."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version    INTEGER PRIMARY KEY,
+            name       TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """))
+    return {v for (v,) in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def upgrade(conn, verbose=True):
+    """Apply pending migrations inside the caller's transaction. Returns the versions applied."""
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOCK_KEY})
+    done = applied(conn)
+    new = []
+    for version, name, path in available():
+        if version in done:
+            continue
+        # Raw DBAPI cursor without parameters: the file may hold several
+        # statements, dollar-quoted bodies and literal % signs
+        with conn.connection.cursor() as cur:
+            cur.execute(path.read_text(encoding="utf-8"))
+        conn.execute(
+            text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"),
+            {"v": version, "n": name}
+        )
+        new.append(version)
+        if verbose:
+            print(f"Applied migration {version:04d} {name}")
+    return new
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Apply pending schema migrations")
+    ap.add_argument("--status", action="store_true", help="list migrations without applying them")
+    args = ap.parse_args(argv)
+
+    from db import get_engine
+
+    with get_engine().begin() as conn:
+        if args.status:
+            done = applied(conn)
+            for version, name, _ in available():
+                print(f"{version:04d} {name:<30} {'applied' if version in done else 'pending'}")
+            return
+        if not upgrade(conn):
+            print("Schema is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+-- 0001_base_schema.sql
+-- Baseline schema as used by load.py so far. Written with IF NOT EXISTS so it
+-- also applies cleanly to databases whose tables were created by to_sql.
+-- Those may hold repeated keys (to_sql appended every run), so duplicates are
+-- removed before each unique index is built: for market_history the row of the
+-- latest snapshot is kept (the rule 0002 applies when it copies the rows),
+-- for market_snapshots the row inserted last.
+
+CREATE TABLE IF NOT EXISTS coins (
+    coin_id TEXT PRIMARY KEY,
+    symbol  TEXT,
+    name    TEXT
+);
+
+CREATE TABLE IF NOT EXISTS market_snapshots (
+    snapshot_id  TEXT NOT NULL,
+    coin_id      TEXT NOT NULL,
+    price_eur    DOUBLE PRECISION,
+    market_cap   DOUBLE PRECISION,
+    volume_24h   DOUBLE PRECISION,
+    rank         BIGINT,
+    last_updated TEXT
+);
+DELETE FROM market_snapshots s
+USING (
+    SELECT ctid, row_number() OVER (PARTITION BY snapshot_id, coin_id ORDER BY ctid DESC) AS rn
+    FROM market_snapshots
+) d
+WHERE s.ctid = d.ctid AND d.rn > 1;
+CREATE UNIQUE INDEX IF NOT EXISTS market_snapshots_snapshot_id_coin_id_key
+    ON market_snapshots (snapshot_id, coin_id);
+
+CREATE TABLE IF NOT EXISTS market_history (
+    coin_id     TEXT NOT NULL,
+    ts          TIMESTAMP NOT NULL,
+    price_eur   DOUBLE PRECISION,
+    market_cap  DOUBLE PRECISION,
+    volume_24h  DOUBLE PRECISION,
+    snapshot_id TEXT
+);
+DELETE FROM market_history h
+USING (
+    SELECT ctid, row_number() OVER (PARTITION BY coin_id, ts ORDER BY snapshot_id DESC, ctid DESC) AS rn
+    FROM market_history
+) d
+WHERE h.ctid = d.ctid AND d.rn > 1;
+CREATE UNIQUE INDEX IF NOT EXISTS market_history_coin_id_ts_key
+    ON market_history (coin_id, ts);
+
+CREATE TABLE IF NOT EXISTS load_watermarks (
+    coin_id    TEXT PRIMARY KEY,
+    max_ts     TIMESTAMP NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
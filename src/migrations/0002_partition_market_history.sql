@@ -0,0 +1,65 @@
+-- 0002_partition_market_history.sql
+-- Turns market_history into a table range-partitioned by month on ts, with
+-- PRIMARY KEY (coin_id, ts). Monthly partitions (market_history_yYYYYmMM) are
+-- created on demand by ensure_market_history_partitions(), which load.py
+-- calls for the time range of every batch before inserting it.
+
+CREATE OR REPLACE FUNCTION ensure_market_history_partitions(p_from TIMESTAMP, p_to TIMESTAMP)
+RETURNS INTEGER LANGUAGE plpgsql AS $$
+DECLARE
+    m       TIMESTAMP := date_trunc('month', p_from);
+    part    TEXT;
+    created INTEGER := 0;
+BEGIN
+    IF p_from IS NULL OR p_to IS NULL THEN
+        RETURN 0;
+    END IF;
+    WHILE m <= p_to LOOP
+        part := 'market_history_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM');
+        IF to_regclass(part) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF market_history FOR VALUES FROM (%L) TO (%L)',
+                part, m, m + INTERVAL '1 month'
+            );
+            created := created + 1;
+        END IF;
+        m := m + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END $$;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('market_history')) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE market_history RENAME TO market_history_legacy;
+    ALTER INDEX IF EXISTS market_history_coin_id_ts_key RENAME TO market_history_legacy_coin_id_ts_key;
+
+    CREATE TABLE market_history (
+        coin_id     TEXT NOT NULL,
+        ts          TIMESTAMP NOT NULL,
+        price_eur   DOUBLE PRECISION,
+        market_cap  DOUBLE PRECISION,
+        volume_24h  DOUBLE PRECISION,
+        snapshot_id TEXT,
+        PRIMARY KEY (coin_id, ts)
+    ) PARTITION BY RANGE (ts);
+
+    PERFORM ensure_market_history_partitions(
+        (SELECT MIN(ts) FROM market_history_legacy),
+        (SELECT MAX(ts) FROM market_history_legacy)
+    );
+
+    INSERT INTO market_history (coin_id, ts, price_eur, market_cap, volume_24h, snapshot_id)
+    SELECT DISTINCT ON (coin_id, ts) coin_id, ts, price_eur, market_cap, volume_24h, snapshot_id
+    FROM market_history_legacy
+    WHERE coin_id IS NOT NULL AND ts IS NOT NULL
+    ORDER BY coin_id, ts, snapshot_id DESC;
+
+    DROP TABLE market_history_legacy;
+END $$;
+
+-- Time-range scans across all coins (dashboards, rollup refresh by date)
+CREATE INDEX IF NOT EXISTS market_history_ts_idx ON market_history (ts);
@@ -0,0 +1,45 @@
+-- 0003_rollups.sql
+-- Pre-aggregated OHLC rollups of market_history. They behave like
+-- materialized views but are plain tables so load.py can refresh only the
+-- buckets touched by each load (see load.refresh_rollups) instead of
+-- recomputing everything.
+
+CREATE TABLE IF NOT EXISTS market_history_hourly (
+    coin_id    TEXT NOT NULL,
+    bucket     TIMESTAMP NOT NULL,
+    open       DOUBLE PRECISION,
+    high       DOUBLE PRECISION,
+    low        DOUBLE PRECISION,
+    close      DOUBLE PRECISION,
+    avg_price  DOUBLE PRECISION,
+    market_cap DOUBLE PRECISION,
+    volume_24h DOUBLE PRECISION,
+    n_points   INTEGER NOT NULL,
+    PRIMARY KEY (coin_id, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS market_history_daily (LIKE market_history_hourly INCLUDING ALL);
+
+CREATE INDEX IF NOT EXISTS market_history_hourly_bucket_idx ON market_history_hourly (bucket);
+CREATE INDEX IF NOT EXISTS market_history_daily_bucket_idx ON market_history_daily (bucket);
+
+-- Initial fill from the existing history
+INSERT INTO market_history_hourly
+SELECT coin_id, date_trunc('hour', ts),
+       (array_agg(price_eur ORDER BY ts))[1], MAX(price_eur), MIN(price_eur),
+       (array_agg(price_eur ORDER BY ts DESC))[1], AVG(price_eur),
+       (array_agg(market_cap ORDER BY ts DESC))[1], (array_agg(volume_24h ORDER BY ts DESC))[1],
+       COUNT(*)
+FROM market_history
+GROUP BY coin_id, date_trunc('hour', ts)
+ON CONFLICT DO NOTHING;
+
+INSERT INTO market_history_daily
+SELECT coin_id, date_trunc('day', ts),
+       (array_agg(price_eur ORDER BY ts))[1], MAX(price_eur), MIN(price_eur),
+       (array_agg(price_eur ORDER BY ts DESC))[1], AVG(price_eur),
+       (array_agg(market_cap ORDER BY ts DESC))[1], (array_agg(volume_24h ORDER BY ts DESC))[1],
+       COUNT(*)
+FROM market_history
+GROUP BY coin_id, date_trunc('day', ts)
+ON CONFLICT DO NOTHING;
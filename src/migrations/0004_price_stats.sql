@@ -0,0 +1,18 @@
+-- 0004_price_stats.sql
+-- Running per-coin price statistics for analysis/summary.py. Stored in
+-- Welford form (count, mean, sum of squared deviations m2) so batches of new
+-- rows can be merged in without rescanning the history (Chan et al. update).
+-- last_ts is the load watermark the rows were folded in up to.
+
+CREATE TABLE IF NOT EXISTS price_stats (
+    coin_id    TEXT PRIMARY KEY,
+    n          BIGINT NOT NULL,
+    mean       DOUBLE PRECISION,
+    m2         DOUBLE PRECISION,
+    min_price  DOUBLE PRECISION,
+    max_price  DOUBLE PRECISION,
+    start_date TIMESTAMP,
+    end_date   TIMESTAMP,
+    last_ts    TIMESTAMP NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,12 @@
+-- 0005_load_version.sql
+-- Single-row counter bumped by load.py at the end of every load transaction.
+-- Readers (the dashboard) key their caches on it, so they only query the
+-- data tables again after new data has been committed.
+
+CREATE TABLE IF NOT EXISTS load_version (
+    id        BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version   BIGINT NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+INSERT INTO load_version (id, version) VALUES (TRUE, 0) ON CONFLICT DO NOTHING;
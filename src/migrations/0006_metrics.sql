@@ -0,0 +1,48 @@
+-- 0006_metrics.sql
+-- Derived metrics materialized by src/analytics.py after each load, on the
+-- aligned daily grid of market_history_daily closes. Consumers (charts.py,
+-- the dashboard) read these tables instead of recomputing them.
+--
+-- metrics_returns:     per coin and day: close, log return, rolling mean of
+--                      the close and annualized rolling volatility of the log
+--                      returns over 7 and 30 days. Only buckets from each
+--                      coin's last computed one onwards are rewritten.
+-- metrics_sharpe:      annualized Sharpe ratio per coin (daily simple returns);
+--                      last_ts is the load watermark it was computed at.
+-- metrics_correlation: pairwise correlation of daily log returns over the
+--                      trailing window, one row per coin pair (coin_a < coin_b).
+
+CREATE TABLE IF NOT EXISTS metrics_returns (
+    coin_id    TEXT NOT NULL,
+    bucket     TIMESTAMP NOT NULL,
+    close      DOUBLE PRECISION,
+    log_return DOUBLE PRECISION,
+    ma_7       DOUBLE PRECISION,
+    ma_30      DOUBLE PRECISION,
+    vol_7      DOUBLE PRECISION,
+    vol_30     DOUBLE PRECISION,
+    PRIMARY KEY (coin_id, bucket)
+);
+
+CREATE INDEX IF NOT EXISTS metrics_returns_bucket_idx ON metrics_returns (bucket);
+
+CREATE TABLE IF NOT EXISTS metrics_sharpe (
+    coin_id     TEXT PRIMARY KEY,
+    n_returns   BIGINT NOT NULL,
+    mean_return DOUBLE PRECISION,
+    std_return  DOUBLE PRECISION,
+    sharpe      DOUBLE PRECISION,
+    last_bucket TIMESTAMP NOT NULL,
+    last_ts     TIMESTAMP NOT NULL,
+    updated_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS metrics_correlation (
+    coin_a       TEXT NOT NULL,
+    coin_b       TEXT NOT NULL,
+    n_obs        INTEGER NOT NULL,
+    corr         DOUBLE PRECISION,
+    window_start TIMESTAMP NOT NULL,
+    window_end   TIMESTAMP NOT NULL,
+    PRIMARY KEY (coin_a, coin_b)
+);
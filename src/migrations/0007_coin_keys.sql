@@ -0,0 +1,10 @@
+-- 0007_coin_keys.sql
+-- Surrogate integer keys of the coin dimension (src/coindim.py). The keys
+-- are assigned by the dimension and never change, so tables and queries can
+-- join on a 4-byte integer instead of the text coin_id. load.py only writes
+-- the coins whose key, symbol, name or first_seen differ from these rows.
+
+ALTER TABLE coins ADD COLUMN IF NOT EXISTS coin_key INTEGER;
+ALTER TABLE coins ADD COLUMN IF NOT EXISTS first_seen TIMESTAMP;
+
+CREATE UNIQUE INDEX IF NOT EXISTS coins_coin_key_key ON coins (coin_key);
@@ -0,0 +1,56 @@
+-- 0008_fx_rates.sql
+-- Multi-currency quotes (src/fx.py). Prices are still stored once, in EUR
+-- (the price_eur columns, unchanged, so every existing query keeps working).
+-- fx_rates holds the reference rates: rate = units of `currency` per 1 EUR
+-- at `ts`. Other currencies are derived at read time with an as-of join
+-- (the last rate at or before each ts) in the *_quotes views below.
+
+CREATE TABLE IF NOT EXISTS fx_rates (
+    currency TEXT NOT NULL,
+    ts       TIMESTAMP NOT NULL,
+    rate     DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (currency, ts)
+);
+
+-- Every currency a quote can be asked in
+CREATE OR REPLACE VIEW fx_currencies AS
+SELECT 'eur'::TEXT AS currency
+UNION
+SELECT DISTINCT currency FROM fx_rates;
+
+-- market_history in every currency: (coin_id, ts, currency) → values.
+-- Filter on currency (and coin_id/ts) when querying; each row looks up its
+-- rate through the fx_rates primary key.
+CREATE OR REPLACE VIEW market_history_quotes AS
+SELECT h.coin_id, h.ts, c.currency,
+       h.price_eur * fx.rate  AS price,
+       h.market_cap * fx.rate AS market_cap,
+       h.volume_24h * fx.rate AS volume_24h,
+       h.snapshot_id
+FROM market_history h
+CROSS JOIN fx_currencies c
+CROSS JOIN LATERAL (
+    SELECT CASE WHEN c.currency = 'eur' THEN 1.0 ELSE (
+        SELECT r.rate FROM fx_rates r
+        WHERE r.currency = c.currency AND r.ts <= h.ts
+        ORDER BY r.ts DESC LIMIT 1
+    ) END AS rate
+) fx;
+
+-- Rollups in every currency, converted at the rate of the bucket start
+CREATE OR REPLACE VIEW market_history_daily_quotes AS
+SELECT d.coin_id, d.bucket, c.currency,
+       d.open * fx.rate AS open, d.high * fx.rate AS high,
+       d.low * fx.rate AS low, d.close * fx.rate AS close,
+       d.avg_price * fx.rate AS avg_price,
+       d.market_cap * fx.rate AS market_cap, d.volume_24h * fx.rate AS volume_24h,
+       d.n_points
+FROM market_history_daily d
+CROSS JOIN fx_currencies c
+CROSS JOIN LATERAL (
+    SELECT CASE WHEN c.currency = 'eur' THEN 1.0 ELSE (
+        SELECT r.rate FROM fx_rates r
+        WHERE r.currency = c.currency AND r.ts <= d.bucket
+        ORDER BY r.ts DESC LIMIT 1
+    ) END AS rate
+) fx;
@@ -0,0 +1,21 @@
+-- 0009_market_history_changes.sql
+-- Per-partition write counter for backup/backup.py. load.py (and stream.py)
+-- bump the counter of every market_history partition a batch writes to, in
+-- the same transaction as the rows, so the backup can tell which partitions
+-- changed since their last export without scanning them. Statistics
+-- counters (pg_stat_user_tables) can't be trusted for that: they are
+-- updated asynchronously and reset by pg_stat_reset() or a crash.
+
+CREATE TABLE IF NOT EXISTS market_history_changes (
+    partition  TEXT PRIMARY KEY,
+    changes    BIGINT NOT NULL DEFAULT 0,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Partitions written before this table existed start at one change
+INSERT INTO market_history_changes (partition, changes)
+SELECT c.relname, 1
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = to_regclass('market_history')
+ON CONFLICT (partition) DO NOTHING;
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+pipeline.py
+In-process orchestrator: extract → transform → load in a single Python
+process, handing markets, charts and DataFrames from stage to stage in memory
+(one import of pandas/SQLAlchemy, one engine, no re-reading of intermediate
+files).
+
+--checkpoint additionally writes the raw files and the processed run (with
+its manifest entry) exactly as the batch scripts do, so the run can be
+replayed or inspected; without it only the coin dimension (coindim.py), the
+run report and, after the load, the local analysis store's copy of the
+loaded frames are written to disk.
+
+Every stage records wall and CPU time, rows, bytes and the counters of
+metrics.py (HTTP requests/retries/bytes, SQL statements, COPY calls/bytes).
+The run report is written as JSON to data/reports/. --profile adds a cProfile
+capture per stage (top functions in the report, full .prof next to it; main
+thread only) and --tracemalloc the peak Python memory allocated by each stage.
+
+Usage:
+    python src/pipeline.py --top-n 100
+    python src/pipeline.py --checkpoint --profile --tracemalloc
+"""
+
+import argparse
+import contextlib
+import cProfile
+import io
+import pathlib
+import pstats
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import coindim
+import extract
+import fx
+import metrics
+from coindim import snapshot_time
+from state import read_manifest, write_json
+from transform import WRITE_CSV, history_frame, snapshot_frames, write_run
+
+REPORTS_DIR = pathlib.Path(__file__).resolve().parents[1] / "data" / "reports"
+
+# Functions listed per stage in the report when profiling
+PROFILE_TOP = 15
+
+
+class StageRecorder:
+    """Collects per-stage measurements into a run report."""
+
+    def __init__(self, run_name, profile=False, trace_memory=False, reports_dir=REPORTS_DIR):
+        self.run_name = run_name
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.reports_dir = pathlib.Path(reports_dir)
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure the enclosed block; the caller fills rows/bytes in the yielded dict."""
+        info = {"rows": 0, "bytes": 0}
+        before = metrics.snapshot()
+        prof = cProfile.Profile() if self.profile else None
+        if self.trace_memory:
+            tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if prof:
+            prof.enable()
+        try:
+            yield info
+        finally:
+            if prof:
+                prof.disable()
+            info["wall_s"] = round(time.perf_counter() - wall, 4)
+            info["cpu_s"] = round(time.process_time() - cpu, 4)
+            if self.trace_memory:
+                info["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            info["counters"] = metrics.delta(before, metrics.snapshot())
+            if prof:
+                info["profile"] = self._profile_summary(name, prof)
+            self.stages[name] = info
+            print(f"[{name}] {info['wall_s']:.2f}s, {info['rows']} rows", flush=True)
+
+    def _profile_summary(self, name, prof):
+        self.reports_dir.mkdir(parents=True, exist_ok=True)
+        prof_file = self.reports_dir / f"{self.run_name}_{name}.prof"
+        prof.dump_stats(str(prof_file))
+        stats = pstats.Stats(prof, stream=io.StringIO()).sort_stats("cumulative")
+        top = []
+        for (fname, line, func), (_, ncalls, tottime, cumtime, _) in list(stats.stats.items()):
+            top.append({"function": f"{pathlib.Path(fname).name}:{line}({func})",
+                        "ncalls": ncalls, "tottime_s": round(tottime, 4), "cumtime_s": round(cumtime, 4)})
+        top.sort(key=lambda r: r["cumtime_s"], reverse=True)
+        return {"file": prof_file.name, "top": top[:PROFILE_TOP]}
+
+    def report(self, **extra):
+        totals = {
+            "wall_s": round(sum(s["wall_s"] for s in self.stages.values()), 4),
+            "cpu_s": round(sum(s["cpu_s"] for s in self.stages.values()), 4),
+        }
+        counters = {}
+        for s in self.stages.values():
+            for k, v in s["counters"].items():
+                counters[k] = counters.get(k, 0) + v
+        totals["counters"] = counters
+        return {"run": self.run_name, **extra, "stages": self.stages, "totals": totals}
+
+    def write(self, report, path=None):
+        path = pathlib.Path(path) if path else self.reports_dir / f"{self.run_name}.json"
+        write_json(path, report)
+        return path
+
+
+def frame_bytes(frames):
+    return int(sum(df.memory_usage(deep=True).sum() for df in frames))
+
+
+def checkpoint_bytes(files):
+    from dataset import PROCESSED_DIR
+    return sum((PROCESSED_DIR / f).stat().st_size for f in files if (PROCESSED_DIR / f).exists())
+
+
+def run(args):
+    started = datetime.now(timezone.utc)
+    snapshot_id = started.strftime("%Y%m%dT%H%M%SZ")
+    rec = StageRecorder(f"pipeline_{snapshot_id}", args.profile, args.tracemalloc)
+
+    # --- Extract: markets + charts kept in memory ---
+    with rec.stage("extract") as info:
+        snap = extract.extract_snapshot(args.top_n, args.mode, args.days, snapshot_id=snapshot_id,
+                                        save=args.checkpoint, keep=True)
+        meta, markets, charts = snap["metadata"], snap["markets"], snap["charts"]
+        info["rows"] = len(markets) + sum(len(c.get("prices", [])) for c in charts.values())
+    rec.stages["extract"]["bytes"] = rec.stages["extract"]["counters"].get("http_bytes", 0)
+
+    # --- Transform: DataFrames built in memory (optionally checkpointed) ---
+    with rec.stage("transform") as info:
+        sid = meta["snapshot_id"]
+        df_snap, df_coins = snapshot_frames(pd.DataFrame(markets), sid)
+        since = meta["since"]
+        hist = [history_frame(c, charts[c], sid, since.get(c)) for c in meta["coins"] if c in charts]
+        hist = [df for df in hist if not df.empty]
+        fx_charts = snap["fx"]
+        rates = (fx.rates_frame(fx_charts[fx.BASE_CURRENCY], fx_charts, meta["fx"]["currencies"])
+                 if fx_charts else fx.empty_rates())
+        del snap, charts, fx_charts  # raw responses are no longer needed
+        info["rows"] = len(df_snap) + sum(len(df) for df in hist)
+        info["bytes"] = frame_bytes([df_snap, df_coins, *hist])
+        runs = []
+        if args.checkpoint:
+            run_id = write_run([sid], [df_snap], [df_coins], iter(hist), args.csv, fx_frames=[rates])
+            run_info = read_manifest()["runs"][run_id]
+            runs = [(run_id, run_info)]
+            info["checkpoint_bytes"] = checkpoint_bytes(
+                run_info["files"]["market_snapshots"] + run_info["files"]["market_history"])
+        else:
+            coindim.update(df_coins, snapshot_time(sid))  # write_run does it with --checkpoint
+
+    # --- Load: one engine, one transaction, frames straight from memory ---
+    if not args.skip_load:
+        import analytics
+        import load
+        from db import get_engine
+        from migrate import upgrade
+
+        engine = get_engine()
+        metrics.count_statements(engine)
+        with rec.stage("load") as info:
+            with engine.begin() as conn:
+                upgrade(conn, verbose=False)
+                load.load_coins(conn, df=df_coins)
+                load.load_snapshots(conn, args.upsert, frames=[df_snap])
+                load.load_fx(conn, frames=[rates])
+                watermarks = load.load_history(conn, args.upsert, args.fill_gaps, frames=hist)
+                analytics.refresh_metrics(conn, full=args.fill_gaps)
+                version = load.bump_load_version(conn)
+            # Without --checkpoint there are no processed files to mirror: the
+            # local store gets the frames themselves, or it would miss this window
+            memory_run = None if runs else (sid, {"market_history": hist, "market_snapshots": [df_snap],
+                                                  "fx_rates": [rates]})
+            load.finish_load(watermarks, runs, version, memory_run)
+            info["rows"] = len(df_coins) + len(df_snap) + sum(len(df) for df in hist)
+        rec.stages["load"]["bytes"] = rec.stages["load"]["counters"].get("db_copy_bytes", 0)
+
+    report = rec.report(
+        snapshot_id=sid,
+        started=started.isoformat(),
+        finished=datetime.now(timezone.utc).isoformat(),
+        options={k: v for k, v in vars(args).items() if k != "report"},
+    )
+    if args.tracemalloc:
+        import resource
+        report["totals"]["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    path = rec.write(report, args.report)
+    print(f"Run report: {path}")
+    return report
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Run extract → transform → load in one process")
+    ap.add_argument("--top-n", type=int, default=extract.UNIVERSE_SIZE)
+    ap.add_argument("--mode", choices=["incremental", "full"], default="incremental")
+    ap.add_argument("--days", type=int, default=extract.BACKFILL_DAYS)
+    ap.add_argument("--checkpoint", action="store_true",
+                    help="also write raw files and the processed run to disk, as the batch scripts do")
+    ap.add_argument("--csv", action="store_true", default=WRITE_CSV,
+                    help="with --checkpoint, also write CSV copies")
+    ap.add_argument("--upsert", action="store_true")
+    ap.add_argument("--fill-gaps", action="store_true")
+    ap.add_argument("--skip-load", action="store_true", help="stop after transform (no database)")
+    ap.add_argument("--profile", action="store_true", help="cProfile every stage")
+    ap.add_argument("--tracemalloc", action="store_true", help="record peak traced memory per stage")
+    ap.add_argument("--report", help="report path (default: data/reports/pipeline_<snapshot_id>.json)")
+    args = ap.parse_args(argv)
+    run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+rawio.py
+Readers and writers for the raw API responses stored in data/raw/.
+
+Two on-disk formats are supported:
+- .json       pretty-printed JSON document (legacy, still readable)
+- .ndjson.gz  gzip-compressed newline-delimited JSON. Lists (coins/markets) are
+              stored one element per line; market_chart payloads as blocks of at
+              most RAW_CHUNK_POINTS points: {"series": "prices", "points": [...]}.
+              Written as a stream and read back block by block.
+
+NumPy/pandas are only imported by the readers, so the extractor (which only
+writes) starts without them.
+"""
+
+import gzip
+import json
+
+FORMATS = ("json", "ndjson.gz")
+RAW_CHUNK_POINTS = 10_000
+
+
+def raw_suffix(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown raw format {fmt!r}, expected one of {FORMATS}")
+    return "." + fmt
+
+
+def is_ndjson(path):
+    return str(path).endswith(".ndjson.gz")
+
+
+def coin_from_filename(fname):
+    """<snapshot>_<ts>_<coin_id>_market_chart.<ext> → coin_id"""
+    return str(fname).split("_market_chart")[0].split("_")[-1]
+
+
+def currency_from_filename(fname):
+    """<snapshot>_<ts>_fx_<currency>_reference_chart.<ext> → currency (see fx.py)"""
+    return str(fname).split("_reference_chart")[0].split("_")[-1]
+
+
+# --- Writers ---
+def iter_records(obj, chunk_points=RAW_CHUNK_POINTS):
+    """Split an API response into NDJSON records."""
+    if isinstance(obj, list):
+        yield from obj
+        return
+    for series, points in obj.items():
+        for i in range(0, max(len(points), 1), chunk_points):
+            yield {"series": series, "points": points[i:i + chunk_points]}
+
+
+def write_ndjson(path, records):
+    """Stream records to a gzip NDJSON file, one compact JSON document per line."""
+    n = 0
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+            n += 1
+    return n
+
+
+# --- Readers ---
+def iter_ndjson(path):
+    """Yield the records of a gzip NDJSON file one line at a time."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_chart(path):
+    """
+    Load a market_chart file as {series: points}. For NDJSON the blocks are
+    converted to NumPy (n, 2) arrays as they are read, so the Python object
+    representation of the whole payload never materializes.
+    """
+    import numpy as np
+
+    if not is_ndjson(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    blocks = {}
+    for rec in iter_ndjson(path):
+        arr = np.asarray(rec["points"], dtype=np.float64).reshape(-1, 2)
+        blocks.setdefault(rec["series"], []).append(arr)
+    return {series: np.concatenate(parts) for series, parts in blocks.items()}
+
+
+def read_markets(path):
+    """Load a coins_markets file as a DataFrame."""
+    import pandas as pd
+
+    if is_ndjson(path):
+        return pd.read_json(path, lines=True, compression="gzip")
+    return pd.read_json(path)
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+readapi.py
+Read-only HTTP API over the loaded data, for the dashboard, the notebook and
+external consumers (src/apiclient.py is the Python client).
+
+    GET /version                 {"version": load version, "backend": ...}
+    GET /health                  pool and cache counters
+    GET /coins                   coin dimension
+    GET /snapshot/latest         rows of the newest market snapshot
+    GET /history                 downsampled close/OHLC series (src/downsample.py)
+            coins=a,b            default: every coin
+            days=N | start=, end=  window (days: back from the last point)
+            points=500           about this many points per coin
+            mode=lttb|ohlc
+            currency=eur         other quote currencies need FX rates (src/fx.py)
+    GET /stats                   per-coin summary statistics (price_stats)
+    GET /metrics/sharpe          [coins=a,b]
+    GET /metrics/correlation     [coins=a,b]
+
+Every table endpoint takes format=json (default; gzip-compressed when the
+client accepts it), arrow (Arrow IPC stream, zstd buffers) or parquet.
+
+Single asyncio process. Queries run in a thread pool of exactly API_POOL_SIZE
+workers, each borrowing from a connection pool of the same size with no
+overflow, so the number of PostgreSQL connections stays at API_POOL_SIZE
+however many clients are connected; extra requests wait their turn.
+
+Responses are cached under the load_version row (0005_load_version.sql),
+re-read at most every API_VERSION_TTL seconds: until the next load commits,
+repeated requests are answered from memory, concurrent identical requests
+share one query, and clients holding the ETag (load version, format and
+content encoding) get 304. --backend local serves
+the local Parquet store instead (src/localstore.py).
+
+Usage:
+    python src/readapi.py --port 8800
+    python src/readapi.py --backend local --pool-size 2
+"""
+
+import argparse
+import asyncio
+import collections
+import datetime as dt
+import gzip
+import io
+import json
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+import analytics
+import config
+import downsample
+import frames
+import fx
+import localstore
+
+API_HOST = config.API_HOST
+API_PORT = config.API_PORT
+API_POOL_SIZE = config.API_POOL_SIZE
+API_VERSION_TTL = config.API_VERSION_TTL
+API_CACHE_ENTRIES = config.API_CACHE_ENTRIES
+
+FORMATS = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+STATUS_TEXT = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+               405: "Method Not Allowed", 500: "Internal Server Error"}
+
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_BYTES = 1024
+MAX_HEADER_BYTES = 16 * 1024
+
+
+class BadRequest(ValueError):
+    pass
+
+
+# --- Parameters ---
+def coins_param(params):
+    coins = [c.strip() for c in params.get("coins", "").split(",") if c.strip()]
+    return coins or None
+
+
+def int_param(params, name, default=None, low=1, high=100_000):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        n = int(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer, got {value!r}")
+    if not low <= n <= high:
+        raise BadRequest(f"{name} must be between {low} and {high}")
+    return n
+
+
+def ts_param(params, name):
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        return downsample.naive_utc(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be an ISO date/time, got {value!r}")
+
+
+def history_params(params):
+    mode = params.get("mode", "lttb")
+    if mode not in downsample.MODES:
+        raise BadRequest(f"mode must be one of {downsample.MODES}")
+    return {
+        "coins": coins_param(params),
+        "start": ts_param(params, "start"),
+        "end": ts_param(params, "end"),
+        "days": int_param(params, "days"),
+        "n_points": int_param(params, "points", 500, low=3),
+        "mode": mode,
+        "currency": params.get("currency", fx.BASE_CURRENCY).lower(),
+    }
+
+
+def quote(df, rates, currency):
+    """Convert a history result (price_eur or OHLC columns) to `currency`."""
+    if currency == fx.BASE_CURRENCY:
+        return df
+    if currency not in set(rates["currency"]):
+        raise BadRequest(f"no FX rates stored for {currency!r}")
+    return fx.convert(df, rates, currency, columns=("price_eur", "open", "high", "low", "close"))
+
+
+def utc(df, col="ts"):
+    if col in df and len(df) and getattr(df[col].dt, "tz", None) is None:
+        df[col] = df[col].dt.tz_localize("UTC")
+    return df
+
+
+# --- Sources ---
+class PostgresSource:
+    """Queries PostgreSQL through a fixed-size pool (no overflow connections)."""
+
+    name = "postgres"
+
+    def __init__(self, pool_size):
+        from db import new_engine
+
+        self.engine = new_engine(pool_size=pool_size, max_overflow=0, pool_pre_ping=True, pool_timeout=60)
+
+    def pool_stats(self):
+        pool = self.engine.pool
+        return {"pool_size": pool.size(), "connections": pool.checkedin() + pool.checkedout(),
+                "checked_out": pool.checkedout()}
+
+    def version(self):
+        with self.engine.connect() as conn:
+            if not conn.execute(text("SELECT to_regclass('load_version') IS NOT NULL")).scalar():
+                return 0
+            return conn.execute(text("SELECT version FROM load_version")).scalar() or 0
+
+    def read(self, sql, params=None):
+        with self.engine.connect() as conn:
+            return frames.read_sql(text(sql), conn, params)
+
+    def coins(self):
+        return self.read("SELECT coin_key, coin_id, symbol, name FROM coins ORDER BY coin_id")
+
+    def latest_snapshot(self):
+        return self.read("""
+            SELECT * FROM market_snapshots
+            WHERE snapshot_id = (SELECT MAX(snapshot_id) FROM market_snapshots)
+            ORDER BY rank NULLS LAST, coin_id
+        """)
+
+    def history(self, coins, start, end, days, n_points, mode, currency):
+        # One connection per request: a second checkout could wait forever on a full pool
+        with self.engine.connect() as conn:
+            if not coins:
+                coins = conn.execute(text("SELECT coin_id FROM coins ORDER BY coin_id")).scalars().all()
+            if days is not None and start is None:
+                last = end or downsample.time_bounds(conn, coins)[1]
+                start = last - dt.timedelta(days=days) if last is not None else None
+            df = downsample.downsample(conn, coins, start, end, n_points, mode)
+            if currency != fx.BASE_CURRENCY:
+                df = quote(df, fx.read_rates(conn, [currency], start), currency)
+        return utc(df)
+
+    def stats(self):
+        with self.engine.connect() as conn:
+            return analytics.read_price_stats(conn)
+
+    def sharpe(self, coins):
+        with self.engine.connect() as conn:
+            return analytics.read_sharpe(conn, coins)
+
+    def correlation(self, coins):
+        with self.engine.connect() as conn:
+            return analytics.read_correlation(conn, coins)
+
+
+class LocalSource:
+    """Reads the local Parquet store; the load version is its sync time."""
+
+    name = "local"
+
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+
+    def pool_stats(self):
+        return {"pool_size": self.pool_size, "connections": 0, "checked_out": 0}
+
+    def version(self):
+        return localstore.version()
+
+    def coins(self):
+        return localstore.read_coins().sort_values("coin_id", ignore_index=True)
+
+    def latest_snapshot(self):
+        return localstore.read_latest_snapshot()
+
+    def history(self, coins, start, end, days, n_points, mode, currency):
+        df = localstore.read_history(coins, start, end, columns=["price_eur"])
+        df = df.sort_values(["coin_id", "ts"], ignore_index=True)
+        if days is not None and start is None and len(df):
+            start = df["ts"].max() - pd.Timedelta(days=days)
+            df = df[df["ts"] >= start].reset_index(drop=True)
+        if mode == "ohlc":
+            df = downsample.ohlc_frame(df, start or df["ts"].min(), end or df["ts"].max(), n_points)
+        else:
+            df = downsample.lttb_frame(df[["coin_id", "ts", "price_eur"]], n_points)
+        if currency != fx.BASE_CURRENCY:
+            df = quote(df, fx.read_rates_local([currency]), currency)
+        return utc(df)
+
+    def stats(self):
+        return analytics.local_price_stats()
+
+    def _metrics(self, coins):
+        daily = localstore.read_history(coins, columns=["price_eur"]).sort_values(["coin_id", "ts"])
+        daily = daily.groupby(["coin_id", daily["ts"].dt.floor("D")], observed=True)["price_eur"].last()
+        return analytics.local_metrics(daily.reset_index())
+
+    def sharpe(self, coins):
+        return self._metrics(coins)[0]
+
+    def correlation(self, coins):
+        return self._metrics(coins)[1]
+
+
+SOURCES = {"postgres": PostgresSource, "local": LocalSource}
+
+# path → (handler(source, params) returning a DataFrame)
+ROUTES = {
+    "/coins": lambda src, p: src.coins(),
+    "/snapshot/latest": lambda src, p: src.latest_snapshot(),
+    "/history": lambda src, p: src.history(**history_params(p)),
+    "/stats": lambda src, p: src.stats(),
+    "/metrics/sharpe": lambda src, p: src.sharpe(coins_param(p)),
+    "/metrics/correlation": lambda src, p: src.correlation(coins_param(p)),
+}
+
+
+# --- Encoding ---
+def encode(df, fmt):
+    """DataFrame → response body. A named index (coin_id) becomes a column."""
+    if df.index.name is not None:
+        df = df.reset_index()
+    if fmt == "json":
+        return df.to_json(orient="records", date_format="iso", date_unit="ms").encode("utf-8")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = io.BytesIO()
+    if fmt == "arrow":
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink, compression="zstd")
+    return sink.getvalue()
+
+
+# --- Cache ---
+class VersionedCache:
+    """
+    LRU of query results and encoded bodies, all valid for one load version.
+    A new version empties it. get() runs `compute` once per key, however many
+    callers ask for it at the same time.
+    """
+
+    def __init__(self, max_entries=API_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.version = None
+        self.entries = collections.OrderedDict()
+        self.hits = self.misses = 0
+
+    def reset(self, version):
+        if version != self.version:
+            self.version = version
+            self.entries.clear()
+
+    async def get(self, key, compute):
+        fut = self.entries.get(key)
+        if fut is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return await asyncio.shield(fut)
+        self.misses += 1
+        fut = asyncio.ensure_future(compute())
+        self.entries[key] = fut
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        try:
+            return await asyncio.shield(fut)
+        except Exception:
+            # Don't cache failures
+            if self.entries.get(key) is fut:
+                del self.entries[key]
+            raise
+
+
+# --- HTTP ---
+class ReadApi:
+    def __init__(self, source, pool_size=API_POOL_SIZE, version_ttl=API_VERSION_TTL):
+        self.source = source
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="readapi")
+        self.version_ttl = version_ttl
+        self.cache = VersionedCache()
+        self.version_checked = 0.0
+        self.version_lock = asyncio.Lock()
+        self.stats = collections.Counter()
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def current_version(self):
+        """load_version, re-read at most every version_ttl seconds (one reader at a time)."""
+        async with self.version_lock:
+            if self.cache.version is None or time.monotonic() - self.version_checked >= self.version_ttl:
+                self.cache.reset(await self.run(self.source.version))
+                self.version_checked = time.monotonic()
+            return self.cache.version
+
+    async def respond(self, path, params, headers):
+        """(status, content type, body, extra headers) of one GET."""
+        if path == "/version":
+            version = await self.current_version()
+            return 200, FORMATS["json"], json.dumps({"version": version, "backend": self.source.name}).encode(), {}
+        if path == "/health":
+            body = {"backend": self.source.name, "version": self.cache.version,
+                    "cache_entries": len(self.cache.entries), "cache_hits": self.cache.hits,
+                    "cache_misses": self.cache.misses, **self.source.pool_stats(), **self.stats}
+            return 200, FORMATS["json"], json.dumps(body).encode(), {}
+        handler = ROUTES.get(path)
+        if handler is None:
+            return 404, FORMATS["json"], json.dumps({"error": f"unknown path {path}"}).encode(), {}
+
+        fmt = params.pop("format", "json")
+        if fmt not in FORMATS:
+            raise BadRequest(f"format must be one of {sorted(FORMATS)}")
+        version = await self.current_version()
+        # JSON bodies are gzipped for clients that accept it: the encoding is part of
+        # the representation, so it is part of the ETag too
+        gzip_ok = fmt == "json" and "gzip" in headers.get("accept-encoding", "")
+        etag = f'"{version}-{fmt}{"-gzip" if gzip_ok else ""}"'
+        extra = {"ETag": etag, "Cache-Control": "no-cache"}
+        if fmt == "json":
+            extra["Vary"] = "Accept-Encoding"
+        if etag in (t.strip() for t in headers.get("if-none-match", "").split(",")):
+            return 304, FORMATS[fmt], b"", extra
+
+        key = (path, tuple(sorted(params.items())))
+        frame = await self.cache.get(key, lambda: self.run(handler, self.source, params))
+        body = await self.cache.get(key + (fmt,), lambda: self.run(encode, frame, fmt))
+        if gzip_ok and len(body) >= GZIP_MIN_BYTES:
+            body = await self.cache.get(key + (fmt, "gzip"), lambda: self.run(gzip.compress, body, 6))
+            extra["Content-Encoding"] = "gzip"
+        return 200, FORMATS[fmt], body, extra
+
+    async def handle(self, reader, writer):
+        """One client connection: HTTP/1.1 requests, kept alive until the client closes it."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+
+                started = time.perf_counter()
+                url = urlsplit(target)
+                try:
+                    if method != "GET":
+                        status, ctype, body, extra = 405, FORMATS["json"], b'{"error": "GET only"}', {}
+                    else:
+                        status, ctype, body, extra = await self.respond(url.path.rstrip("/") or "/",
+                                                                        dict(parse_qsl(url.query)), headers)
+                except BadRequest as exc:
+                    status, ctype, body, extra = 400, FORMATS["json"], json.dumps({"error": str(exc)}).encode(), {}
+                except Exception as exc:
+                    print(f"{method} {target} failed: {exc!r}", file=sys.stderr, flush=True)
+                    status, ctype, body, extra = 500, FORMATS["json"], json.dumps({"error": repr(exc)}).encode(), {}
+                self.stats["requests"] += 1
+                self.stats[f"status_{status}"] += 1
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                out = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                       f"Content-Type: {ctype}", f"Content-Length: {len(body)}",
+                       f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                       f"Server-Timing: app;dur={(time.perf_counter() - started) * 1000:.1f}"]
+                out += [f"{k}: {v}" for k, v in extra.items()]
+                writer.write(("\r\n".join(out) + "\r\n\r\n").encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+
+async def serve(api, host, port):
+    server = await asyncio.start_server(api.handle, host, port, limit=MAX_HEADER_BYTES)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    addr = server.sockets[0].getsockname()
+    print(f"Read API ({api.source.name}) on http://{addr[0]}:{addr[1]}", flush=True)
+    async with server:
+        await stop.wait()
+    api.executor.shutdown(wait=False)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Read-only HTTP API over the loaded data")
+    ap.add_argument("--host", default=API_HOST)
+    ap.add_argument("--port", type=int, default=API_PORT)
+    ap.add_argument("--backend", choices=localstore.BACKENDS, default=localstore.DEFAULT_BACKEND,
+                    help="postgres (default) or the local Parquet store")
+    ap.add_argument("--pool-size", type=int, default=API_POOL_SIZE,
+                    help="database connections (and query threads); constant under load")
+    ap.add_argument("--version-ttl", type=float, default=API_VERSION_TTL,
+                    help="seconds between load_version checks")
+    args = ap.parse_args(argv)
+
+    source = SOURCES[args.backend](args.pool_size)
+    asyncio.run(serve(ReadApi(source, args.pool_size, args.version_ttl), args.host, args.port))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+#!/bin/bash
+# Script para arrancar la API de lectura (dashboard, notebook) usando el venv
+
+set -e
+
+PROJECT_DIR=$(dirname "$(dirname "$(realpath "$0")")")
+SRC_DIR="$PROJECT_DIR/src"
+VENV_PYTHON="$PROJECT_DIR/venv/bin/python"
+
+echo "=== Arrancando la API de lectura..."
+exec $VENV_PYTHON "$SRC_DIR/readapi.py" "$@"
@@ -11,7 +11,7 @@ echo "=== [1/3] Extrayendo datos..."
 $VENV_PYTHON "$SRC_DIR/extract.py"
 
 echo "=== [2/3] Transformando datos..."
-$VENV_PYTHON "$SRC_DIR/transform.py"
+$VENV_PYTHON "$SRC_DIR/transform.py" --backlog
 
 echo "=== [3/3] Cargando en la BBDD..."
 $VENV_PYTHON "$SRC_DIR/load.py"
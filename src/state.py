@@ -0,0 +1,95 @@
+"""
+state.py
+Small persistent pipeline state shared by the ETL scripts (data/state/).
+
+- watermarks.json: last loaded market_history timestamp per coin (epoch ms),
+  written by load.py and read by extract.py to request only the missing window.
+- stream_watermarks.json: the same for the ticks written by stream.py, kept
+  apart so streaming never moves the batch pipeline's window.
+- manifest.json: processed-state manifest. Maps every transformed snapshot to
+  the run (output files) it was consolidated into, and whether that run has
+  been loaded into the database.
+"""
+
+import json
+import os
+import pathlib
+import tempfile
+
+STATE_DIR = pathlib.Path(__file__).resolve().parents[1] / "data" / "state"
+WATERMARKS_FILE = STATE_DIR / "watermarks.json"
+STREAM_WATERMARKS_FILE = STATE_DIR / "stream_watermarks.json"
+
+# snapshot_id suffix of the rows written by stream.py
+STREAM_SUFFIX = "-live"
+MANIFEST_FILE = STATE_DIR / "manifest.json"
+
+
+def read_json(path, default=None):
+    """Read a JSON state file, returning `default` when it doesn't exist."""
+    path = pathlib.Path(path)
+    if not path.exists():
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json(path, obj):
+    """Atomically replace a JSON state file (write to temp file + rename)."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def read_watermarks(path=None):
+    """Return {coin_id: last_loaded_ts_ms} (from watermarks.json unless `path` is given)."""
+    return {k: int(v) for k, v in read_json(path or WATERMARKS_FILE, {}).items()}
+
+
+def write_watermarks(watermarks, path=None):
+    """Merge `watermarks` into the state file, never moving a coin backwards."""
+    path = path or WATERMARKS_FILE
+    current = read_watermarks(path)
+    for coin_id, ts_ms in watermarks.items():
+        if ts_ms is not None:
+            current[coin_id] = max(int(ts_ms), current.get(coin_id, 0))
+    write_json(path, current)
+    return current
+
+
+def read_manifest():
+    """Return {"snapshots": {snapshot_id: run_id}, "runs": {run_id: {...}}}."""
+    manifest = read_json(MANIFEST_FILE, {})
+    manifest.setdefault("snapshots", {})
+    manifest.setdefault("runs", {})
+    return manifest
+
+
+def record_transformed(run_id, snapshot_ids, files):
+    """Register the outputs of a transform run covering `snapshot_ids`."""
+    manifest = read_manifest()
+    manifest["runs"][run_id] = {"snapshots": list(snapshot_ids), "files": files, "loaded": False}
+    for sid in snapshot_ids:
+        manifest["snapshots"][sid] = run_id
+    write_json(MANIFEST_FILE, manifest)
+
+
+def pending_runs():
+    """Transformed runs not loaded yet, oldest first: [(run_id, info), ...]."""
+    runs = read_manifest()["runs"]
+    return [(run_id, runs[run_id]) for run_id in sorted(runs) if not runs[run_id]["loaded"]]
+
+
+def mark_loaded(run_ids):
+    manifest = read_manifest()
+    for run_id in run_ids:
+        manifest["runs"][run_id]["loaded"] = True
+    write_json(MANIFEST_FILE, manifest)
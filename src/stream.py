@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+stream.py
+Long-running streaming ingestion, alongside the batch extract → transform →
+load pipeline.
+
+Three threads connected by bounded queues:
+
+    poller ──(markets)──▶ transformer ──(frames)──▶ writer ──▶ PostgreSQL
+
+- poller: fetches the top-N coins/markets every --interval seconds (or takes
+  them from FakeProducer with --fake).
+- transformer: turns each poll into market_snapshots / coins / market_history
+  rows in memory, keeping only coins whose last_updated moved.
+- writer: buffers rows and flushes them in one transaction (COPY + merge, as
+  load.py does) once STREAM_BATCH_ROWS rows are pending or the oldest has
+  waited STREAM_FLUSH_SECONDS, and reports the API → committed latency.
+
+Streamed ticks never advance the batch watermarks (load_watermarks,
+data/state/watermarks.json): the batch pipeline still owns the hourly history
+before them. Their snapshot_id ends in STREAM_SUFFIX so load.py can tell them
+apart, and the daemon's own progress is kept in
+data/state/stream_watermarks.json.
+
+Backpressure: when the writer falls behind (slow or unavailable database),
+the queues fill up and the poller blocks instead of buffering without bound.
+SIGINT/SIGTERM stop polling, drain the queues and flush what is pending.
+
+Usage:
+    python src/stream.py --top-n 100 --interval 30
+    python src/stream.py --fake --interval 1 --sink null --duration 30
+"""
+
+import argparse
+import queue
+import signal
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import config
+from frames import compact_history, concat_history, constant_key
+from state import STREAM_SUFFIX, STREAM_WATERMARKS_FILE, read_watermarks, write_watermarks
+from transform import snapshot_frames
+
+STREAM_INTERVAL = config.STREAM_INTERVAL
+STREAM_BATCH_ROWS = config.STREAM_BATCH_ROWS
+STREAM_FLUSH_SECONDS = config.STREAM_FLUSH_SECONDS
+STREAM_QUEUE_SIZE = config.STREAM_QUEUE_SIZE
+
+# Cap on the wait between retries of a failed flush
+MAX_RETRY_WAIT = 60
+STOP = object()  # end-of-stream marker passed down the queues
+
+
+# --- Producers ---
+class ApiProducer:
+    """Top-N coins/markets from the CoinGecko API (extract.py's rate-limited client)."""
+
+    def __init__(self, top_n):
+        import extract
+        self.fetch = extract.fetch_top_markets
+        self.top_n = top_n
+
+    def __call__(self):
+        return self.fetch(self.top_n, vs_currency="eur")
+
+
+class FakeProducer:
+    """Random-walk coins/markets rows, for tests and load experiments without the API."""
+
+    def __init__(self, top_n, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.prices = 50000.0 / np.arange(1, top_n + 1)
+
+    def __call__(self):
+        self.prices *= np.exp(self.rng.normal(0, 0.001, self.prices.size))
+        now = pd.Timestamp.now(tz="UTC").strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        return [
+            {
+                "id": f"coin-{i:05d}", "symbol": f"c{i}", "name": f"Coin {i}",
+                "current_price": float(p), "market_cap": float(p) * 1e6,
+                "total_volume": float(p) * 1e4, "market_cap_rank": i + 1,
+                "last_updated": now,
+            }
+            for i, p in enumerate(self.prices)
+        ]
+
+
+# --- Sinks ---
+def postgres_sink():
+    """Write function committing one flush to PostgreSQL, the way load.py loads a run."""
+    import coindim
+    from db import get_engine
+    from load import bulk_load, bump_load_version, ensure_partitions, load_coins, refresh_rollups
+    from migrate import upgrade
+
+    engine = get_engine()
+
+    with engine.begin() as conn:
+        upgrade(conn)
+
+    def write(coins, snaps, hist):
+        coindim.update(coins, coindim.snapshot_time(snaps["snapshot_id"].max()))
+        with engine.begin() as conn:
+            load_coins(conn, df=coins)
+            bulk_load(conn, [snaps], "market_snapshots")
+            staged, written = bulk_load(conn, [hist], "market_history", before_merge=ensure_partitions)
+            if staged:
+                refresh_rollups(conn, "stage_market_history")
+            bump_load_version(conn)
+        # Only the stream's own watermarks: extract.py must still fetch the hourly
+        # points up to these ticks
+        latest = hist.groupby("coin_id", observed=True)["ts"].max()
+        write_watermarks({c: ts.value // 10**6 for c, ts in latest.items()}, STREAM_WATERMARKS_FILE)
+        return written
+
+    return write
+
+
+def null_sink(coins, snaps, hist):
+    """Discard the rows (measures the pipeline without a database)."""
+    return len(hist)
+
+
+SINKS = {"postgres": postgres_sink, "null": lambda: null_sink}
+
+
+# --- Stages ---
+def transform_markets(markets, snapshot_id, last_ts):
+    """
+    One poll → (df_coins, df_snap, df_hist) for the coins whose last_updated
+    is newer than `last_ts` (updated in place), or None when nothing moved.
+    """
+    df = pd.DataFrame(markets)
+    if df.empty:
+        return None
+    df_snap, df_coins = snapshot_frames(df, snapshot_id)
+    ts = pd.to_datetime(df_snap["last_updated"], utc=True).dt.tz_convert(None)
+    prev = pd.to_datetime(df_snap["coin_id"].map(last_ts))
+    fresh = (prev.isna() | (ts > prev)).to_numpy()
+    if not fresh.any():
+        return None
+
+    df_snap, df_coins, ts = df_snap[fresh], df_coins[fresh], ts[fresh]
+    df_hist = compact_history(pd.DataFrame({
+        "coin_id": df_snap["coin_id"].to_numpy(),
+        "ts": ts.to_numpy(),
+        "price_eur": df_snap["price_eur"].to_numpy(),
+        "market_cap": df_snap["market_cap"].to_numpy(),
+        "volume_24h": df_snap["volume_24h"].to_numpy(),
+        "snapshot_id": constant_key(snapshot_id, len(df_snap)),
+    }))
+    last_ts.update(zip(df_hist["coin_id"], df_hist["ts"]))
+    return df_coins, df_snap, df_hist
+
+
+def put(q, item, stop):
+    """Blocking put that gives up when `stop` is set (the backpressure point)."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def poll_loop(producer, out_q, stop, interval, stats):
+    while not stop.is_set():
+        t0 = time.monotonic()
+        try:
+            markets = producer()
+        except Exception as e:
+            print(f"[poll] error: {e}", flush=True)
+            stop.wait(interval)
+            continue
+        stats["polls"] += 1
+        blocked = time.monotonic()
+        if not put(out_q, (time.time(), markets), stop):
+            break
+        stats["blocked_s"] += time.monotonic() - blocked
+        stop.wait(max(0.0, interval - (time.monotonic() - t0)))
+    out_q.put(STOP)
+
+
+def transform_loop(in_q, out_q, last_ts):
+    while True:
+        item = in_q.get()
+        if item is STOP:
+            out_q.put(STOP)
+            return
+        received, markets = item
+        sid = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(received)) + STREAM_SUFFIX
+        frames = transform_markets(markets, sid, last_ts)
+        if frames is not None:
+            out_q.put((received, *frames))
+
+
+class BatchWriter:
+    """Buffers transformed polls and flushes them on size or age."""
+
+    def __init__(self, sink, max_rows=STREAM_BATCH_ROWS, max_age=STREAM_FLUSH_SECONDS):
+        self.sink = sink
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.items = []
+        self.rows = 0
+        self.since = None
+        self.latencies = []
+        self.written = 0
+
+    def add(self, item):
+        if not self.items:
+            self.since = time.monotonic()
+        self.items.append(item)
+        self.rows += len(item[3])
+
+    def time_left(self):
+        if not self.items:
+            return self.max_age
+        return max(0.0, self.max_age - (time.monotonic() - self.since))
+
+    def due(self):
+        return self.rows >= self.max_rows or (self.items and self.time_left() == 0)
+
+    def flush(self):
+        if not self.items:
+            return
+        received = [it[0] for it in self.items]
+        coins, snaps = (pd.concat([it[k] for it in self.items], ignore_index=True) for k in (1, 2))
+        hist = concat_history([it[3] for it in self.items])
+        coins = coins.drop_duplicates("coin_id", keep="last")
+        t0 = time.monotonic()
+        written = self.sink(coins, snaps, hist)
+        committed = time.time()
+        self.latencies.extend(committed - r for r in received)
+        self.written += written
+        print(f"[write] {len(hist)} rows from {len(received)} polls in {time.monotonic() - t0:.2f}s, "
+              f"latency {committed - max(received):.2f}-{committed - min(received):.2f}s", flush=True)
+        self.clear()
+
+    def clear(self):
+        self.items, self.rows = [], 0
+
+
+def write_loop(in_q, writer, stop):
+    retry, done = 0, False
+    while True:
+        # While a flush is failing nothing more is read: the queues fill up
+        # and the poller blocks, so pending rows stay bounded
+        if not done and not retry:
+            try:
+                item = in_q.get(timeout=max(writer.time_left(), 0.05))
+            except queue.Empty:
+                item = None
+            if item is STOP:
+                done = True
+            elif item is not None:
+                writer.add(item)
+        if not (done or writer.due()):
+            continue
+        try:
+            writer.flush()
+            retry = 0
+        except Exception as e:
+            retry += 1
+            print(f"[write] flush failed ({e}); {writer.rows} rows kept for retry {retry}", flush=True)
+            if stop.is_set() and retry >= 3:
+                # Shutting down: drop the rows but keep draining so upstream threads can exit
+                print(f"[write] dropping {writer.rows} rows at shutdown", flush=True)
+                writer.clear()
+            else:
+                time.sleep(1 if stop.is_set() else min(2 ** retry, MAX_RETRY_WAIT))
+                continue
+        if done:
+            return
+
+
+def run(producer, sink, interval=STREAM_INTERVAL, max_rows=STREAM_BATCH_ROWS,
+        max_age=STREAM_FLUSH_SECONDS, queue_size=STREAM_QUEUE_SIZE, stop=None, duration=None):
+    """Run the pipeline until `stop` is set (or `duration` seconds pass). Returns stats."""
+    stop = stop or threading.Event()
+    raw_q = queue.Queue(maxsize=queue_size)
+    rows_q = queue.Queue(maxsize=queue_size)
+    last_ts = {c: pd.Timestamp(ms, unit="ms") for c, ms in read_watermarks(STREAM_WATERMARKS_FILE).items()}
+    writer = BatchWriter(sink, max_rows, max_age)
+    stats = {"polls": 0, "blocked_s": 0.0}
+
+    threads = [
+        threading.Thread(target=poll_loop, args=(producer, raw_q, stop, interval, stats), name="poll"),
+        threading.Thread(target=transform_loop, args=(raw_q, rows_q, last_ts), name="transform"),
+        threading.Thread(target=write_loop, args=(rows_q, writer, stop), name="write"),
+    ]
+    for t in threads:
+        t.start()
+    try:
+        stop.wait(duration)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    lat = np.array(writer.latencies)
+    stats.update(rows=writer.written)
+    if lat.size:
+        stats.update(latency_p50_s=float(np.percentile(lat, 50)), latency_max_s=float(lat.max()))
+    return stats
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Streaming ingestion daemon")
+    ap.add_argument("--top-n", type=int, default=config.UNIVERSE_SIZE)
+    ap.add_argument("--interval", type=float, default=STREAM_INTERVAL, help="seconds between polls")
+    ap.add_argument("--batch-rows", type=int, default=STREAM_BATCH_ROWS, help="flush at this many rows")
+    ap.add_argument("--flush-seconds", type=float, default=STREAM_FLUSH_SECONDS,
+                    help="flush when the oldest pending row is this old")
+    ap.add_argument("--fake", action="store_true", help="synthetic producer instead of the API")
+    ap.add_argument("--sink", choices=sorted(SINKS), default="postgres")
+    ap.add_argument("--duration", type=float, help="stop after this many seconds (default: run until signalled)")
+    args = ap.parse_args(argv)
+
+    producer = FakeProducer(args.top_n) if args.fake else ApiProducer(args.top_n)
+    sink = SINKS[args.sink]()
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    print(f"Streaming top {args.top_n} every {args.interval}s → {args.sink} "
+          f"(flush at {args.batch_rows} rows / {args.flush_seconds}s)", flush=True)
+    stats = run(producer, sink, args.interval, args.batch_rows, args.flush_seconds,
+                stop=stop, duration=args.duration)
+    print(f"Stopped after {stats['polls']} polls ({stats['blocked_s']:.1f}s blocked by backpressure), "
+          f"{stats['rows']} rows written"
+          + (f", latency p50 {stats['latency_p50_s']:.2f}s max {stats['latency_max_s']:.2f}s"
+             if "latency_p50_s" in stats else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
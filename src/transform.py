@@ -1,23 +1,57 @@
 #!/usr/bin/env python3
 """
 transform.py
-Transforms extracted JSON files into clean tabular datasets.
+Transforms extracted raw files (.json or .ndjson.gz) into clean tabular datasets.
 
-Reads the latest snapshot metadata (snapshot_*.json) and generates:
-- coins.csv / coins.parquet (accumulated metadata)
-- market_snapshots_<snapshot_id>.csv / .parquet
-- market_history_<snapshot_id>.csv / .parquet
+Reads snapshot metadata (snapshot_*.json) and generates:
+- coins.parquet: the coin dimension (coindim.py), one row per coin with its
+  integer coin_key; only new or changed coins are rewritten
+- market_snapshots/month=YYYY-MM/part-<run_id>.parquet
+- fx_rates/month=YYYY-MM/part-<run_id>.parquet: FX reference rates of
+  multi-currency extractions (fx.py)
+- market_history/month=YYYY-MM/part-<run_id>.parquet (frames.HISTORY_SCHEMA:
+  dictionary-encoded coin_id/snapshot_id, see frames.py)
+- coins.csv / market_snapshots_<run_id>.csv / market_history_<run_id>.csv (only with --csv)
+
+By default only the newest run (all of its shards) is transformed, unless
+the processed manifest (data/state/manifest.json) already records it. With
+--backlog every snapshot not yet recorded there is transformed in parallel
+and consolidated into a single run named after the newest and oldest
+snapshots of the batch (see run_name()).
 """
 
+import argparse
+import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pathlib
 import json
+from concurrent.futures import ProcessPoolExecutor
+
+import coindim
+import config
+import fx
+from coindim import snapshot_time
+from dataset import FX_DIR, HISTORY_DIR, SNAPSHOTS_DIR, PartitionedWriter
+from frames import (FLOAT_DTYPES, HISTORY_COLUMNS, HISTORY_SCHEMA, RATES_SCHEMA, concat_history, constant_key,
+                    empty_history)
+from rawio import coin_from_filename, read_chart, read_markets
+from state import read_manifest, record_transformed
 
 # Paths
 BASE_DIR = pathlib.Path(__file__).resolve().parents[1]
 RAW_DIR = BASE_DIR / "data" / "raw"
 PROCESSED_DIR = BASE_DIR / "data" / "processed"
 PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+STAGING_DIR = PROCESSED_DIR / ".staging"
+
+# History rows buffered in memory before being flushed to disk
+HISTORY_BATCH_ROWS = 500_000
+
+# Legacy CSV copies of each run's outputs are opt-in (--csv or WRITE_CSV=1)
+WRITE_CSV = config.WRITE_CSV
 
 def latest_snapshot():
     """Get the most recent snapshot metadata file."""
@@ -26,22 +60,39 @@ def latest_snapshot():
         raise FileNotFoundError("No snapshot metadata found in data/raw/")
     return snapshots[-1]
 
-def transform(snapshot_file):
-    # Load snapshot metadata
-    with open(snapshot_file, "r", encoding="utf-8") as f:
-        meta = json.load(f)
+def latest_snapshots():
+    """All shard metadata files of the most recent run (a single file when unsharded)."""
+    run_id = json.loads(latest_snapshot().read_text(encoding="utf-8"))["snapshot_id"].split("-s")[0]
+    return sorted(RAW_DIR.glob(f"snapshot_{run_id}*.json"))
 
-    snapshot_id = meta["snapshot_id"]
-    top5 = set(meta["coins"])
-
-    # --- Market snapshots & coins ---
-    markets_file = [f for f in meta["files"] if "coins_markets" in f][0]
-    markets = pd.read_json(RAW_DIR / markets_file)
+def pending_snapshots(snapshot_files=None):
+    """
+    Snapshot metadata files (default: all of data/raw/) not yet recorded in
+    the processed manifest.
+    """
+    done = read_manifest()["snapshots"]
+    if snapshot_files is None:
+        snapshot_files = RAW_DIR.glob("snapshot_*.json")
+    return [
+        fp for fp in sorted(snapshot_files)
+        if fp.stem[len("snapshot_"):] not in done
+    ]
 
-    # Keep only top 5 coins
-    markets = markets[markets["id"].isin(top5)]
+def run_name(snapshot_ids):
+    """
+    run_id of the outputs of `snapshot_ids` (sorted): the snapshot itself,
+    the newest shard for the shards of one extraction, or
+    <newest>_from_<oldest> for a batch spanning several extractions, so a
+    batch never reuses (and overwrites) the run of a single snapshot.
+    Runs still sort by their newest snapshot.
+    """
+    newest, oldest = snapshot_ids[-1], snapshot_ids[0]
+    if newest.split("-s")[0] == oldest.split("-s")[0]:
+        return newest
+    return f"{newest}_from_{oldest}"
 
-    # Build market_snapshots dataframe
+def snapshot_frames(markets, snapshot_id):
+    """coins/markets rows (DataFrame) → (df_snap, df_coins) for market_snapshots and coins."""
     df_snap = markets.rename(
         columns={
             "id": "coin_id",
@@ -53,56 +104,258 @@ def transform(snapshot_file):
         }
     )[["coin_id", "price_eur", "market_cap", "volume_24h", "rank", "last_updated"]]
     df_snap.insert(0, "snapshot_id", snapshot_id)
+    df_snap["rank"] = df_snap["rank"].astype("Int64")  # stable Parquet schema across runs
 
-    # Save market_snapshots CSV + Parquet
-    snap_csv = PROCESSED_DIR / f"market_snapshots_{snapshot_id}.csv"
-    snap_pq = PROCESSED_DIR / f"market_snapshots_{snapshot_id}.parquet"
-    df_snap.to_csv(snap_csv, index=False)
-    df_snap.to_parquet(snap_pq, index=False)
-    print(f"Saved {len(df_snap)} market_snapshots → {snap_csv.name}, {snap_pq.name}")
-
-    # Build/update coins dataframe
     df_coins = markets[["id", "symbol", "name"]].rename(columns={"id": "coin_id"})
-    coins_csv = PROCESSED_DIR / "coins.csv"
-    coins_pq = PROCESSED_DIR / "coins.parquet"
+    return df_snap, df_coins
 
-    if coins_csv.exists():
-        existing = pd.read_csv(coins_csv)
-        df_coins = pd.concat([existing, df_coins]).drop_duplicates("coin_id", keep="last")
+def build_snapshot(snapshot_file):
+    """
+    Transform one snapshot without touching the shared outputs.
+    Returns (snapshot_id, df_snap, df_coins, staged_history_path, df_fx); the
+    history is streamed to a staging Parquet file so workers stay memory-bounded.
+    """
+    # Load snapshot metadata
+    with open(snapshot_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    snapshot_id = meta["snapshot_id"]
+    universe = set(meta["coins"])
+
+    # --- Market snapshots & coins ---
+    markets_file = [f for f in meta["files"] if "coins_markets" in f][0]
+    markets = read_markets(RAW_DIR / markets_file)
+
+    # Keep only the coins of this snapshot's universe
+    markets = markets[markets["id"].isin(universe)]
 
-    df_coins.to_csv(coins_csv, index=False)
-    df_coins.to_parquet(coins_pq, index=False)
-    print(f"Saved {len(df_coins)} coins → {coins_csv.name}, {coins_pq.name}")
+    df_snap, df_coins = snapshot_frames(markets, snapshot_id)
 
     # --- Market history ---
-    dfs = []
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    staged = STAGING_DIR / f"market_history_{snapshot_id}.parquet"
+    write_staged(iter_history(meta), staged)
+
+    return snapshot_id, df_snap, df_coins, staged, fx.snapshot_rates(meta, RAW_DIR)
+
+def transform(snapshot_file, csv=WRITE_CSV):
+    """Transform a single snapshot into its own run."""
+    return transform_many([snapshot_file], workers=1, csv=csv)
+
+def transform_many(snapshot_files, workers=None, csv=WRITE_CSV):
+    """
+    Transform several snapshots (in parallel when workers > 1) and write
+    consolidated outputs as one run (run_name()). History is merged in
+    chronological order, dropping (coin_id, ts) points already emitted by an
+    earlier snapshot of the batch.
+    """
+    snapshot_files = sorted(snapshot_files)
+    if not snapshot_files:
+        print("No pending snapshots.")
+        return None
+
+    workers = workers or min(len(snapshot_files), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(build_snapshot, snapshot_files))
+    else:
+        results = [build_snapshot(fp) for fp in snapshot_files]
+
+    # --- Market history: staged files merged in chronological order ---
+    staged = [r[3] for r in results]
+    run_id = write_run([r[0] for r in results], [r[1] for r in results], [r[2] for r in results],
+                       dedup_history(iter_staged(staged)), csv, fx_frames=[r[4] for r in results])
+    for fp in staged:
+        fp.unlink(missing_ok=True)
+    return run_id
+
+def write_run(snapshot_ids, snap_frames, coin_frames, history_frames, csv=WRITE_CSV, fx_frames=()):
+    """
+    Write the processed outputs of one run (run_name() of `snapshot_ids`):
+    snapshot, history and FX rate partitions, the accumulated coins table and
+    the manifest entry. Returns the run_id.
+    """
+    run_id = run_name(snapshot_ids)
+
+    # --- Market snapshots ---
+    df_snap = pd.concat(snap_frames, ignore_index=True)
+    with PartitionedWriter(SNAPSHOTS_DIR, run_id, sort_by=("snapshot_id", "coin_id")) as snap_writer:
+        for sid, part in df_snap.groupby("snapshot_id", sort=True):
+            snap_writer.write(part, month=f"{sid[:4]}-{sid[4:6]}")
+    snap_files = snap_writer.files()
+    if csv:
+        df_snap.to_csv(PROCESSED_DIR / f"market_snapshots_{run_id}.csv", index=False)
+    print(f"Saved {len(df_snap)} market_snapshots ({len(snapshot_ids)} snapshots) → {', '.join(snap_files)}")
+
+    # --- Coins: folded into the coin dimension (latest snapshot wins) ---
+    df_coins = pd.concat(
+        [df.assign(seen=snapshot_time(sid)) for sid, df in zip(snapshot_ids, coin_frames)], ignore_index=True)
+    changed = coindim.update(df_coins, df_coins["seen"])
+    if csv:
+        coindim.read().to_csv(PROCESSED_DIR / "coins.csv", index=False)
+    print(f"Coin dimension: {len(changed)} new/changed of {len(df_coins)} coins → {coindim.DIM_FILE.name}")
+
+    # --- Market history (consolidated, partitioned by month) ---
+    hist_csv = PROCESSED_DIR / f"market_history_{run_id}.csv" if csv else None
+    hist_files = write_history(history_frames, run_id, hist_csv)
+
+    # --- FX reference rates (multi-currency extractions only; later snapshots win) ---
+    fx_files = []
+    df_fx = pd.concat([df for df in fx_frames if len(df)] or [fx.empty_rates()], ignore_index=True)
+    if len(df_fx):
+        df_fx = df_fx.drop_duplicates(["currency", "ts"], keep="last")
+        with PartitionedWriter(FX_DIR, run_id, sort_by=("currency", "ts"), schema=RATES_SCHEMA) as fx_writer:
+            fx_writer.write(df_fx)
+        fx_files = fx_writer.files()
+        print(f"Saved {len(df_fx)} fx_rates ({', '.join(sorted(df_fx['currency'].unique()))}) → {', '.join(fx_files)}")
+
+    record_transformed(run_id, snapshot_ids, {
+        "market_snapshots": snap_files,
+        "market_history": hist_files,
+        "fx_rates": fx_files,
+    })
+    return run_id
+
+# market_chart array → market_history column
+CHART_SERIES = {"prices": "price_eur", "market_caps": "market_cap", "total_volumes": "volume_24h"}
+
+def chart_arrays(points):
+    """[[ts_ms, value], ...] → (int64 ts_ms, float64 values) NumPy arrays."""
+    arr = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return arr[:, 0].astype(np.int64), arr[:, 1]
+
+def parse_market_chart(chart):
+    """
+    Vectorized parser for a market_chart payload.
+    Converts each series straight into NumPy arrays and timestamps in a single
+    call. When the series don't share the same timestamps (different lengths
+    or misaligned points) they are outer-merged on ts.
+    """
+    series = {col: chart_arrays(chart.get(key, [])) for key, col in CHART_SERIES.items()}
+    ts_ms = series["price_eur"][0]
+
+    if all(len(t) == len(ts_ms) and np.array_equal(t, ts_ms) for t, _ in series.values()):
+        df = pd.DataFrame({
+            col: values.astype(FLOAT_DTYPES[col], copy=False) for col, (_, values) in series.items()
+        })
+        df.insert(0, "ts", ts_ms)
+    else:
+        df = None
+        for col, (t, values) in series.items():
+            part = pd.DataFrame({"ts": t, col: values}).drop_duplicates("ts", keep="last")
+            df = part if df is None else df.merge(part, on="ts", how="outer")
+        df = df.sort_values("ts", ignore_index=True).astype(FLOAT_DTYPES)
+
+    df["ts"] = pd.to_datetime(df["ts"].to_numpy(), unit="ms")  # naive UTC
+    return df
+
+def history_frame(coin_id, chart, snapshot_id, since=None):
+    """
+    market_chart response → market_history rows, keeping only points after
+    `since` (ms). coin_id/snapshot_id are single-category categoricals.
+    """
+    df_hist = parse_market_chart(chart)
+
+    # Incremental extraction: keep only points after the loaded watermark
+    if since is not None:
+        df_hist = df_hist[df_hist["ts"] > pd.to_datetime(since, unit="ms")].reset_index(drop=True)
+    df_hist.insert(0, "coin_id", constant_key(coin_id, len(df_hist)))
+    df_hist["snapshot_id"] = constant_key(snapshot_id, len(df_hist))
+    return df_hist
+
+def iter_history(meta):
+    """Yield one market_history frame per market_chart file of the snapshot."""
+    snapshot_id = meta["snapshot_id"]
+    since = meta.get("since", {})
     for fname in meta["files"]:
         if "market_chart" in fname:
-            coin_id = fname.split("_market_chart.json")[0].split("_")[-1]
-            df_raw = pd.read_json(RAW_DIR / fname)
-
-            df_hist = pd.DataFrame({
-                "ts": [pd.to_datetime(x[0], unit="ms", utc=True).tz_convert(None) for x in df_raw["prices"]],
-                "price_eur": [x[1] for x in df_raw["prices"]],
-                "market_cap": [x[1] for x in df_raw["market_caps"]],
-                "volume_24h": [x[1] for x in df_raw["total_volumes"]],
-            })
-            df_hist.insert(0, "coin_id", coin_id)
-            df_hist["snapshot_id"] = snapshot_id
-            dfs.append(df_hist)
-
-    df_history = pd.concat(dfs, ignore_index=True)
-
-    hist_csv = PROCESSED_DIR / f"market_history_{snapshot_id}.csv"
-    hist_pq = PROCESSED_DIR / f"market_history_{snapshot_id}.parquet"
-
-    df_history.to_csv(hist_csv, index=False)
-    df_history.to_parquet(hist_pq, index=False)
-    print(f"Saved {len(df_history)} market_history → {hist_csv.name}, {hist_pq.name}")
-
-def main():
-    snapshot_file = latest_snapshot()
-    transform(snapshot_file)
+            coin_id = coin_from_filename(fname)
+            yield history_frame(coin_id, read_chart(RAW_DIR / fname), snapshot_id, since.get(coin_id))
+
+def iter_staged(paths, batch_rows=HISTORY_BATCH_ROWS):
+    """Stream staged history files back as DataFrames, in the given order."""
+    for fp in paths:
+        for batch in pq.ParquetFile(fp).iter_batches(batch_size=batch_rows):
+            yield batch.to_pandas()
+
+def dedup_history(frames):
+    """
+    Drop points at or before the last ts already emitted for each coin, so
+    overlapping windows of consecutive snapshots are written only once.
+    """
+    emitted = pd.Series(dtype="datetime64[ns]")
+    for df in frames:
+        last = df["coin_id"].map(emitted)
+        df = df[last.isna() | (df["ts"] > last)]
+        if df.empty:
+            continue
+        latest = df.groupby("coin_id", observed=True)["ts"].max()
+        latest.index = latest.index.astype(object)
+        emitted = pd.concat([emitted, latest]).groupby(level=0).max()
+        yield df
+
+def write_staged(frames, path):
+    """Stream one worker's history frames to a single staging Parquet file."""
+    writer = None
+    try:
+        for df in frames:
+            table = pa.Table.from_pandas(df[HISTORY_COLUMNS], preserve_index=False, schema=HISTORY_SCHEMA)
+            if writer is None:
+                writer = pq.ParquetWriter(path, HISTORY_SCHEMA)
+            writer.write_table(table)
+        if writer is None:
+            pq.write_table(pa.Table.from_pandas(empty_history(), preserve_index=False, schema=HISTORY_SCHEMA), path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def write_history(frames, run_id, hist_csv=None, batch_rows=HISTORY_BATCH_ROWS):
+    """
+    Stream history frames into the partitioned market_history dataset (and
+    optionally a CSV copy). Frames are buffered up to `batch_rows` rows, so
+    memory stays bounded regardless of the universe size.
+    Returns the part files written, relative to data/processed.
+    """
+    buffer, buffered, total = [], 0, 0
+
+    with PartitionedWriter(HISTORY_DIR, run_id, schema=HISTORY_SCHEMA) as writer:
+        def flush():
+            nonlocal buffer, buffered, total
+            df = concat_history(buffer)[HISTORY_COLUMNS]
+            writer.write(df)
+            if hist_csv is not None:
+                df.to_csv(hist_csv, mode="a" if total else "w", header=not total, index=False)
+            total += len(df)
+            buffer, buffered = [], 0
+
+        for df in frames:
+            buffer.append(df)
+            buffered += len(df)
+            if buffered >= batch_rows:
+                flush()
+        if buffer:
+            flush()
+
+    files = writer.files()
+    names = ", ".join(files + ([hist_csv.name] if hist_csv is not None else []))
+    print(f"Saved {total} market_history → {names or '(no new rows)'}")
+    return files
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Transform raw snapshots into processed datasets")
+    ap.add_argument("--backlog", action="store_true",
+                    help="transform every snapshot not yet in the processed manifest")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="worker processes for --backlog (default: CPU count)")
+    ap.add_argument("--csv", action="store_true", default=WRITE_CSV,
+                    help="also write CSV copies of the run's snapshots/history (env WRITE_CSV=1)")
+    args = ap.parse_args(argv)
+
+    if args.backlog:
+        transform_many(pending_snapshots(), workers=args.workers, csv=args.csv)
+    else:
+        # Snapshots already transformed (e.g. by a previous --backlog) are not redone
+        transform_many(pending_snapshots(latest_snapshots()), workers=1, csv=args.csv)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,134 @@
+"""
+Shared fixtures. Tests import the src/ modules the way the scripts import
+each other, and never touch the real data/ directory: `data_dir` points
+every data/ path held by an imported src/ module at a temporary directory.
+
+Tests of the SQL itself use `pg_schema`/`pg`: a throwaway schema on the
+PostgreSQL database of BENCH_DATABASE_URL (as benchmarks/bench_load.py),
+skipped when it is not set.
+"""
+
+import json
+import os
+import pathlib
+import sys
+import threading
+import uuid
+
+import pytest
+
+BASE_DIR = pathlib.Path(__file__).resolve().parents[1]
+SRC_DIR = BASE_DIR / "src"
+DATA_DIR = BASE_DIR / "data"
+
+sys.path.insert(0, str(SRC_DIR))
+sys.path.insert(0, str(BASE_DIR / "benchmarks"))  # stub_api
+sys.path.insert(0, str(BASE_DIR / "analysis"))  # summary
+sys.path.insert(0, str(BASE_DIR / "backup"))  # backup
+
+HOUR_MS = 3_600_000
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Temporary data/ directory for every src/ module imported so far."""
+    root = tmp_path / "data"
+    for module in list(sys.modules.values()):
+        if not str(getattr(module, "__file__", None) or "").startswith(str(SRC_DIR)):
+            continue
+        for name, value in list(vars(module).items()):
+            if isinstance(value, pathlib.Path) and (value == DATA_DIR or DATA_DIR in value.parents):
+                monkeypatch.setattr(module, name, root / value.relative_to(DATA_DIR))
+    if "coindim" in sys.modules:
+        monkeypatch.setattr(sys.modules["coindim"], "_cache", {"stamp": None, "dim": None, "keys": None})
+    (root / "raw").mkdir(parents=True)
+    return root
+
+
+@pytest.fixture
+def raw_snapshot(data_dir):
+    """
+    Write an extracted snapshot to the temporary data/raw/:
+    raw_snapshot(snapshot_id, {coin_id: [price, ...]}, start_ms) with hourly
+    points from start_ms. Returns the metadata file.
+    """
+    raw = data_dir / "raw"
+
+    def write(snapshot_id, prices, start_ms=0, since=None):
+        markets = [
+            {"id": coin_id, "symbol": coin_id[:3], "name": coin_id.title(), "current_price": values[-1],
+             "market_cap": values[-1] * 1000, "total_volume": values[-1] * 10, "market_cap_rank": rank,
+             "last_updated": "2025-01-01T00:00:00.000Z"}
+            for rank, (coin_id, values) in enumerate(prices.items(), 1)
+        ]
+        files = [f"{snapshot_id}_000000Z_coins_markets.json"]
+        (raw / files[0]).write_text(json.dumps(markets), encoding="utf-8")
+        for coin_id, values in prices.items():
+            ts = [start_ms + i * HOUR_MS for i in range(len(values))]
+            chart = {"prices": [[t, v] for t, v in zip(ts, values)],
+                     "market_caps": [[t, v * 1000] for t, v in zip(ts, values)],
+                     "total_volumes": [[t, v * 10] for t, v in zip(ts, values)]}
+            fname = f"{snapshot_id}_000000Z_{coin_id}_market_chart.json"
+            (raw / fname).write_text(json.dumps(chart), encoding="utf-8")
+            files.append(fname)
+        meta = {"snapshot_id": snapshot_id, "coins": list(prices), "files": files, "since": since or {}}
+        path = raw / f"snapshot_{snapshot_id}.json"
+        path.write_text(json.dumps(meta), encoding="utf-8")
+        return path
+
+    return write
+
+
+@pytest.fixture
+def stub():
+    """Start a stub CoinGecko API: stub(script=[...], retry_after=...) → (server, base_url)."""
+    from stub_api import make_server
+
+    servers = []
+
+    def start(**kwargs):
+        srv = make_server(**{"n_coins": 10, **kwargs})
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        servers.append(srv)
+        return srv, f"http://127.0.0.1:{srv.server_address[1]}"
+
+    yield start
+    for srv in servers:
+        srv.shutdown()
+        srv.server_close()
+
+
+@pytest.fixture
+def pg_schema():
+    """Engine whose connections use a new, empty schema of BENCH_DATABASE_URL, dropped afterwards."""
+    url = os.getenv("BENCH_DATABASE_URL")
+    if not url:
+        pytest.skip("BENCH_DATABASE_URL not set")
+    from sqlalchemy import create_engine, event, text
+
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    engine = create_engine(url)
+
+    @event.listens_for(engine, "connect")
+    def _search_path(dbapi_conn, _):
+        with dbapi_conn.cursor() as cur:
+            cur.execute(f"SET search_path TO {schema}")
+
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    try:
+        yield engine
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        engine.dispose()
+
+
+@pytest.fixture
+def pg(pg_schema):
+    """pg_schema with every migration applied."""
+    from migrate import upgrade
+
+    with pg_schema.begin() as conn:
+        upgrade(conn, verbose=False)
+    return pg_schema
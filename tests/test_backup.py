@@ -0,0 +1,44 @@
+import pandas as pd
+from sqlalchemy import text
+
+import backup
+import load
+
+
+def rows(coin_id, start, hours):
+    return pd.DataFrame({
+        "coin_id": coin_id, "ts": pd.date_range(start, periods=hours, freq="h"),
+        "price_eur": 1.0, "market_cap": 1.0, "volume_24h": 1.0, "snapshot_id": "20250101T000000Z",
+    })
+
+
+def fingerprints(engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(text(backup.FINGERPRINTS_SQL)).fetchall())
+
+
+def test_fingerprints_follow_loads(pg):
+    with pg.begin() as conn:
+        load.load_history(conn, frames=[rows("bitcoin", "2025-01-31", 48)])  # January and February
+    first = fingerprints(pg)
+    assert sorted(first) == ["market_history_y2025m01", "market_history_y2025m02"]
+
+    # A load into February leaves January's fingerprint alone
+    with pg.begin() as conn:
+        load.load_history(conn, frames=[rows("bitcoin", "2025-02-10", 5)])
+    second = fingerprints(pg)
+    assert second["market_history_y2025m01"] == first["market_history_y2025m01"]
+    assert second["market_history_y2025m02"] != first["market_history_y2025m02"]
+
+    # A rolled-back load counts nothing
+    with pg.connect() as conn:
+        load.load_history(conn, frames=[rows("bitcoin", "2025-02-20", 5)])
+        conn.rollback()
+    assert fingerprints(pg) == second
+
+    # TRUNCATE bypasses load.py but replaces the relfilenode
+    with pg.begin() as conn:
+        conn.execute(text("TRUNCATE market_history_y2025m01"))
+    third = fingerprints(pg)
+    assert third["market_history_y2025m01"] != second["market_history_y2025m01"]
+    assert third["market_history_y2025m02"] == second["market_history_y2025m02"]
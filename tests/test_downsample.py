@@ -0,0 +1,69 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+import downsample
+
+HOUR = dt.timedelta(hours=1)
+DAY = dt.timedelta(days=1)
+
+
+def test_floor_to_rollup_bucket():
+    ts = dt.datetime(2025, 3, 4, 15, 42, 7)
+    assert downsample.floor_to(ts, HOUR) == dt.datetime(2025, 3, 4, 15)
+    assert downsample.floor_to(ts, DAY) == dt.datetime(2025, 3, 4)
+    assert downsample.floor_to(dt.datetime(2025, 3, 4), DAY) == dt.datetime(2025, 3, 4)
+    assert downsample.floor_to(ts, dt.timedelta(0)) == ts  # raw table: no buckets
+
+
+def test_range_starting_mid_bucket_reads_its_rollup_row():
+    # A month at ~720 points picks the hourly rollup: the 15:00 row holds 15:42
+    start, end = dt.datetime(2025, 3, 4, 15, 42), dt.datetime(2025, 4, 4)
+    granularity, table, *_ = downsample.pick_source((end - start) / 700)
+    assert table == "market_history_hourly"
+    assert downsample.floor_to(start, granularity) == dt.datetime(2025, 3, 4, 15)
+
+
+def test_lttb_keeps_endpoints_and_count():
+    rng = np.random.default_rng(0)
+    x = np.arange(10_000)
+    y = rng.normal(size=x.size).cumsum()
+    idx = downsample.lttb(x, y, 500)
+    assert len(idx) == 500
+    assert idx[0] == 0 and idx[-1] == x.size - 1
+    assert (np.diff(idx) > 0).all()
+
+
+def test_lttb_passes_small_series_through():
+    assert list(downsample.lttb([0, 1, 2], [1.0, 2.0, 3.0], 10)) == [0, 1, 2]
+    assert list(downsample.lttb(range(5), range(5), 2)) == [0, 1, 2, 3, 4]
+
+
+def test_lttb_keeps_a_spike():
+    y = np.zeros(1000)
+    y[637] = 50.0
+    assert 637 in downsample.lttb(np.arange(1000), y, 20)
+
+
+def test_lttb_frame_per_coin():
+    ts = pd.date_range("2025-01-01", periods=300, freq="h")
+    df = pd.DataFrame({
+        "coin_id": pd.Categorical(["bitcoin"] * 300 + ["ethereum"] * 2),
+        "ts": ts.append(ts[:2]),
+        "price_eur": np.r_[np.sin(np.arange(300) / 10), [1.0, np.nan]],
+    })
+    out = downsample.lttb_frame(df, 50)
+    assert out.groupby("coin_id", observed=True).size().to_dict() == {"bitcoin": 50, "ethereum": 1}
+    assert out["ts"].iloc[0] == ts[0] and out["ts"].iloc[49] == ts[-1]
+    assert downsample.lttb_frame(df.iloc[0:0], 50).empty
+
+
+def test_ohlc_frame_buckets():
+    ts = pd.date_range("2025-01-01", periods=48, freq="h")
+    df = pd.DataFrame({"coin_id": "bitcoin", "ts": ts, "price_eur": np.arange(48.0)})
+    out = downsample.ohlc_frame(df, ts[0], ts[-1] + pd.Timedelta(hours=1), n_points=4)
+    assert list(out["n_points"]) == [12] * 4
+    assert list(out["open"]) == [0.0, 12.0, 24.0, 36.0]
+    assert list(out["close"]) == [11.0, 23.0, 35.0, 47.0]
+    assert (out["high"] == out["close"]).all() and (out["low"] == out["open"]).all()
@@ -0,0 +1,98 @@
+import threading
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+import extract
+import metrics
+
+
+def fast_limiter():
+    return extract.TokenBucket(1000, capacity=100)
+
+
+def get_markets(url, limiter, **kwargs):
+    return extract.robust_get(f"{url}/coins/markets", {"per_page": 5}, base_wait=0.01, limiter=limiter, **kwargs)
+
+
+def test_retry_after_header():
+    class Resp:
+        def __init__(self, value):
+            self.headers = {"Retry-After": value} if value is not None else {}
+
+    assert extract.retry_after_seconds(Resp("3")) == 3
+    assert extract.retry_after_seconds(Resp(None)) is None
+    assert extract.retry_after_seconds(Resp("soon")) is None
+    assert 8 <= extract.retry_after_seconds(Resp(formatdate(time.time() + 10, usegmt=True))) <= 10
+
+
+def test_429_waits_retry_after(stub):
+    srv, url = stub(script=[429], retry_after=0.4)
+    before = metrics.snapshot()
+    rows = get_markets(url, fast_limiter())
+    assert len(rows) == 5
+    assert srv.stats["requests"] == 2
+    assert srv.times[1] - srv.times[0] >= 0.35  # the retry honoured Retry-After, not base_wait
+    assert metrics.delta(before, metrics.snapshot()).get("http_retries") == 1
+
+
+def test_429_pauses_every_thread(stub):
+    srv, url = stub(script=[429], retry_after=0.5)
+    limiter = fast_limiter()
+    worker = threading.Thread(target=get_markets, args=(url, limiter))
+    worker.start()
+    while not limiter.blocked_until:  # the worker got its 429 and paused the limiter
+        time.sleep(0.01)
+    # Another thread sharing the limiter waits out the same pause
+    t0 = time.monotonic()
+    get_markets(url, limiter)
+    worker.join()
+    assert time.monotonic() - t0 >= 0.3
+    assert min(srv.times[1:]) - srv.times[0] >= 0.45
+
+
+def test_5xx_and_dropped_connections_are_retried(stub):
+    srv, url = stub(script=[503, "drop", 500])
+    assert len(get_markets(url, fast_limiter())) == 5
+    assert srv.stats["requests"] == 4
+
+
+def test_gives_up_after_max_attempts(stub):
+    srv, url = stub(script=[503] * 3)
+    with pytest.raises(Exception, match="after 3 attempts"):
+        get_markets(url, fast_limiter(), max_attempts=3)
+    assert srv.stats["requests"] == 3
+
+
+def test_unreachable_server_raises_after_retries(stub):
+    srv, url = stub()
+    srv.shutdown()
+    srv.server_close()
+    with pytest.raises(Exception, match="after 2 attempts"):
+        get_markets(url, fast_limiter(), max_attempts=2)
+
+
+def test_client_errors_are_not_retried(stub):
+    srv, url = stub()
+    with pytest.raises(requests.HTTPError):
+        extract.robust_get(f"{url}/unknown", base_wait=0.01, limiter=fast_limiter())
+    assert srv.stats["requests"] == 1
+
+
+def test_token_bucket_rate(stub):
+    srv, url = stub()
+    limiter = extract.TokenBucket(20, capacity=2)
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=get_markets, args=(url, limiter)) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - t0
+    # A burst of 2, then one request every 1/20 s whatever the thread count
+    assert srv.stats["requests"] == 12
+    assert 0.45 <= elapsed < 2.0
+    window = [t for t in srv.times if t - srv.times[0] < 0.2]
+    assert len(window) <= 2 + 0.2 * 20 + 1
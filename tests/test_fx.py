@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+import fx
+
+T0 = pd.Timestamp("2025-01-01")
+
+
+def hours(*h):
+    return [T0 + pd.Timedelta(hours=x) for x in h]
+
+
+def rates():
+    return pd.DataFrame({
+        "currency": pd.Categorical(["usd", "usd", "usd", "btc"]),
+        "ts": hours(1, 3, 6, 0),
+        "rate": [1.10, 1.20, 1.30, 1e-5],
+    })
+
+
+def test_convert_takes_the_last_rate_at_or_before_each_row():
+    # Rows deliberately out of order, one before the first usd rate
+    df = pd.DataFrame({"coin_id": ["a", "b", "a", "b", "a"], "ts": hours(4, 0, 1, 7, 3),
+                       "price_eur": [10.0, 10.0, 10.0, 10.0, 10.0], "market_cap": [100.0] * 5})
+    out = fx.convert(df, rates(), "usd")
+    assert list(out["coin_id"]) == list(df["coin_id"]) and list(out["ts"]) == list(df["ts"])  # order kept
+    np.testing.assert_allclose(out["price_eur"], [12.0, np.nan, 11.0, 13.0, 12.0])
+    np.testing.assert_allclose(out["market_cap"], [120.0, np.nan, 110.0, 130.0, 120.0])
+    assert "volume_24h" not in out
+    assert df["price_eur"].tolist() == [10.0] * 5  # input untouched
+
+
+def test_convert_to_base_currency_is_identity():
+    df = pd.DataFrame({"ts": hours(0), "price_eur": [5.0]})
+    assert fx.convert(df, rates(), fx.BASE_CURRENCY) is df
+
+
+def test_quotes_long_frame():
+    df = pd.DataFrame({"coin_id": ["a", "a"], "ts": hours(2, 6), "price_eur": [2.0, 4.0]})
+    out = fx.quotes(df, rates(), currencies=["eur", "usd", "btc"])
+    assert list(out["currency"]) == ["eur", "eur", "usd", "usd", "btc", "btc"]
+    np.testing.assert_allclose(out["price"], [2.0, 4.0, 2.2, 5.2, 2e-5, 4e-5])
+
+
+def test_rates_frame_from_reference_charts():
+    ms = [int(t.timestamp() * 1000) for t in hours(0, 1, 2)]
+    base = {"prices": [[t, p] for t, p in zip(ms, [100.0, 200.0, 0.0])]}  # a zero price is dropped
+    usd = {"prices": [[t + 60_000, p] for t, p in zip(ms, [110.0, 240.0, 1.0])]}  # a minute off
+    out = fx.rates_frame(base, {"usd": usd}, currencies=["eur", "usd", fx.REFERENCE_SYMBOL])
+    usd_rates = out[out["currency"] == "usd"]
+    assert list(usd_rates["ts"]) == hours(0, 1)
+    np.testing.assert_allclose(usd_rates["rate"], [1.1, 1.2])
+    np.testing.assert_allclose(out.loc[out["currency"] == fx.REFERENCE_SYMBOL, "rate"], [0.01, 0.005])
+    assert fx.rates_frame({"prices": []}, {}).empty
@@ -0,0 +1,30 @@
+import pandas as pd
+from sqlalchemy import text
+
+from migrate import available, upgrade
+
+
+def test_upgrade_dedups_a_legacy_to_sql_database(pg_schema):
+    # Tables as the old to_sql loads left them: no keys, every run appended
+    history = pd.DataFrame({
+        "coin_id": ["bitcoin", "bitcoin", "bitcoin", "ethereum"],
+        "ts": pd.to_datetime(["2025-01-01 00:00", "2025-01-01 00:00", "2025-01-01 01:00", "2025-01-01 00:00"]),
+        "price_eur": [1.0, 2.0, 3.0, 4.0], "market_cap": 1.0, "volume_24h": 1.0,
+        "snapshot_id": ["20250101T000000Z", "20250102T000000Z", "20250101T000000Z", "20250101T000000Z"],
+    })
+    snapshots = pd.DataFrame({
+        "snapshot_id": ["20250101T000000Z"] * 3, "coin_id": ["bitcoin", "bitcoin", "ethereum"],
+        "price_eur": [1.0, 2.0, 4.0], "market_cap": 1.0, "volume_24h": 1.0, "rank": [1, 1, 2],
+        "last_updated": "2025-01-01T00:00:00.000Z",
+    })
+    with pg_schema.begin() as conn:
+        history.to_sql("market_history", conn, index=False)
+        snapshots.to_sql("market_snapshots", conn, index=False)
+
+    with pg_schema.begin() as conn:
+        assert upgrade(conn, verbose=False) == [v for v, _, _ in available()]
+    with pg_schema.connect() as conn:
+        hist = pd.read_sql(text("SELECT coin_id, ts, price_eur FROM market_history ORDER BY coin_id, ts"), conn)
+        snap = pd.read_sql(text("SELECT coin_id, price_eur FROM market_snapshots ORDER BY coin_id"), conn)
+    assert hist["price_eur"].tolist() == [2.0, 3.0, 4.0]  # the latest snapshot's row wins
+    assert snap["price_eur"].tolist() == [2.0, 4.0]       # the last inserted row wins
@@ -0,0 +1,42 @@
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+import db
+import extract
+import localstore
+import pipeline
+
+
+def table_counts(engine):
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT coin_id, count(*) FROM market_history GROUP BY coin_id")).fetchall()
+    return dict(rows)
+
+
+def local_counts():
+    return localstore.read_history(columns=[]).groupby("coin_id", observed=True).size().to_dict()
+
+
+def test_load_from_memory_keeps_the_local_store_complete(pg, stub, data_dir, monkeypatch):
+    _, url = stub()
+    monkeypatch.setattr(extract, "BASE_URL", url)
+    monkeypatch.setattr(extract.LIMITER, "rate", 1000.0)
+    monkeypatch.setattr(extract.LIMITER, "capacity", 100)
+    monkeypatch.setattr(db, "_engine", pg)
+    monkeypatch.setattr(localstore, "ENABLED", True)
+
+    # No --checkpoint: no processed run to mirror, the frames go to data/local/ themselves
+    report = ["--report", str(data_dir / "report.json")]
+    pipeline.main(["--top-n", "3", "--mode", "full", "--days", "3", *report])
+    assert not (data_dir / "processed" / "market_history").exists()
+    first = table_counts(pg)
+    assert len(first) == 3 and local_counts() == first
+
+    # The next run starts from the advanced watermarks; the store still has everything
+    time.sleep(1)  # snapshot ids (and part file names) have a one-second resolution
+    pipeline.main(["--top-n", "3", *report])
+    assert local_counts() == table_counts(pg)
+    snapshots = pd.read_parquet(data_dir / "local" / "market_snapshots")
+    assert snapshots["snapshot_id"].nunique() == 2
@@ -0,0 +1,89 @@
+import asyncio
+import gzip
+import json
+import threading
+import time
+
+import pandas as pd
+
+import readapi
+
+
+class FakeSource:
+    """In-memory source counting its queries; `version` is set by the test."""
+
+    name = "fake"
+
+    def __init__(self, delay=0.0):
+        self.version_value = 1
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def pool_stats(self):
+        return {"pool_size": 1, "connections": 0, "checked_out": 0}
+
+    def version(self):
+        return self.version_value
+
+    def coins(self):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls += 1
+        return pd.DataFrame({"coin_id": [f"coin-{i:05d}" for i in range(100)], "symbol": "c", "name": "Coin"})
+
+
+def respond(api, headers=None, **params):
+    return api.respond("/coins", dict(params), headers or {})
+
+
+def test_etag_depends_on_format_and_encoding():
+    async def scenario():
+        api = readapi.ReadApi(FakeSource(), pool_size=1, version_ttl=60)
+        status, _, plain, h_plain = await respond(api)
+        status_gz, _, body_gz, h_gz = await respond(api, {"accept-encoding": "gzip, deflate"})
+        _, _, _, h_arrow = await respond(api, format="arrow")
+        assert status == status_gz == 200
+        assert h_gz["Content-Encoding"] == "gzip" and "Content-Encoding" not in h_plain
+        assert gzip.decompress(body_gz) == plain
+        assert len({h_plain["ETag"], h_gz["ETag"], h_arrow["ETag"]}) == 3
+        assert h_plain["Vary"] == h_gz["Vary"] == "Accept-Encoding"
+
+        # A conditional request only matches the representation it was served
+        status, _, body, _ = await respond(api, {"if-none-match": h_gz["ETag"], "accept-encoding": "gzip"})
+        assert (status, body) == (304, b"")
+        status, _, body, _ = await respond(api, {"if-none-match": h_gz["ETag"]})
+        assert status == 200 and json.loads(body)[0]["coin_id"] == "coin-00000"
+        status, _, _, _ = await respond(api, {"if-none-match": f'"x", {h_plain["ETag"]}'})
+        assert status == 304
+
+    asyncio.run(scenario())
+
+
+def test_cache_is_kept_until_the_load_version_changes():
+    async def scenario():
+        source = FakeSource()
+        api = readapi.ReadApi(source, pool_size=1, version_ttl=0)
+        _, _, _, first = await respond(api)
+        await respond(api)
+        assert source.calls == 1
+
+        source.version_value = 2
+        _, _, _, second = await respond(api)
+        assert source.calls == 2
+        assert first["ETag"] != second["ETag"]
+        status, _, _, _ = await respond(api, {"if-none-match": first["ETag"]})
+        assert status == 200  # stale ETag
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_identical_requests_share_one_query():
+    async def scenario():
+        source = FakeSource(delay=0.2)
+        api = readapi.ReadApi(source, pool_size=4, version_ttl=60)
+        results = await asyncio.gather(*(respond(api) for _ in range(10)))
+        assert source.calls == 1
+        assert len({body for _, _, body, _ in results}) == 1
+
+    asyncio.run(scenario())
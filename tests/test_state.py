@@ -0,0 +1,56 @@
+import json
+
+import state
+
+
+def test_watermarks_start_empty(data_dir):
+    assert state.read_watermarks() == {}
+    assert not (data_dir / "state").exists()  # reading never creates state
+
+
+def test_watermarks_never_move_backwards(data_dir):
+    assert state.write_watermarks({"bitcoin": 2000, "ethereum": 1000}) == {"bitcoin": 2000, "ethereum": 1000}
+    # Older, missing (None) and new coins in one update: only forward moves are kept
+    state.write_watermarks({"bitcoin": 1500, "ethereum": None, "solana": 10})
+    assert state.read_watermarks() == {"bitcoin": 2000, "ethereum": 1000, "solana": 10}
+    state.write_watermarks({"ethereum": "3000"})
+    assert state.read_watermarks()["ethereum"] == 3000
+    assert json.loads((data_dir / "state" / "watermarks.json").read_text())["bitcoin"] == 2000
+
+
+def test_stream_watermarks_are_kept_apart(data_dir):
+    state.write_watermarks({"bitcoin": 1000})
+    state.write_watermarks({"bitcoin": 5000}, state.STREAM_WATERMARKS_FILE)
+    assert state.read_watermarks() == {"bitcoin": 1000}
+    assert state.read_watermarks(state.STREAM_WATERMARKS_FILE) == {"bitcoin": 5000}
+
+
+def test_write_json_leaves_no_temp_files(data_dir):
+    path = data_dir / "state" / "x.json"
+    state.write_json(path, {"a": 1})
+    state.write_json(path, {"a": 2})
+    assert state.read_json(path) == {"a": 2}
+    assert [p.name for p in path.parent.iterdir()] == ["x.json"]
+
+
+def test_manifest_runs_from_transformed_to_loaded(data_dir):
+    assert state.read_manifest() == {"snapshots": {}, "runs": {}}
+    state.record_transformed("20250102T000000Z_from_20250101T000000Z", ["20250101T000000Z", "20250102T000000Z"],
+                             {"market_history": ["a.parquet"]})
+    state.record_transformed("20250103T000000Z", ["20250103T000000Z"], {"market_history": ["b.parquet"]})
+    manifest = state.read_manifest()
+    assert manifest["snapshots"] == {"20250101T000000Z": "20250102T000000Z_from_20250101T000000Z",
+                                     "20250102T000000Z": "20250102T000000Z_from_20250101T000000Z",
+                                     "20250103T000000Z": "20250103T000000Z"}
+    # Pending oldest first, until marked loaded
+    assert [r for r, _ in state.pending_runs()] == ["20250102T000000Z_from_20250101T000000Z", "20250103T000000Z"]
+    state.mark_loaded(["20250102T000000Z_from_20250101T000000Z"])
+    assert [(r, info["files"]) for r, info in state.pending_runs()] == [
+        ("20250103T000000Z", {"market_history": ["b.parquet"]})]
+    state.mark_loaded(["20250103T000000Z"])
+    assert state.pending_runs() == []
+
+    # Re-transforming a run resets it to pending
+    state.record_transformed("20250103T000000Z", ["20250103T000000Z"], {"market_history": ["c.parquet"]})
+    assert [(r, info["loaded"]) for r, info in state.pending_runs()] == [("20250103T000000Z", False)]
+    assert len(state.read_manifest()["runs"]) == 2
@@ -0,0 +1,106 @@
+import queue
+import threading
+import time
+
+import pandas as pd
+
+import stream
+from state import STREAM_SUFFIX
+
+
+class RecordingSink:
+    """Fake sink: remembers the history rows of every flush, optionally slowly."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    def __call__(self, coins, snaps, hist):
+        time.sleep(self.delay)
+        self.batches.append(hist)
+        return len(hist)
+
+    @property
+    def rows(self):
+        return sum(len(b) for b in self.batches)
+
+
+def polls(n, top_n=5):
+    """Transformed items of n FakeProducer polls, one second apart."""
+    producer, last_ts = stream.FakeProducer(top_n), {}
+    items = []
+    for i in range(n):
+        markets = producer()
+        for m in markets:
+            m["last_updated"] = (pd.Timestamp("2025-01-01", tz="UTC") + pd.Timedelta(seconds=i)).isoformat()
+        frames = stream.transform_markets(markets, f"20250101T0000{i:02d}Z{STREAM_SUFFIX}", last_ts)
+        items.append((time.time(), *frames))
+    return items
+
+
+def drive(items, writer, stop=None):
+    """Feed items then STOP through write_loop; returns when it exits."""
+    q = queue.Queue()
+    for item in items:
+        q.put(item)
+    q.put(stream.STOP)
+    stream.write_loop(q, writer, stop or threading.Event())
+
+
+def test_transform_markets_keeps_only_moved_coins():
+    producer, last_ts = stream.FakeProducer(3), {}
+    markets = producer()
+    coins, snaps, hist = stream.transform_markets(markets, "20250101T000000Z-live", last_ts)
+    assert len(coins) == len(snaps) == len(hist) == 3
+    assert hist["coin_id"].dtype == "category"
+    assert stream.transform_markets(markets, "20250101T000001Z-live", last_ts) is None
+
+    markets[1]["last_updated"] = (pd.Timestamp(markets[1]["last_updated"]) + pd.Timedelta(seconds=1)).isoformat()
+    _, _, hist = stream.transform_markets(markets, "20250101T000002Z-live", last_ts)
+    assert list(hist["coin_id"]) == [markets[1]["id"]]
+
+
+def test_writer_flushes_at_batch_rows():
+    sink = RecordingSink()
+    drive(polls(10, top_n=5), stream.BatchWriter(sink, max_rows=20, max_age=60))
+    # 5 rows per poll: full batches of 20 rows, the rest flushed at STOP
+    assert [len(b) for b in sink.batches] == [20, 20, 10]
+    assert not pd.concat(sink.batches).duplicated(["coin_id", "ts"]).any()
+
+
+def test_writer_flushes_on_timeout():
+    sink = RecordingSink()
+    writer = stream.BatchWriter(sink, max_rows=10_000, max_age=0.2)
+    q = queue.Queue()
+    t = threading.Thread(target=stream.write_loop, args=(q, writer, threading.Event()))
+    t.start()
+    try:
+        q.put(polls(1)[0])
+        deadline = time.monotonic() + 5
+        while not sink.batches and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert [len(b) for b in sink.batches] == [5]  # flushed by age, before any STOP
+    finally:
+        q.put(stream.STOP)
+        t.join()
+    assert len(sink.batches) == 1  # nothing left to flush at STOP
+
+
+def test_run_drains_everything_at_shutdown(data_dir):
+    sink = RecordingSink()
+    stats = stream.run(stream.FakeProducer(4), sink, interval=0.05, max_rows=10_000, max_age=60, duration=0.5)
+    # No flush was due before stop: every polled row is written by the final drain
+    assert stats["polls"] > 1
+    assert stats["rows"] == sink.rows == 4 * stats["polls"]
+    assert len(sink.batches) == 1
+
+
+def test_slow_sink_blocks_the_poller(data_dir):
+    sink = RecordingSink(delay=0.3)
+    stats = stream.run(stream.FakeProducer(2), sink, interval=0, max_rows=1, max_age=60,
+                       queue_size=1, duration=1.0)
+    # Bounded queues: the poller waited instead of racing ahead of the writer...
+    assert stats["blocked_s"] > 0
+    assert stats["polls"] <= len(sink.batches) + 4  # at most one item per queue/thread in flight
+    # ...and nothing it did poll was lost
+    assert stats["rows"] == sink.rows == 2 * stats["polls"]
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import analytics
+import db
+import load
+import stream
+import summary
+from state import STREAM_SUFFIX
+
+T0 = pd.Timestamp("2025-01-01")
+
+
+def history(coin_hours, level=1e9, seed=0):
+    """market_history rows, hourly: {coin_id: range of hours}. A large level with small moves."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for coin_id, hours in coin_hours.items():
+        hours = np.asarray(hours)
+        frames.append(pd.DataFrame({
+            "coin_id": coin_id, "ts": T0 + pd.to_timedelta(hours, unit="h"),
+            "price_eur": level + rng.normal(scale=0.5, size=len(hours)).cumsum(),
+            "market_cap": 1.0, "volume_24h": 1.0, "snapshot_id": "20250101T000000Z",
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def price_stats(conn):
+    return pd.read_sql(text("""
+        SELECT coin_id, n, mean, m2, min_price, max_price, start_date, end_date, last_ts
+        FROM price_stats ORDER BY coin_id
+    """), conn, index_col="coin_id")
+
+
+def assert_same_stats(a, b):
+    pd.testing.assert_index_equal(a.index, b.index)
+    for col in ("n", "min_price", "max_price", "start_date", "end_date", "last_ts"):
+        pd.testing.assert_series_equal(a[col], b[col], check_exact=True)
+    np.testing.assert_allclose(a["mean"], b["mean"], rtol=1e-15)
+    np.testing.assert_allclose(a["m2"], b["m2"], rtol=1e-6)
+
+
+def test_incremental_refresh_matches_full(pg):
+    loads = [
+        history({"bitcoin": range(0, 100), "ethereum": range(0, 40)}, seed=1),
+        history({"bitcoin": range(100, 103), "ethereum": range(40, 200), "solana": range(0, 10)}, seed=2),
+        history({"bitcoin": range(103, 104)}, seed=3),  # a single new row
+    ]
+    everything = pd.concat(loads, ignore_index=True)
+    with pg.begin() as conn:
+        for df in loads:
+            load.load_history(conn, frames=[df])
+            summary.refresh_stats(conn)
+        incremental = price_stats(conn)
+        assert summary.refresh_stats(conn) == 0  # nothing new to fold
+        summary.refresh_stats(conn, full=True)
+        full = price_stats(conn)
+
+    assert_same_stats(incremental, full)
+    # ...and both are the one-pass statistics (sample variance like pandas)
+    expected = everything.groupby("coin_id")["price_eur"].agg(["count", "mean", "var"])
+    np.testing.assert_array_equal(full["n"], expected["count"])
+    np.testing.assert_allclose(full["mean"], expected["mean"], rtol=1e-15)
+    np.testing.assert_allclose(full["m2"] / (full["n"] - 1), expected["var"], rtol=1e-6)
+
+
+def test_streamed_tick_before_backfill(pg, data_dir, monkeypatch):
+    monkeypatch.setattr(db, "_engine", pg)
+    sink = stream.postgres_sink()
+    with pg.begin() as conn:
+        load.load_history(conn, frames=[history({"bitcoin": range(0, 24)}, seed=1)])
+        summary.refresh_stats(conn)
+
+    # The stream writes a tick hours ahead of the batch watermark...
+    tick = T0 + pd.Timedelta(hours=30, minutes=15)
+    markets = [{"id": "bitcoin", "symbol": "btc", "name": "Bitcoin", "current_price": 1e9, "market_cap": 1.0,
+                "total_volume": 1.0, "market_cap_rank": 1, "last_updated": tick.isoformat() + "Z"}]
+    sink(*stream.transform_markets(markets, "20250102T061500Z" + STREAM_SUFFIX, {}))
+    with pg.begin() as conn:
+        summary.refresh_stats(conn)
+        stats = price_stats(conn)
+    assert stats.loc["bitcoin", "n"] == 24  # not folded yet: the hours before it are missing
+    assert stats.loc["bitcoin", "last_ts"] == T0 + pd.Timedelta(hours=23)
+
+    # ...then batch loads fill the hours before it (the watermark moves, still short
+    # of the tick), and after it
+    with pg.begin() as conn:
+        for seed, hours in enumerate([range(24, 30), range(30, 48)], 2):
+            load.load_history(conn, frames=[history({"bitcoin": hours}, seed=seed)])
+            summary.refresh_stats(conn)
+        incremental = price_stats(conn)
+        summary.refresh_stats(conn, full=True)
+        full = price_stats(conn)
+    assert incremental.loc["bitcoin", "n"] == 48 + 1
+    assert_same_stats(incremental, full)
+
+
+def test_moments_table_matches_pandas():
+    prices = {"bitcoin": [10.0, 12.0, 11.0, 15.0], "ethereum": [2.0]}
+    rows = []
+    for coin_id, values in prices.items():
+        x = np.asarray(values)
+        rows.append({"coin_id": coin_id, "n": len(x), "mean": x.mean(), "m2": ((x - x.mean()) ** 2).sum(),
+                     "min_price": x.min(), "max_price": x.max(),
+                     "start_date": pd.Timestamp("2025-01-01"), "end_date": pd.Timestamp("2025-01-02")})
+    stats = analytics.moments_table(pd.DataFrame(rows).set_index("coin_id"))
+    btc = pd.Series(prices["bitcoin"])
+    assert np.isclose(stats.loc["bitcoin", "variance"], btc.var())
+    assert np.isclose(stats.loc["bitcoin", "rel_volatility_pct"], btc.std() / btc.mean() * 100)
+    assert stats.loc["bitcoin", "pct_growth"] == 50.0
+    assert np.isnan(stats.loc["ethereum", "variance"])  # sample variance of one point
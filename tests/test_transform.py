@@ -0,0 +1,72 @@
+import pandas as pd
+import pyarrow.parquet as pq
+
+import transform
+from state import read_manifest
+
+DAY_MS = 24 * 3_600_000
+
+
+def history_rows(data_dir, run_id):
+    files = read_manifest()["runs"][run_id]["files"]["market_history"]
+    return pd.concat([pq.read_table(data_dir / "processed" / f).to_pandas() for f in files], ignore_index=True)
+
+
+def test_run_name():
+    assert transform.run_name(["20250101T000000Z"]) == "20250101T000000Z"
+    assert transform.run_name(["20250101T000000Z-s0of2", "20250101T000000Z-s1of2"]) == "20250101T000000Z-s1of2"
+    assert transform.run_name(["20250101T000000Z", "20250102T000000Z"]) == "20250102T000000Z_from_20250101T000000Z"
+
+
+def test_backlog_then_default_run_keeps_every_snapshot(data_dir, raw_snapshot):
+    raw_snapshot("20250101T000000Z", {"bitcoin": [1.0] * 48, "ethereum": [2.0] * 48})
+    raw_snapshot("20250102T000000Z", {"bitcoin": [3.0] * 48, "ethereum": [4.0] * 48}, start_ms=DAY_MS)
+
+    transform.main(["--backlog", "--workers", "1"])
+    manifest = read_manifest()
+    batch = "20250102T000000Z_from_20250101T000000Z"
+    assert list(manifest["runs"]) == [batch]
+    assert set(manifest["snapshots"].values()) == {batch}
+    hist = history_rows(data_dir, batch)
+    assert len(hist) == 2 * 72  # 48 + 48 hourly points overlapping by 24, per coin
+    assert not hist.duplicated(["coin_id", "ts"]).any()
+
+    # The default mode finds the newest snapshot already transformed and leaves the batch alone
+    transform.main([])
+    assert read_manifest() == manifest
+    assert len(history_rows(data_dir, batch)) == 2 * 72
+    assert transform.pending_snapshots() == []
+
+    # A new snapshot gets a run of its own
+    raw_snapshot("20250103T000000Z", {"bitcoin": [5.0] * 24, "ethereum": [6.0] * 24}, start_ms=3 * DAY_MS)
+    transform.main([])
+    runs = read_manifest()["runs"]
+    assert sorted(runs) == [batch, "20250103T000000Z"]
+    assert len(history_rows(data_dir, batch)) == 2 * 72
+    assert len(history_rows(data_dir, "20250103T000000Z")) == 2 * 24
+
+
+def history(coin_hours):
+    """History frame with hourly points: {coin_id: (first hour, last hour)}."""
+    rows = [(coin, pd.Timestamp("2025-01-01") + pd.Timedelta(hours=h), float(h))
+            for coin, (lo, hi) in coin_hours.items() for h in range(lo, hi + 1)]
+    df = pd.DataFrame(rows, columns=["coin_id", "ts", "price_eur"])
+    return df.astype({"coin_id": "category"})
+
+
+def test_dedup_history_overlapping_windows():
+    frames = [
+        history({"bitcoin": (0, 47), "ethereum": (0, 47)}),
+        history({"bitcoin": (24, 71), "ethereum": (40, 50)}),  # overlaps both coins' windows
+        history({"bitcoin": (10, 20)}),                         # entirely inside what was written
+        history({"bitcoin": (70, 80), "solana": (0, 5)}),       # a coin seen for the first time
+    ]
+    out = list(transform.dedup_history(iter(frames)))
+    assert len(out) == 3  # the fully covered frame is skipped
+    hist = pd.concat([df.astype({"coin_id": object}) for df in out], ignore_index=True)
+    assert not hist.duplicated(["coin_id", "ts"]).any()
+    counts = hist.groupby("coin_id").size().to_dict()
+    assert counts == {"bitcoin": 81, "ethereum": 51, "solana": 6}
+    # The first window to cover a point is the one written
+    assert len(out[1]) == (71 - 47) + (50 - 47)
+    assert out[1]["ts"].min() == pd.Timestamp("2025-01-01") + pd.Timedelta(hours=48)